@@ -2,25 +2,53 @@
 # To get started, simply uncomment the below code or create your own.
 # Deploy with `firebase deploy`
 
+import atexit
+import contextlib
+import contextvars
+import functools
+import gzip
 import hashlib
+import ipaddress
 import json
 import logging
 import os
+import random
 import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta, date
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, TypedDict, get_type_hints
 from zoneinfo import ZoneInfo
 
+# Module load time is reported with each instance's first request (see _serve).
+_MODULE_LOAD_STARTED = time.perf_counter()
+
+# firebase_functions already pulls in requests and the firebase_admin auth and
+# Firestore modules. openai and Cloud Storage are imported on the code paths
+# that use them, so booking endpoints never pay for them.
 import firebase_admin
 import requests
-from openai import OpenAI
 from firebase_admin import auth, firestore
-from firebase_functions import https_fn
-from firebase_functions.options import set_global_options
-from dotenv import load_dotenv
+from firebase_functions import firestore_fn, https_fn, scheduler_fn
+from firebase_functions.options import MemoryOption, set_global_options
+from google.api_core.exceptions import Conflict, FailedPrecondition
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env for local runs. Deployed functions (and
+# the emulator) get functions/.env from the Firebase CLI, so skip the lookup.
+if not os.getenv("K_SERVICE"):
+    from dotenv import load_dotenv
+
+    load_dotenv()
 
 # Configure logging for clearer Cloud Functions console output.
 logger = logging.getLogger(__name__)
@@ -34,21 +62,33 @@ if not logger.handlers:
 # parameter in the decorator, e.g. @https_fn.on_request(max_instances=5).
 set_global_options(max_instances=10)
 
-# Lazy init, but always initialize when first used
+# This project uses a non-default Firestore database id (see firebase.json).
+FIRESTORE_DATABASE_ID = os.getenv("FIRESTORE_DATABASE_ID", "actuelbackend12")
+
+# Lazy init, but always initialize when first used. Instances serve several
+# requests at once, so the first ones may race here; the lock makes exactly one
+# of them initialize.
+_firebase_init_lock = threading.Lock()
 firebase_app = None
 db = None
 
 
+def _init_firebase_app():
+    global firebase_app
+    if firebase_app is None:
+        try:
+            firebase_app = firebase_admin.get_app()
+        except ValueError:
+            firebase_app = firebase_admin.initialize_app()
+    return firebase_app
+
+
 def ensure_firebase_app():
     """Ensure Firebase app is initialized at first use."""
-    global firebase_app
     if firebase_app is not None:
         return firebase_app
-    try:
-        firebase_app = firebase_admin.get_app()
-    except ValueError:
-        firebase_app = firebase_admin.initialize_app()
-    return firebase_app
+    with _firebase_init_lock:
+        return _init_firebase_app()
 
 
 def get_db():
@@ -56,27 +96,1070 @@ def get_db():
     global db
     if db is not None:
         return db
-    app = ensure_firebase_app()
-    # This project uses a non-default Firestore database id (see firebase.json).
-    database_id = os.getenv("FIRESTORE_DATABASE_ID", "actuelbackend12")
-    db = firestore.client(database_id=database_id, app=app)
+    with _firebase_init_lock:
+        if db is None:
+            client = firestore.client(database_id=FIRESTORE_DATABASE_ID, app=_init_firebase_app())
+            _trace_firestore_client(client)
+            db = client
     return db
 
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        logger.warning("Invalid integer for %s; using %s", name, default)
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        logger.warning("Invalid number for %s; using %s", name, default)
+        return default
+
+
+# Structured event logging. _log_event writes one "event {json}" line and
+# samples INFO events per name (LOG_SAMPLE_RATES, JSON of event -> rate, over
+# the defaults below). Sampled lines carry sampleRate so counts can be scaled
+# back up. Warnings and errors are never sampled. Formatting is lazy: nothing
+# is redacted, truncated or serialized unless the line is actually emitted,
+# and callable field values are only called then. Fields named in
+# LOG_REDACT_KEYS hold patient text or contact details; only their length is
+# logged unless LOG_PATIENT_TEXT is set for local debugging. Other strings
+# are cut to LOG_MAX_FIELD_CHARS, and lists and dicts to LOG_MAX_ITEMS items
+# except under LOG_UNCAPPED_KEYS: request_trace spans are named in code, so
+# their number is bounded already and the trace is only useful whole.
+LOG_MAX_FIELD_CHARS = _env_int("LOG_MAX_FIELD_CHARS", 200)
+LOG_MAX_ITEMS = _env_int("LOG_MAX_ITEMS", 20)
+LOG_UNCAPPED_KEYS = frozenset({"spans"})
+LOG_PATIENT_TEXT = os.getenv("LOG_PATIENT_TEXT", "").strip().lower() in ("1", "true", "yes")
+LOG_REDACT_KEYS = frozenset(
+    key.strip().lower()
+    for key in os.getenv(
+        "LOG_REDACT_KEYS",
+        "prompt,output,message,text,content,summary,notes,email,phone,firstName,lastName,fullName",
+    ).split(",")
+    if key.strip()
+)
+_DEFAULT_LOG_SAMPLE_RATES = {
+    "public_response": 0.05,
+    "public_services": 0.1,
+    "availability": 0.1,
+}
+
+
+def _load_log_sample_rates() -> Dict[str, float]:
+    rates = dict(_DEFAULT_LOG_SAMPLE_RATES)
+    raw = os.getenv("LOG_SAMPLE_RATES", "").strip()
+    if not raw:
+        return rates
+    try:
+        overrides = json.loads(raw)
+        rates.update({str(event): min(max(float(rate), 0.0), 1.0) for event, rate in overrides.items()})
+    except (AttributeError, TypeError, ValueError):
+        logger.warning("Invalid LOG_SAMPLE_RATES; using the defaults", exc_info=True)
+    return rates
+
+
+LOG_SAMPLE_RATES = _load_log_sample_rates()
+
+
+def _log_safe(value: Any, key: str = "", depth: int = 0) -> Any:
+    """Redact, truncate and bound a log field so it serializes to a small JSON value."""
+    if callable(value):
+        value = value()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if key.lower() in LOG_REDACT_KEYS and not LOG_PATIENT_TEXT:
+        size = len(value) if isinstance(value, (str, list, dict)) else len(str(value))
+        return f"<redacted {size} chars>" if isinstance(value, str) else f"<redacted {size} items>"
+    if isinstance(value, dict):
+        if depth >= 3:
+            return f"<{len(value)} keys>"
+        items = list(value.items())
+        limit = len(items) if key in LOG_UNCAPPED_KEYS else LOG_MAX_ITEMS
+        safe = {str(k): _log_safe(v, str(k), depth + 1) for k, v in items[:limit]}
+        if len(items) > limit:
+            safe["..."] = len(items) - limit
+        return safe
+    if isinstance(value, (list, tuple, set)):
+        items = list(value)
+        if depth >= 3:
+            return f"<{len(items)} items>"
+        safe = [_log_safe(v, key, depth + 1) for v in items[:LOG_MAX_ITEMS]]
+        if len(items) > LOG_MAX_ITEMS:
+            safe.append(f"... +{len(items) - LOG_MAX_ITEMS}")
+        return safe
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > LOG_MAX_FIELD_CHARS:
+        return f"{text[:LOG_MAX_FIELD_CHARS]}... +{len(text) - LOG_MAX_FIELD_CHARS} chars"
+    return text
+
+
+class _LogFields:
+    """Event fields rendered as JSON only when the logging handler formats the record."""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields: Dict[str, Any]):
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return _json_dumps({key: _log_safe(value, key) for key, value in self.fields.items()}).decode("utf-8")
+
+
+def _log_event(event: str, level: int = logging.INFO, **fields: Any) -> None:
+    """Log ``event {json}``, sampled per event name below WARNING."""
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING:
+        rate = LOG_SAMPLE_RATES.get(event, 1.0)
+        if rate < 1.0:
+            if random.random() >= rate:
+                return
+            fields["sampleRate"] = rate
+    logger.log(level, "%s %s", event, _LogFields(fields))
+
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_TRANSCRIBE_URL = "https://api.openai.com/v1/audio/transcriptions"
+OPENAI_TRANSCRIBE_URL = os.getenv(
+    "OPENAI_TRANSCRIBE_URL", "https://api.openai.com/v1/audio/transcriptions"
+)
 DEFAULT_TRANSCRIBE_MODEL = os.getenv("OPENAI_TRANSCRIBE_MODEL", "gpt-4o-mini-transcribe")
 REQUEST_TIMEOUT_SECONDS = 60
 
+# Shared upstream clients. Connection pools are per process, so keep-alive
+# connections are reused across requests served by the same instance.
+OPENAI_TIMEOUT_SECONDS = _env_float("OPENAI_TIMEOUT_SECONDS", 60.0)
+OPENAI_CONNECT_TIMEOUT_SECONDS = _env_float("OPENAI_CONNECT_TIMEOUT_SECONDS", 5.0)
+# SDK-level retries stay off by default; _call_upstream owns retry policy.
+OPENAI_MAX_RETRIES = _env_int("OPENAI_MAX_RETRIES", 0)
+HTTP_POOL_MAXSIZE = _env_int("HTTP_POOL_MAXSIZE", 40)
+HTTP_KEEPALIVE_CONNECTIONS = _env_int("HTTP_KEEPALIVE_CONNECTIONS", 10)
+# requests caches one connection pool per upstream host; we only talk to a
+# handful of hosts, each pool holding up to HTTP_POOL_MAXSIZE connections.
+HTTP_POOL_HOSTS = _env_int("HTTP_POOL_HOSTS", 4)
+HTTP_KEEPALIVE_EXPIRY_SECONDS = _env_float("HTTP_KEEPALIVE_EXPIRY_SECONDS", 60.0)
+IO_POOL_MAXSIZE = _env_int("IO_POOL_MAXSIZE", 32)
+# LLM fan-out gets its own pool so slow completions cannot queue ahead of
+# the Firestore reads served by the io pool.
+LLM_POOL_MAXSIZE = _env_int("LLM_POOL_MAXSIZE", 12)
+
+# Requests one instance serves at once. Most endpoints spend their time
+# waiting on Firestore or OpenAI, so they take many requests per instance
+# rather than scaling out to one instance per request; transcription stays at
+# one because uploads and ffmpeg work are held in memory. Concurrency above 1
+# needs a whole CPU (the global default is the fractional gcf_gen1 size). The
+# functions framework serves requests from THREADS gunicorn threads, read after
+# this module is imported; each deployed function sets THREADS to its own
+# concurrency at the end of the module unless it is set explicitly. The pools
+# above are shared by all of an instance's requests. api also routes the
+# transcription handlers, so it gets transcription-sized memory and runs at
+# most API_TRANSCRIBE_CONCURRENCY uploads at once; an upload that cannot start
+# within API_TRANSCRIBE_WAIT_SECONDS gets a 503 with Retry-After.
+HTTP_CONCURRENCY_PUBLIC = _env_int("HTTP_CONCURRENCY_PUBLIC", 40)
+HTTP_CONCURRENCY_LLM = _env_int("HTTP_CONCURRENCY_LLM", 20)
+HTTP_CONCURRENCY_API = _env_int("HTTP_CONCURRENCY_API", 8)
+HTTP_CONCURRENCY_TRANSCRIBE = _env_int("HTTP_CONCURRENCY_TRANSCRIBE", 1)
+API_TRANSCRIBE_CONCURRENCY = _env_int("API_TRANSCRIBE_CONCURRENCY", 2)
+API_TRANSCRIBE_WAIT_SECONDS = _env_float("API_TRANSCRIBE_WAIT_SECONDS", 10.0)
+
+_function_concurrency: Dict[str, int] = {}
+
+
+def _concurrency_options(function: str, concurrency: int) -> Dict[str, Any]:
+    """on_request options for serving up to ``concurrency`` requests per instance."""
+    concurrency = min(max(concurrency, 1), 1000)
+    _function_concurrency[function] = concurrency
+    if concurrency == 1:
+        return {}
+    return {"concurrency": concurrency, "cpu": 1}
+
+# Shared aiChats history: older turns are folded into a rolling summary stored
+# on the aiChats/shared document; requests only load the summary + recent delta.
+CHAT_HISTORY_TOKEN_BUDGET = _env_int("CHAT_HISTORY_TOKEN_BUDGET", 2500)
+CHAT_COMPACT_TRIGGER_MESSAGES = _env_int("CHAT_COMPACT_TRIGGER_MESSAGES", 16)
+CHAT_COMPACT_KEEP_RECENT = _env_int("CHAT_COMPACT_KEEP_RECENT", 8)
+CHAT_SUMMARY_MAX_CHARS = _env_int("CHAT_SUMMARY_MAX_CHARS", 4000)
+# A fold leases the shared document first, so the user and assistant writes of
+# one turn (each a trigger) cause a single model call. Outlives the LLM timeout.
+CHAT_COMPACT_LEASE_SECONDS = _env_int("CHAT_COMPACT_LEASE_SECONDS", 120)
+
+# Prompt token budgets (see PromptBuilder). Totals include the system prompt.
+PROMPT_TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER_ENCODING", "o200k_base")
+PROMPT_MIN_ITEM_TOKENS = 24
+AGENT_CHAT_PROMPT_BUDGET = _env_int("AGENT_CHAT_PROMPT_BUDGET", 7000)
+AGENT_CLIENT_TOKEN_BUDGET = _env_int("AGENT_CLIENT_TOKEN_BUDGET", 300)
+AGENT_JOURNAL_TOKEN_BUDGET = _env_int("AGENT_JOURNAL_TOKEN_BUDGET", 1200)
+AGENT_JOURNAL_ITEM_TOKENS = _env_int("AGENT_JOURNAL_ITEM_TOKENS", 400)
+AGENT_SUMMARY_TOKEN_BUDGET = _env_int("AGENT_SUMMARY_TOKEN_BUDGET", 1000)
+AGENT_HISTORY_ITEM_TOKENS = _env_int("AGENT_HISTORY_ITEM_TOKENS", 300)
+AGENT_DRAFT_TOKEN_BUDGET = _env_int("AGENT_DRAFT_TOKEN_BUDGET", 1500)
+SUMMARIZE_PROMPT_BUDGET = _env_int("SUMMARIZE_PROMPT_BUDGET", 8000)
+SUMMARIZE_ENTRY_TOKENS = _env_int("SUMMARIZE_ENTRY_TOKENS", 1500)
+SUGGEST_SUMMARY_TOKEN_BUDGET = _env_int("SUGGEST_SUMMARY_TOKEN_BUDGET", 800)
+COMPLETION_PROMPT_BUDGET = _env_int("COMPLETION_PROMPT_BUDGET", 16000)
+CHAT_COMPACT_INPUT_BUDGET = _env_int("CHAT_COMPACT_INPUT_BUDGET", 6000)
+
+# Nightly precompute of journal summaries for the next day's appointments.
+CASELOAD_SUMMARY_SCHEDULE = os.getenv("CASELOAD_SUMMARY_SCHEDULE", "0 18 * * *")
+CASELOAD_SUMMARY_CONCURRENCY = _env_int("CASELOAD_SUMMARY_CONCURRENCY", 4)
+CASELOAD_SUMMARY_MAX_PER_MINUTE = _env_int("CASELOAD_SUMMARY_MAX_PER_MINUTE", 60)
+CASELOAD_SUMMARY_MAX_ATTEMPTS = max(_env_int("CASELOAD_SUMMARY_MAX_ATTEMPTS", 4), 1)
+
+_client_init_lock = threading.Lock()
+openai_client = None
+http_session = None
+io_executor = None
+llm_executor = None
+
+
+def get_openai_client() -> "OpenAI":
+    """Get the shared OpenAI client lazily."""
+    global openai_client
+    if openai_client is not None:
+        return openai_client
+    with _client_init_lock:
+        if openai_client is None:
+            import httpx
+            from openai import DefaultHttpxClient, OpenAI
+
+            timeout = httpx.Timeout(
+                OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS
+            )
+            http_client = DefaultHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_MAXSIZE,
+                    max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+                ),
+                timeout=timeout,
+            )
+            openai_client = OpenAI(
+                api_key=OPENAI_API_KEY,
+                http_client=http_client,
+                timeout=timeout,
+                max_retries=OPENAI_MAX_RETRIES,
+            )
+    return openai_client
+
+
+def get_http_session() -> requests.Session:
+    """Get the shared requests session (used for raw multipart uploads) lazily."""
+    global http_session
+    if http_session is not None:
+        return http_session
+    with _client_init_lock:
+        if http_session is None:
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_HOSTS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            http_session = session
+    return http_session
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """Get the shared thread pool used to overlap blocking Firestore/HTTP calls."""
+    global io_executor
+    if io_executor is not None:
+        return io_executor
+    with _client_init_lock:
+        if io_executor is None:
+            io_executor = ThreadPoolExecutor(
+                max_workers=IO_POOL_MAXSIZE, thread_name_prefix="io"
+            )
+    return io_executor
+
+
+def get_llm_executor() -> ThreadPoolExecutor:
+    """Get the bounded thread pool used to fan out LLM completions."""
+    global llm_executor
+    if llm_executor is not None:
+        return llm_executor
+    with _client_init_lock:
+        if llm_executor is None:
+            llm_executor = ThreadPoolExecutor(
+                max_workers=LLM_POOL_MAXSIZE, thread_name_prefix="llm"
+            )
+    return llm_executor
+
+
+class _TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max(max_entries, 1)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl_seconds: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "size": len(self._data),
+            }
+
+
+def _timed_call(fn, *args, **kwargs) -> tuple[Any, float]:
+    """Run fn and return (result, elapsed milliseconds)."""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+# Per-request tracing. _serve opens a trace for each HTTP request; spans time
+# named blocks (Firestore reads and writes, upstream HTTP/LLM calls, ffmpeg)
+# and nest by name ("clinic/firestore.get"). Every Firestore RPC is traced
+# where the client sends it, with document reads and writes counted. The
+# request then logs one request_trace JSON line, and top-level spans are
+# returned in a Server-Timing header. Work handed to other threads joins the
+# trace only through _submit_traced.
+REQUEST_TRACING = os.getenv("REQUEST_TRACING", "1").strip().lower() not in ("0", "false", "no")
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "1").strip().lower() not in ("0", "false", "no")
+SERVER_TIMING_MAX_ENTRIES = _env_int("SERVER_TIMING_MAX_ENTRIES", 12)
+
+
+class _RequestTrace:
+    """Span timings and Firestore read/write counts for one request."""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.perf_counter()
+        self.reads = 0
+        self.writes = 0
+        self._spans: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, started: float, reads: int = 0, writes: int = 0) -> None:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            span = self._spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += elapsed_ms
+            self.reads += reads
+            self.writes += writes
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = {
+                name: {"n": count, "ms": round(total_ms, 1)}
+                for name, (count, total_ms) in sorted(self._spans.items())
+            }
+            return {
+                "route": self.route,
+                "totalMs": round((time.perf_counter() - self.started) * 1000, 1),
+                "reads": self.reads,
+                "writes": self.writes,
+                "spans": spans,
+            }
+
+
+_current_trace: contextvars.ContextVar[_RequestTrace | None] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+_span_path: contextvars.ContextVar[tuple[str, ...]] = contextvars.ContextVar("span_path", default=())
+
+
+@contextlib.contextmanager
+def _span(name: str):
+    """Time the block as span ``name`` of the current request; no-op outside a request."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    path = _span_path.get() + (name,)
+    token = _span_path.set(path)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _span_path.reset(token)
+        trace.record("/".join(path), started)
+
+
+def _traced(name: str):
+    """Decorator form of _span."""
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def _submit_traced(executor: ThreadPoolExecutor, name: str, fn, *args, **kwargs) -> Future:
+    """executor.submit running fn as span ``name`` in the caller's trace."""
+
+    def run():
+        with _span(name):
+            return fn(*args, **kwargs)
+
+    return executor.submit(contextvars.copy_context().run, run)
+
+
+# Client RPC -> span name. Streamed responses are counted as they are read.
+_FIRESTORE_TRACED_RPCS = {
+    "batch_get_documents": "firestore.get",
+    "run_query": "firestore.query",
+    "run_aggregation_query": "firestore.aggregate",
+    "list_documents": "firestore.list",
+    "commit": "firestore.commit",
+    "begin_transaction": "firestore.begin",
+    "rollback": "firestore.rollback",
+}
+
+
+def _traced_firestore_stream(trace: _RequestTrace, kind: str, name: str, started: float, responses):
+    reads = 0
+    try:
+        for response in responses:
+            if kind == "firestore.get":
+                reads += 1 if ("found" in response or "missing" in response) else 0
+            elif kind == "firestore.query":
+                reads += 1 if "document" in response else 0
+            else:
+                reads += 1
+            yield response
+    finally:
+        if kind in ("firestore.query", "firestore.aggregate"):
+            # A query is billed at least one read, even when empty.
+            reads = max(reads, 1)
+        trace.record(name, started, reads=reads)
+
+
+def _traced_firestore_rpc(span_name: str, rpc):
+    def call(*args, **kwargs):
+        trace = _current_trace.get()
+        if trace is None:
+            return rpc(*args, **kwargs)
+        name = "/".join(_span_path.get() + (span_name,))
+        started = time.perf_counter()
+        try:
+            result = rpc(*args, **kwargs)
+        except Exception:
+            trace.record(name, started)
+            raise
+        if span_name in ("firestore.get", "firestore.query", "firestore.aggregate", "firestore.list"):
+            return _traced_firestore_stream(trace, span_name, name, started, result)
+        writes = 0
+        if span_name == "firestore.commit":
+            request = kwargs.get("request")
+            writes = len((request.get("writes") if isinstance(request, dict) else None) or ())
+        trace.record(name, started, writes=writes)
+        return result
+
+    return call
+
+
+def _trace_firestore_client(client) -> None:
+    """Wrap the RPC methods of a Firestore client's transport-level API.
+
+    Relies on the private ``client._firestore_api`` GAPIC client and on
+    proto-plus field presence (``"found" in response``) for read counts. Both
+    hold for google-cloud-firestore 2.16-2.34, the range requirements.txt
+    allows; scripts/check_request_trace.py checks the counts after an upgrade.
+    """
+    try:
+        api = client._firestore_api
+        for method, span_name in _FIRESTORE_TRACED_RPCS.items():
+            rpc = getattr(api, method, None)
+            if rpc is not None:
+                setattr(api, method, _traced_firestore_rpc(span_name, rpc))
+    except Exception:
+        logger.warning("Firestore tracing unavailable", exc_info=True)
+
+
+def _finish_trace(trace: _RequestTrace, req: https_fn.Request, response: https_fn.Response | None) -> None:
+    summary = trace.summary()
+    summary["method"] = req.method
+    summary["status"] = response.status_code if response is not None else 500
+    summary["instance"] = _INSTANCE_ID
+    _log_event("request_trace", **summary)
+    if response is None or not SERVER_TIMING_HEADER:
+        return
+    top = sorted(
+        ((name, span["ms"]) for name, span in summary["spans"].items() if "/" not in name),
+        key=lambda item: -item[1],
+    )[:SERVER_TIMING_MAX_ENTRIES]
+    entries = [f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)};dur={ms}" for name, ms in top]
+    entries.append(f'firestore;desc="reads={summary["reads"]} writes={summary["writes"]}"')
+    entries.append(f"total;dur={summary['totalMs']}")
+    response.headers["Server-Timing"] = ", ".join(entries)
+    response.headers["Timing-Allow-Origin"] = "*"
+    exposed = response.headers.get("Access-Control-Expose-Headers")
+    response.headers["Access-Control-Expose-Headers"] = f"{exposed}, Server-Timing" if exposed else "Server-Timing"
+
+
+# Upstream resilience: every OpenAI call (chat and transcription) runs under a
+# per-call deadline, retries 429/5xx with jittered back-off honoring
+# Retry-After, and fails fast with 503 while the circuit breaker is open.
+# Defaults to the per-request timeout the calls had before retries existed.
+UPSTREAM_DEADLINE_SECONDS = _env_float("UPSTREAM_DEADLINE_SECONDS", REQUEST_TIMEOUT_SECONDS)
+UPSTREAM_MAX_ATTEMPTS = _env_int("UPSTREAM_MAX_ATTEMPTS", 3)
+UPSTREAM_BACKOFF_BASE_SECONDS = _env_float("UPSTREAM_BACKOFF_BASE_SECONDS", 0.5)
+UPSTREAM_BACKOFF_MAX_SECONDS = _env_float("UPSTREAM_BACKOFF_MAX_SECONDS", 8.0)
+CIRCUIT_FAILURE_THRESHOLD = _env_int("CIRCUIT_FAILURE_THRESHOLD", 5)
+CIRCUIT_RESET_SECONDS = _env_float("CIRCUIT_RESET_SECONDS", 30.0)
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class _UpstreamUnavailable(Exception):
+    """Upstream is failing: breaker open, retries exhausted or deadline spent."""
+
+    def __init__(self, upstream: str, retry_after: float, reason: str):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class _CircuitBreaker:
+    """Opens after consecutive upstream failures; lets one probe through after a cool-down."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probe_in_flight = False
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0 or self._probe_in_flight:
+                raise _UpstreamUnavailable(self.name, max(remaining, 1.0), "circuit open")
+            # Half-open: this caller is the probe.
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(
+                        "Circuit opened for %s after %s consecutive failures",
+                        self.name,
+                        self._failures,
+                    )
+                self._opened_at = time.monotonic()
+
+
+openai_chat_breaker = _CircuitBreaker("openai_chat", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+openai_transcribe_breaker = _CircuitBreaker(
+    "openai_transcribe", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS
+)
+
+
+def _retry_after_seconds(exc: Any, default: float) -> float:
+    """Read Retry-After (seconds) from an upstream error or response, if present."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        response = exc
+    headers = getattr(response, "headers", None) or {}
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(float(retry_after_ms) / 1000, 0.0)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+    return default
+
+
+def _is_retryable_upstream(outcome: Any) -> bool:
+    """True for 429/5xx responses or errors and for connection/timeout errors."""
+    status = getattr(outcome, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    if isinstance(outcome, (requests.ConnectionError, requests.Timeout)):
+        return True
+    # An openai error can only exist once the SDK has been imported.
+    openai_module = sys.modules.get("openai")
+    return openai_module is not None and isinstance(outcome, openai_module.APIConnectionError)
+
+
+def _call_upstream(
+    breaker: _CircuitBreaker,
+    attempt,
+    deadline_seconds: float | None = None,
+    max_attempts: int | None = None,
+) -> tuple[Any, int]:
+    """Run attempt(timeout_seconds) under a deadline with retries and the breaker.
+
+    Returns (result, retries). A retryable response (e.g. a requests 503) that
+    is still failing on the last attempt is returned as-is; a retryable
+    exception is raised as _UpstreamUnavailable. Other errors propagate.
+    Pass max_attempts=1 for bodies that cannot be replayed (streamed uploads).
+    """
+    deadline = time.monotonic() + (deadline_seconds or UPSTREAM_DEADLINE_SECONDS)
+    max_attempts = max_attempts or UPSTREAM_MAX_ATTEMPTS
+    retries = 0
+    while True:
+        # Before before_call(), which may make this call the half-open probe:
+        # a probe must end in record_success() or record_failure().
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise _UpstreamUnavailable(breaker.name, UPSTREAM_BACKOFF_MAX_SECONDS, "deadline exceeded")
+        breaker.before_call()
+        try:
+            with _span(breaker.name):
+                outcome = attempt(remaining)
+        except Exception as exc:
+            if not _is_retryable_upstream(exc):
+                breaker.record_success()
+                raise
+            outcome = exc
+        else:
+            if not _is_retryable_upstream(outcome):
+                breaker.record_success()
+                return outcome, retries
+        breaker.record_failure()
+
+        backoff = min(UPSTREAM_BACKOFF_MAX_SECONDS, UPSTREAM_BACKOFF_BASE_SECONDS * 2 ** retries)
+        delay = _retry_after_seconds(outcome, default=random.uniform(0, backoff))
+        if retries + 1 >= max_attempts or time.monotonic() + delay >= deadline:
+            if isinstance(outcome, Exception):
+                raise _UpstreamUnavailable(
+                    breaker.name, max(delay, 1.0), f"retries exhausted ({type(outcome).__name__})"
+                ) from outcome
+            return outcome, retries
+        logger.warning(
+            "Upstream %s attempt %s failed (%s); retrying in %.2fs",
+            breaker.name,
+            retries + 1,
+            getattr(outcome, "status_code", None) or type(outcome).__name__,
+            delay,
+        )
+        time.sleep(delay)
+        retries += 1
+
+# LLM call telemetry: one structured log event per model call, plus per-tenant
+# counters aggregated in memory and flushed to sharded Firestore documents
+# once TELEMETRY_FLUSH_SECONDS have passed: at the end of the next request
+# (while the instance still has CPU), from a background thread for instances
+# that go quiet, and once at shutdown.
+TELEMETRY_COLLECTION = os.getenv("TELEMETRY_COLLECTION", "llmUsage")
+TELEMETRY_FLUSH_SECONDS = _env_float("TELEMETRY_FLUSH_SECONDS", 60.0)
+TELEMETRY_COUNTER_SHARDS = _env_int("TELEMETRY_COUNTER_SHARDS", 8)
+
+# USD per 1M (prompt, completion) tokens; only used for cost estimates.
+MODEL_PRICES_PER_MTOK: Dict[str, tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+_telemetry_lock = threading.Lock()
+_telemetry_counters: Dict[tuple[str, str, str], Dict[str, float]] = {}
+_telemetry_flusher: threading.Thread | None = None
+_telemetry_last_flush = time.monotonic()
+
+
+def _estimate_cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    # Longest prefix wins so dated variants (gpt-4o-mini-2024-07-18) resolve.
+    for name in sorted(MODEL_PRICES_PER_MTOK, key=len, reverse=True):
+        if model.startswith(name):
+            prompt_price, completion_price = MODEL_PRICES_PER_MTOK[name]
+            return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+    return 0.0
+
+
+def _usage_counters(endpoint: str, owner_uid: str | None, model: str) -> Dict[str, float]:
+    """Return the in-memory counter group for a call; caller holds _telemetry_lock."""
+    return _telemetry_counters.setdefault(
+        (endpoint, owner_uid or "anonymous", model or "unknown"),
+        {
+            "calls": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "retries": 0,
+            "promptTokens": 0,
+            "completionTokens": 0,
+            "latencyMs": 0,
+            "costMicroUsd": 0,
+        },
+    )
+
+
+def _record_model_call(
+    endpoint: str,
+    owner_uid: str | None,
+    model: str,
+    latency_ms: float,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    retries: int = 0,
+    error: str | None = None,
+) -> None:
+    """Log one model call as a structured event and add it to the counters."""
+    cost_usd = _estimate_cost_usd(model, prompt_tokens, completion_tokens)
+    _log_event(
+        "llm_call",
+        endpoint=endpoint,
+        ownerUid=owner_uid,
+        model=model,
+        promptTokens=prompt_tokens,
+        completionTokens=completion_tokens,
+        latencyMs=round(latency_ms, 1),
+        retries=retries,
+        costUsd=round(cost_usd, 6),
+        error=error,
+    )
+
+    with _telemetry_lock:
+        counters = _usage_counters(endpoint, owner_uid, model)
+        counters["calls"] += 1
+        counters["errors"] += 1 if error else 0
+        counters["retries"] += retries
+        counters["promptTokens"] += prompt_tokens
+        counters["completionTokens"] += completion_tokens
+        counters["latencyMs"] += int(latency_ms)
+        counters["costMicroUsd"] += int(round(cost_usd * 1_000_000))
+    _start_telemetry_flusher()
+
+
+def _start_telemetry_flusher() -> None:
+    """Start the flush thread on the first model call of this instance."""
+    global _telemetry_flusher
+    if _telemetry_flusher is not None:
+        return
+    with _telemetry_lock:
+        if _telemetry_flusher is not None:
+            return
+        _telemetry_flusher = threading.Thread(
+            target=_telemetry_flush_loop, name="telemetry-flush", daemon=True
+        )
+        _telemetry_flusher.start()
+    if os.getenv("K_SERVICE") or os.getenv("FUNCTIONS_EMULATOR"):
+        # Counters gathered since the last tick would otherwise die with the
+        # instance. Not for local scripts, which usually have no Firestore.
+        atexit.register(_flush_model_telemetry)
+
+
+def _telemetry_flush_loop() -> None:
+    while True:
+        time.sleep(max(TELEMETRY_FLUSH_SECONDS, 1.0))
+        try:
+            _flush_model_telemetry_if_due()
+        except Exception:
+            logger.exception("LLM telemetry flush loop failed")
+
+
+def _flush_model_telemetry_if_due() -> int:
+    """Flush the counters if TELEMETRY_FLUSH_SECONDS have passed since the last flush."""
+    global _telemetry_last_flush
+    with _telemetry_lock:
+        if not _telemetry_counters or time.monotonic() - _telemetry_last_flush < TELEMETRY_FLUSH_SECONDS:
+            return 0
+        pending = dict(_telemetry_counters)
+        _telemetry_counters.clear()
+        _telemetry_last_flush = time.monotonic()
+    return _flush_model_telemetry(pending)
+
+
+def _flush_model_telemetry(pending: Dict[tuple[str, str, str], Dict[str, float]] | None = None) -> int:
+    """Write aggregated counters to llmUsage/{day}_{uid}/shards/{n} with increments.
+
+    Each flush picks a random shard per tenant so busy tenants spread their
+    writes instead of contending on one document. Returns the number of
+    counter groups written.
+    """
+    if pending is None:
+        with _telemetry_lock:
+            pending = dict(_telemetry_counters)
+            _telemetry_counters.clear()
+    if not pending:
+        return 0
+
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    try:
+        db_client = get_db()
+        batch = db_client.batch()
+        for i, ((endpoint, owner_uid, model), counters) in enumerate(pending.items(), start=1):
+            shard_ref = (
+                db_client.collection(TELEMETRY_COLLECTION)
+                .document(f"{day}_{owner_uid}")
+                .collection("shards")
+                .document(str(random.randrange(max(TELEMETRY_COUNTER_SHARDS, 1))))
+            )
+            batch.set(
+                shard_ref,
+                {
+                    "day": day,
+                    "ownerUid": owner_uid,
+                    "usage": {
+                        endpoint: {
+                            model: {k: firestore.Increment(v) for k, v in counters.items()}
+                        }
+                    },
+                },
+                merge=True,
+            )
+            if i % 400 == 0:
+                batch.commit()
+                batch = db_client.batch()
+        batch.commit()
+    except Exception:
+        logger.exception("LLM telemetry flush failed; keeping counters for the next flush")
+        with _telemetry_lock:
+            for key, counters in pending.items():
+                current = _telemetry_counters.setdefault(key, dict.fromkeys(counters, 0))
+                for k, v in counters.items():
+                    current[k] = current.get(k, 0) + v
+        return 0
+    return len(pending)
+
+
+class _SingleFlight:
+    """Collapse concurrent calls with the same key into one execution.
+
+    The first caller runs fn; callers arriving while it is in flight wait for
+    and share its result (or exception). Nothing is cached afterwards.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, fn) -> tuple[Any, bool]:
+        """Return (result, shared); shared is True when another caller's result was reused."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+_chat_singleflight = _SingleFlight("chat_completion")
+
+
+def _chat_completion(
+    endpoint: str, owner_uid: str | None, *, coalesce: bool = False, **params
+) -> Any:
+    """Create a chat completion through the shared client and record telemetry.
+
+    With coalesce=True, concurrent identical requests (same endpoint, owner,
+    model, messages and parameters) share a single upstream call.
+    """
+    if not coalesce:
+        return _create_chat_completion(endpoint, owner_uid, params)
+    key = hashlib.sha256(
+        json.dumps(
+            {"endpoint": endpoint, "ownerUid": owner_uid, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        ).encode("utf-8")
+    ).hexdigest()
+    completion, shared = _chat_singleflight.do(
+        key, lambda: _create_chat_completion(endpoint, owner_uid, params)
+    )
+    if shared:
+        # Same key as the leader's _record_model_call: the served (dated) model.
+        model = getattr(completion, "model", None) or str(params.get("model") or "")
+        with _telemetry_lock:
+            _usage_counters(endpoint, owner_uid, model)["coalesced"] += 1
+        logger.info(
+            "llm_call coalesced: endpoint=%s ownerUid=%s coalescedTotal=%s",
+            endpoint,
+            owner_uid,
+            _chat_singleflight.coalesced,
+        )
+    return completion
+
+
+def _create_chat_completion(endpoint: str, owner_uid: str | None, params: Dict[str, Any]) -> Any:
+    import httpx
+
+    model = str(params.get("model") or "")
+    client = get_openai_client()
+    started = time.perf_counter()
+    try:
+        raw, retries = _call_upstream(
+            openai_chat_breaker,
+            lambda remaining: client.chat.completions.with_raw_response.create(
+                **params,
+                timeout=httpx.Timeout(
+                    min(remaining, OPENAI_TIMEOUT_SECONDS), connect=OPENAI_CONNECT_TIMEOUT_SECONDS
+                ),
+            ),
+        )
+        completion = raw.parse()
+    except Exception as exc:
+        _record_model_call(
+            endpoint,
+            owner_uid,
+            model,
+            (time.perf_counter() - started) * 1000,
+            error=type(exc).__name__,
+        )
+        raise
+    usage = getattr(completion, "usage", None)
+    _record_model_call(
+        endpoint,
+        owner_uid,
+        getattr(completion, "model", None) or model,
+        (time.perf_counter() - started) * 1000,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        retries=retries,
+    )
+    return completion
+
+
+# JSON codec shared by every response helper and request decoder. orjson is
+# used when installed (several times faster than json, compact and UTF-8);
+# the stdlib encoder with the same compact, UTF-8 output is the fallback.
+# _serve compresses responses of at least RESPONSE_COMPRESS_MIN_BYTES with br
+# or gzip, whichever the client's Accept-Encoding prefers (br on a tie).
+RESPONSE_COMPRESS_MIN_BYTES = _env_int("RESPONSE_COMPRESS_MIN_BYTES", 1024)
+RESPONSE_GZIP_LEVEL = _env_int("RESPONSE_GZIP_LEVEL", 6)
+RESPONSE_BROTLI_QUALITY = _env_int("RESPONSE_BROTLI_QUALITY", 5)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _json_dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the stdlib encoder handles.
+            pass
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _json_loads(raw: bytes | str) -> Any:
+    """Decode JSON; raises ValueError on malformed input with either backend."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _compress_response(req: https_fn.Request, response: https_fn.Response) -> https_fn.Response:
+    """Compress a buffered JSON/text response in place if the client accepts br or gzip."""
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or not (response.mimetype == "application/json" or response.mimetype.startswith("text/"))
+    ):
+        return response
+    body = response.get_data()
+    if len(body) < RESPONSE_COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add("Accept-Encoding")
+    accepted = req.accept_encodings
+    br_quality = accepted.quality("br") if brotli is not None else 0
+    gzip_quality = accepted.quality("gzip")
+    if br_quality > 0 and br_quality >= gzip_quality:
+        encoding, encoded = "br", brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    elif gzip_quality > 0:
+        encoding, encoded = "gzip", gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+    else:
+        return response
+    response.set_data(encoded)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+# Retry-After is exposed so browser clients can read it from 429 and 503
+# responses; _finish_trace appends Server-Timing to the same list.
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
     "Access-Control-Allow-Methods": "POST, OPTIONS",
     "Access-Control-Allow-Headers": "Content-Type, Authorization",
+    "Access-Control-Expose-Headers": "Retry-After",
 }
 
 PUBLIC_BOOKING_CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
     "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
     "Access-Control-Allow-Headers": "Content-Type, Authorization",
+    "Access-Control-Expose-Headers": "Retry-After",
 }
 
 BOOKING_ALLOWED_ORIGINS = [
@@ -98,12 +1181,12 @@ def _public_booking_cors_headers() -> Dict[str, str]:
 
 
 def _public_booking_log(req: https_fn.Request, status: int) -> None:
-    origin = req.headers.get("Origin")
-    logger.info(
-        "public booking response: method=%s origin=%s status=%s",
-        req.method,
-        origin,
-        status,
+    _log_event(
+        "public_response",
+        logging.WARNING if status >= 500 else logging.INFO,
+        method=req.method,
+        origin=req.headers.get("Origin"),
+        status=status,
     )
 
 
@@ -112,7 +1195,7 @@ def _public_booking_json_response(
 ) -> https_fn.Response:
     _public_booking_log(req, status)
     return https_fn.Response(
-        json.dumps(payload),
+        _json_dumps(payload),
         status=status,
         headers=_public_booking_cors_headers(),
         content_type="application/json",
@@ -140,24 +1223,332 @@ def _public_booking_empty_response(req: https_fn.Request, status: int) -> https_
     return https_fn.Response("", status=status, headers=_public_booking_cors_headers())
 
 
-def _parse_request_json(req: https_fn.Request) -> Dict[str, Any] | None:
-    data = req.get_json(silent=True)
-    if data is None:
-        raw = req.data
-        if raw:
+# Admission control for the public booking endpoints. Each endpoint has token
+# buckets per client IP and per clinic slug, kept in memory on the instance.
+# A limit may also set sharedPerMinute. Admitted requests are then counted in
+# Firestore per minute, across instances, and the key is refused for the rest
+# of the minute once the total passes the budget. Counts are flushed from the
+# I/O pool every RATE_LIMIT_SHARED_SYNC_SECONDS, so the shared budget costs no
+# request latency and fails open when Firestore is unreachable. Refused
+# requests get a 429 with Retry-After before any Firestore read.
+#
+# RATE_LIMITS overrides the defaults per endpoint with JSON, e.g.
+#   {"publicGetAvailability": {"ip": {"perSecond": 1, "burst": 20, "sharedPerMinute": 120}}}
+# A null endpoint or kind turns that limit off.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+RATE_LIMIT_MAX_KEYS = _env_int("RATE_LIMIT_MAX_KEYS", 20000)
+# X-Forwarded-For entries appended by our own proxies: 1 on Cloud Run, 2 behind
+# a Firebase Hosting rewrite. The client IP is the entry just before them.
+RATE_LIMIT_PROXY_HOPS = _env_int("RATE_LIMIT_PROXY_HOPS", 1)
+RATE_LIMIT_SHARED_COLLECTION = os.getenv("RATE_LIMIT_SHARED_COLLECTION", "_rateLimits")
+RATE_LIMIT_SHARED_SYNC_SECONDS = _env_float("RATE_LIMIT_SHARED_SYNC_SECONDS", 2.0)
+RATE_LIMIT_LOG_SECONDS = _env_float("RATE_LIMIT_LOG_SECONDS", 10.0)
+
+_PUBLIC_READ_LIMITS = {
+    "ip": {"perSecond": 1, "burst": 20},
+    "clinic": {"perSecond": 10, "burst": 100},
+}
+_PUBLIC_BOOKING_LIMITS = {
+    "ip": {"perSecond": 0.1, "burst": 5},
+    "clinic": {"perSecond": 1, "burst": 20},
+}
+_DEFAULT_RATE_LIMITS: Dict[str, Dict[str, Dict[str, float]] | None] = {
+    # A booking page asks for a week of days at a time.
+    "publicGetAvailability": {
+        "ip": {"perSecond": 2, "burst": 40},
+        "clinic": {"perSecond": 20, "burst": 200},
+    },
+    "getClinicStaffPublic": _PUBLIC_READ_LIMITS,
+    "getClinicServicesPublic": _PUBLIC_READ_LIMITS,
+    "publicGetServices": _PUBLIC_READ_LIMITS,
+    "publicBookAppointment": _PUBLIC_BOOKING_LIMITS,
+    "createClientFromBooking": _PUBLIC_BOOKING_LIMITS,
+}
+
+
+def _load_rate_limits() -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Defaults merged with the RATE_LIMITS overrides, endpoint by endpoint."""
+    limits = {route: dict(kinds or {}) for route, kinds in _DEFAULT_RATE_LIMITS.items()}
+    raw = os.getenv("RATE_LIMITS", "").strip()
+    if raw:
+        try:
+            overrides = json.loads(raw)
+            if not isinstance(overrides, dict):
+                raise ValueError("expected an object")
+        except ValueError:
+            logger.warning("Invalid RATE_LIMITS; using the defaults", exc_info=True)
+            overrides = {}
+        for route, kinds in overrides.items():
+            if kinds is None:
+                limits[route] = {}
+                continue
+            merged = limits.setdefault(route, {})
+            for kind, limit in (kinds or {}).items():
+                if limit is None:
+                    merged.pop(kind, None)
+                else:
+                    merged[kind] = {**merged.get(kind, {}), **limit}
+
+    resolved: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for route, kinds in limits.items():
+        for kind, limit in kinds.items():
             try:
-                if isinstance(raw, (bytes, bytearray)):
-                    raw = raw.decode("utf-8")
-                data = json.loads(raw)
-            except Exception:
-                return None
-        else:
-            data = {}
+                per_second = float(limit.get("perSecond") or 0)
+                burst = float(limit.get("burst") or max(per_second, 1))
+                shared = float(limit.get("sharedPerMinute") or 0)
+            except (AttributeError, TypeError, ValueError):
+                logger.warning("Invalid rate limit %s.%s: %s", route, kind, limit)
+                continue
+            if per_second <= 0:
+                continue
+            resolved.setdefault(route, {})[kind] = {
+                "perSecond": per_second,
+                "burst": max(burst, 1.0),
+                "sharedPerMinute": shared,
+            }
+    return resolved
+
+
+RATE_LIMITS = _load_rate_limits()
+
+
+class _TokenBuckets:
+    """Thread-safe token buckets by key; the least recently used keys are dropped."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max(max_keys, 1)
+        self._buckets: "OrderedDict[str, list[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, per_second: float, burst: float) -> float:
+        """Take one token; returns 0 when granted, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * per_second)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / per_second
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+class _SharedBudget:
+    """Per-minute request counts shared by all instances through Firestore."""
+
+    def __init__(self, collection: str, sync_seconds: float):
+        self.collection = collection
+        self.sync_seconds = sync_seconds
+        self._pending: Dict[tuple[str, int], list] = {}
+        self._exhausted: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+        self._syncing = False
+
+    def take(self, key: str, per_minute: float) -> float:
+        """Count one admitted request; returns seconds to wait if the key is over budget."""
+        now = time.time()
+        window = int(now // 60)
+        submit = False
+        with self._lock:
+            if self._exhausted.get(key) == window:
+                return 60 - now % 60
+            entry = self._pending.setdefault((key, window), [0, per_minute])
+            entry[0] += 1
+            if not self._syncing and now - self._last_sync >= self.sync_seconds:
+                self._syncing = True
+                self._last_sync = now
+                submit = True
+        if submit:
+            get_io_executor().submit(self._sync)
+        return 0.0
+
+    def _sync(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            collection = get_db().collection(self.collection)
+            for (key, window), (count, per_minute) in pending.items():
+                doc_id = hashlib.sha256(f"{key}|{window}".encode("utf-8")).hexdigest()[:32]
+                ref = collection.document(doc_id)
+                ref.set(
+                    {
+                        "count": firestore.Increment(count),
+                        "window": window,
+                        # For a Firestore TTL policy on this field.
+                        "expiresAt": datetime.fromtimestamp((window + 2) * 60, tz=timezone.utc),
+                    },
+                    merge=True,
+                )
+                total = (ref.get().to_dict() or {}).get("count") or 0
+                if total >= per_minute:
+                    with self._lock:
+                        self._exhausted[key] = window
+        except Exception:
+            logger.warning("Shared rate-limit sync failed; admitting on local limits only", exc_info=True)
+        finally:
+            with self._lock:
+                current = int(time.time() // 60)
+                self._exhausted = {k: w for k, w in self._exhausted.items() if w >= current}
+                self._syncing = False
+
+
+_rate_buckets = _TokenBuckets(RATE_LIMIT_MAX_KEYS)
+_shared_budget = _SharedBudget(RATE_LIMIT_SHARED_COLLECTION, RATE_LIMIT_SHARED_SYNC_SECONDS)
+_rate_limit_lock = threading.Lock()
+_rate_limit_refused: Dict[str, int] = {}
+_rate_limit_logged_at = 0.0
+
+
+def _client_ip(req: https_fn.Request) -> str:
+    """Client address for rate limiting; IPv6 clients are grouped by /64."""
+    forwarded = [part.strip() for part in (req.headers.get("X-Forwarded-For") or "").split(",")]
+    forwarded = [part for part in forwarded if part]
+    if forwarded:
+        address = forwarded[max(len(forwarded) - max(RATE_LIMIT_PROXY_HOPS, 1), 0)]
+    else:
+        address = req.remote_addr or ""
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    if ip.version == 6:
+        return str(ipaddress.ip_network(f"{ip}/64", strict=False).network_address)
+    return str(ip)
+
+
+def _note_refused(route: str, kind: str) -> None:
+    """Count a refused request, logging the counts at most every RATE_LIMIT_LOG_SECONDS."""
+    global _rate_limit_refused, _rate_limit_logged_at
+    now = time.monotonic()
+    with _rate_limit_lock:
+        name = f"{route}.{kind}"
+        _rate_limit_refused[name] = _rate_limit_refused.get(name, 0) + 1
+        if now - _rate_limit_logged_at < RATE_LIMIT_LOG_SECONDS:
+            return
+        refused, _rate_limit_refused = _rate_limit_refused, {}
+        _rate_limit_logged_at = now
+    _log_event("rate_limited", logging.WARNING, refused=refused, instance=_INSTANCE_ID)
+
+
+def _rate_limit_retry_after(req: https_fn.Request, route: str, clinic_slug: str) -> float:
+    """Seconds the caller should wait before retrying ``route``, or 0 to admit the request."""
+    limits = RATE_LIMITS.get(route) if RATE_LIMIT_ENABLED else None
+    if not limits:
+        return 0.0
+    for kind, key in (("ip", _client_ip(req)), ("clinic", clinic_slug)):
+        limit = limits.get(kind)
+        if not limit or not key:
+            continue
+        bucket_key = f"{route}|{kind}|{key}"
+        retry_after = _rate_buckets.take(bucket_key, limit["perSecond"], limit["burst"])
+        if not retry_after and limit["sharedPerMinute"]:
+            retry_after = _shared_budget.take(bucket_key, limit["sharedPerMinute"])
+        if retry_after:
+            _note_refused(route, kind)
+            return retry_after
+    return 0.0
+
+
+def _retry_after_header(seconds: float) -> str:
+    return str(max(int(seconds + 0.999), 1))
+
+
+def _public_rate_limited(req: https_fn.Request, route: str, clinic_slug: str) -> https_fn.Response | None:
+    """A 429 response when the request is over one of the route's limits, else None."""
+    retry_after = _rate_limit_retry_after(req, route, clinic_slug)
+    if not retry_after:
+        return None
+    response = _public_booking_json_response(
+        req, {"error": "Too many requests. Please retry shortly."}, status=429
+    )
+    response.headers["Retry-After"] = _retry_after_header(retry_after)
+    return response
+
+
+def _parse_request_json(req: https_fn.Request) -> Dict[str, Any] | None:
+    """Decode the body once as a JSON object, whatever the Content-Type.
+
+    An empty body is {}; malformed JSON or a non-object body returns None.
+    """
+    raw = req.get_data(cache=True)
+    if not raw:
+        return {}
+    try:
+        data = _json_loads(raw)
+    except ValueError:
+        return None
     if not isinstance(data, dict):
         return None
     return data
 
 
+# Request schemas. _decode_fields reads each field from the query string
+# (when given) and then the JSON body: str fields are stripped and "" when
+# absent, bool fields are True only for a JSON true.
+class _ClinicRequest(TypedDict):
+    clinicSlug: str
+    slug: str
+
+
+class _AvailabilityRequest(TypedDict):
+    clinicSlug: str
+    staffUid: str
+    dateIso: str
+    serviceId: str
+
+
+class _BookingRequest(TypedDict):
+    clinicSlug: str
+    staffUid: str
+    serviceId: str
+    startIso: str
+    endIso: str
+    firstName: str
+    lastName: str
+    email: str
+    phone: str
+    notes: str
+    privacyAccepted: bool
+    marketingOptIn: bool
+
+
+class _AgentChatRequest(TypedDict):
+    agentId: str
+    clientId: str
+    message: str
+    actionId: str
+    draftText: str
+
+
+@functools.lru_cache(maxsize=None)
+def _schema_fields(schema: type) -> tuple[tuple[str, type], ...]:
+    return tuple(get_type_hints(schema).items())
+
+
+def _decode_fields(
+    schema: type, data: Dict[str, Any], query: Mapping[str, str] | None = None
+) -> Dict[str, Any]:
+    decoded: Dict[str, Any] = {}
+    for name, kind in _schema_fields(schema):
+        value = (query.get(name) if query else None) or data.get(name)
+        if kind is bool:
+            decoded[name] = value is True
+        else:
+            decoded[name] = str(value or "").strip()
+    return decoded
+
+
 def _parse_iso_datetime(value: str | None) -> datetime | None:
     if not value:
         return None
@@ -351,6 +1742,7 @@ def _load_user_work_hours(uid: str | None) -> tuple[Dict[str, Any] | None, str |
     return None, uid
 
 
+@_traced("workHours")
 def _resolve_staff_work_hours(
     clinic_data: Dict[str, Any],
     staff_uid: str,
@@ -450,6 +1842,115 @@ def _appointment_matches_staff(
     return False
 
 
+@_traced("appointments")
+def _load_busy_ranges(
+    owner_uid: str,
+    staff_uid: str,
+    staff_name: str,
+    range_start: datetime,
+    range_end: datetime,
+) -> List[tuple[datetime, datetime]]:
+    """Load (start, end) of the staff member's appointments starting in [range_start, range_end)."""
+    appointment_docs = (
+        get_db()
+        .collection("users")
+        .document(owner_uid)
+        .collection("appointments")
+        .where("start", ">=", _to_utc_iso(range_start))
+        .where("start", "<", _to_utc_iso(range_end))
+        .stream()
+    )
+
+    busy_ranges = []
+    for doc in appointment_docs:
+        appt = doc.to_dict() or {}
+        if not _appointment_matches_staff(appt, staff_uid, staff_name, owner_uid):
+            continue
+        appt_start = _parse_iso_datetime(appt.get("start") or appt.get("startIso"))
+        appt_end = _parse_iso_datetime(appt.get("end") or appt.get("endIso"))
+        if not appt_start or not appt_end:
+            continue
+        busy_ranges.append((appt_start, appt_end))
+    return busy_ranges
+
+
+def _resolve_work_window(work_hours: Dict[str, Any] | None, target_date: date) -> Dict[str, Any]:
+    """Resolve the working window for one day.
+
+    Returns {"reason": "CLOSED"} for a closed day, {"error": ...} for invalid
+    work hours, otherwise {"startMinutes", "endMinutes"}.
+    """
+    day_key = _get_weekday_key_long(target_date)
+    work_day = work_hours.get(day_key) if isinstance(work_hours, dict) else None
+    if not isinstance(work_day, dict) or work_day.get("enabled") is not True:
+        return {"reason": "CLOSED"}
+
+    start_raw = work_day.get("start")
+    end_raw = work_day.get("end")
+    if not isinstance(start_raw, str) or not isinstance(end_raw, str) or not start_raw or not end_raw:
+        return {"error": f"workHours missing start/end for {day_key}."}
+
+    start_minutes = _parse_time_minutes(start_raw)
+    end_minutes = _parse_time_minutes(end_raw)
+    if start_minutes is None or end_minutes is None or end_minutes <= start_minutes:
+        return {"error": f"Invalid workHours for {day_key}."}
+    return {"startMinutes": start_minutes, "endMinutes": end_minutes}
+
+
+def _compute_day_slots(
+    window: Dict[str, Any],
+    target_date: date,
+    service_minutes: int,
+    slot_minutes: int,
+    tzinfo,
+    busy_ranges: List[tuple[datetime, datetime]],
+) -> Dict[str, Any]:
+    """Compute free slots in a resolved work window; same rules as publicGetAvailability."""
+    start_minutes = window["startMinutes"]
+    end_minutes = window["endMinutes"]
+
+    day_start_local = datetime(
+        target_date.year,
+        target_date.month,
+        target_date.day,
+        0,
+        0,
+        tzinfo=tzinfo,
+    )
+
+    candidate_slots = []
+    slot_start_minutes = start_minutes
+    while slot_start_minutes + service_minutes <= end_minutes:
+        slot_start_local = day_start_local + timedelta(minutes=slot_start_minutes)
+        slot_end_local = slot_start_local + timedelta(minutes=service_minutes)
+        candidate_slots.append((slot_start_local, slot_end_local))
+        slot_start_minutes += slot_minutes
+
+    slots = []
+    for slot_start_local, slot_end_local in candidate_slots:
+        slot_start = slot_start_local.astimezone(timezone.utc)
+        slot_end = slot_end_local.astimezone(timezone.utc)
+        overlaps = False
+        for busy_start, busy_end in busy_ranges:
+            if slot_start < busy_end and slot_end > busy_start:
+                overlaps = True
+                break
+        if not overlaps:
+            slots.append(
+                {
+                    "startIso": _to_utc_iso(slot_start_local),
+                    "endIso": _to_utc_iso(slot_end_local),
+                }
+            )
+
+    return {
+        "slots": slots,
+        "candidateCount": len(candidate_slots),
+        "workStart": _format_minutes_as_time(start_minutes),
+        "workEnd": _format_minutes_as_time(end_minutes),
+    }
+
+
 def _resolve_booking_origin(origin: str | None) -> str:
     if BOOKING_ALLOW_ANY:
         return "*"
@@ -468,6 +1969,7 @@ def _booking_cors_headers(origin: str | None) -> Dict[str, str]:
     headers = {
         "Access-Control-Allow-Methods": "POST, OPTIONS",
         "Access-Control-Allow-Headers": "Content-Type, Authorization",
+        "Access-Control-Expose-Headers": "Retry-After",
     }
     resolved = _resolve_booking_origin(origin)
     if resolved:
@@ -480,7 +1982,7 @@ def _booking_json_response(
     payload: Dict[str, Any], status: int, origin: str | None
 ) -> https_fn.Response:
     return https_fn.Response(
-        json.dumps(payload),
+        _json_dumps(payload),
         status=status,
         headers=_booking_cors_headers(origin),
         content_type="application/json",
@@ -493,7 +1995,7 @@ def _booking_error(message: str, status: int, origin: str | None) -> https_fn.Re
 
 def _json_response(payload: Dict[str, Any], status: int) -> https_fn.Response:
     return https_fn.Response(
-        json.dumps(payload),
+        _json_dumps(payload),
         status=status,
         headers=_cors_headers(),
         content_type="application/json",
@@ -504,26 +2006,152 @@ def _error(message: str, status: int) -> https_fn.Response:
     return _json_response({"error": message}, status=status)
 
 
+def _upstream_unavailable_response(exc: "_UpstreamUnavailable") -> https_fn.Response:
+    response = _error("The AI service is temporarily unavailable. Please retry shortly.", status=503)
+    response.headers["Retry-After"] = str(max(int(round(exc.retry_after)), 1))
+    return response
+
+
 def _parse_bearer_token(req: https_fn.Request) -> str | None:
     auth_header = req.headers.get("Authorization", "") or ""
     if auth_header.startswith("Bearer "):
-        return auth_header[len("Bearer ") :].strip()
+        return auth_header[len("Bearer ") :].strip() or None
     return None
 
 
-def _pad2(n: int) -> str:
-    return str(int(n)).zfill(2)
+# Verified Firebase ID tokens are cached per instance, keyed by a hash of the
+# token and kept only until shortly before the token's own exp, so repeat
+# calls from a session skip signature verification. Revocation is not checked,
+# matching verify_id_token's default.
+AUTH_TOKEN_CACHE_MAX_ENTRIES = _env_int("AUTH_TOKEN_CACHE_MAX_ENTRIES", 2048)
+AUTH_TOKEN_CACHE_LEEWAY_SECONDS = _env_float("AUTH_TOKEN_CACHE_LEEWAY_SECONDS", 30.0)
+# Google's signing certificates are refreshed in the background well inside
+# their max-age, so a request never waits on the fetch. The refresh goes
+# through the Admin SDK's private verifier session (checked against
+# firebase-admin 6.6-7.x, see requirements.txt); if those internals move it
+# turns itself off and the SDK fetches on demand as before.
+AUTH_CERT_REFRESH_SECONDS = _env_float("AUTH_CERT_REFRESH_SECONDS", 1800.0)
+
+_id_token_cache = _TTLCache(AUTH_TOKEN_CACHE_MAX_ENTRIES, 3600.0)
+_auth_certs_lock = threading.Lock()
+_auth_certs_refreshed_at: float | None = None
+_auth_cert_refresh_supported = True
+
+
+def _refresh_auth_certs(force: bool = True) -> None:
+    """Fetch the ID-token signing certificates through the Admin SDK's cached session.
+
+    ``force`` revalidates with ``Cache-Control: no-cache`` so the SDK's HTTP
+    cache holds a fresh copy before the old one goes stale.
+    """
+    global _auth_certs_refreshed_at, _auth_cert_refresh_supported
+    if os.getenv("FIREBASE_AUTH_EMULATOR_HOST"):
+        # Emulator tokens are unsigned.
+        return
+    if not _auth_cert_refresh_supported:
+        return
+    try:
+        from firebase_admin._token_gen import ID_TOKEN_CERT_URI
+
+        fetch = auth._get_client(ensure_firebase_app())._token_verifier.request
+    except (ImportError, AttributeError):
+        _auth_cert_refresh_supported = False
+        logger.warning("firebase_admin internals changed; background certificate refresh disabled")
+        return
+    response = fetch(
+        ID_TOKEN_CERT_URI,
+        method="GET",
+        headers={"Cache-Control": "no-cache"} if force else None,
+    )
+    if response.status != 200:
+        raise RuntimeError(f"Certificate fetch failed: HTTP {response.status}")
+    with _auth_certs_lock:
+        _auth_certs_refreshed_at = time.monotonic()
+
+
+def _schedule_auth_cert_refresh() -> None:
+    global _auth_certs_refreshed_at
+    if not _auth_cert_refresh_supported:
+        return
+    now = time.monotonic()
+    with _auth_certs_lock:
+        if _auth_certs_refreshed_at is None:
+            # The first verification fetches the certificates itself.
+            _auth_certs_refreshed_at = now
+            return
+        if now - _auth_certs_refreshed_at < AUTH_CERT_REFRESH_SECONDS:
+            return
+        _auth_certs_refreshed_at = now
+
+    def refresh() -> None:
+        try:
+            _refresh_auth_certs()
+        except Exception:
+            logger.warning("Auth certificate refresh failed", exc_info=True)
 
+    get_io_executor().submit(refresh)
 
-def _format_date_ddmmyyyy(d) -> str:
-    return f"{_pad2(d.day)}-{_pad2(d.month)}-{d.year}"
 
+def _verify_id_token(id_token: str) -> Dict[str, Any]:
+    """auth.verify_id_token with a per-instance cache of verified claims."""
+    cache_key = hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+    decoded = _id_token_cache.get(cache_key)
+    if decoded is not None:
+        return decoded
+    _schedule_auth_cert_refresh()
+    with _span("auth.verify"):
+        decoded = auth.verify_id_token(id_token, app=ensure_firebase_app())
+    ttl = _safe_int(decoded.get("exp"), 0) - time.time() - AUTH_TOKEN_CACHE_LEEWAY_SECONDS
+    if ttl > 0:
+        _id_token_cache.set(cache_key, decoded, ttl_seconds=ttl)
+    return decoded
 
-def _format_time_hhmm(d) -> str:
-    return f"{_pad2(d.hour)}:{_pad2(d.minute)}"
 
+def _unauthorized(message: str) -> https_fn.Response:
+    response = _error(message, status=401)
+    response.headers["WWW-Authenticate"] = 'Bearer realm="firebase"'
+    return response
 
-def _safe_int(value: Any, default: int) -> int:
+
+def _authenticate(req: https_fn.Request) -> tuple[str | None, https_fn.Response | None]:
+    """Verify the request's Firebase ID token.
+
+    Returns (uid, None) on success, or (None, response) with a 401 (or a 503
+    when the signing certificates cannot be fetched) for the handler to return.
+    """
+    id_token = _parse_bearer_token(req)
+    if not id_token:
+        return None, _unauthorized("Missing auth token.")
+    try:
+        decoded = _verify_id_token(id_token)
+    except auth.ExpiredIdTokenError:
+        return None, _unauthorized("Expired auth token.")
+    except (auth.InvalidIdTokenError, auth.UserDisabledError, ValueError):
+        return None, _unauthorized("Invalid auth token.")
+    except auth.CertificateFetchError:
+        logger.warning("Could not fetch ID token certificates", exc_info=True)
+        response = _error("Authentication is temporarily unavailable.", status=503)
+        response.headers["Retry-After"] = "5"
+        return None, response
+    user_id = decoded.get("uid")
+    if not user_id:
+        return None, _unauthorized("Invalid auth token.")
+    return user_id, None
+
+
+def _pad2(n: int) -> str:
+    return str(int(n)).zfill(2)
+
+
+def _format_date_ddmmyyyy(d) -> str:
+    return f"{_pad2(d.day)}-{_pad2(d.month)}-{d.year}"
+
+
+def _format_time_hhmm(d) -> str:
+    return f"{_pad2(d.hour)}:{_pad2(d.minute)}"
+
+
+def _safe_int(value: Any, default: int) -> int:
     try:
         return int(value)
     except Exception:
@@ -548,6 +2176,165 @@ def _now_ms() -> int:
     return int(__import__("time").time() * 1000)
 
 
+_tokenizer_lock = threading.Lock()
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def _get_tokenizer():
+    """Get the local tiktoken encoder lazily, or None to use approximate counts."""
+    global _tokenizer, _tokenizer_loaded
+    if _tokenizer_loaded:
+        return _tokenizer
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            try:
+                import tiktoken
+
+                _tokenizer = tiktoken.get_encoding(PROMPT_TOKENIZER_ENCODING)
+            except Exception as exc:
+                logger.warning("tiktoken unavailable (%s); using approximate token counts", exc)
+                _tokenizer = None
+            _tokenizer_loaded = True
+    return _tokenizer
+
+
+def _count_tokens(text: str | None) -> int:
+    if not text:
+        return 0
+    encoder = _get_tokenizer()
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def _truncate_to_tokens(text: str | None, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens, marking the cut with an ellipsis."""
+    if not text or max_tokens <= 0:
+        return ""
+    encoder = _get_tokenizer()
+    if encoder is None:
+        limit = max_tokens * 4
+        return text if len(text) <= limit else text[: limit - 1] + "…"
+    tokens = encoder.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder.decode(tokens[: max_tokens - 1]) + "…"
+
+
+class PromptBuilder:
+    """Assemble prompt text from named sections under token budgets.
+
+    Items in a section are given most important first and are kept in that
+    order until the section budget is spent: the first item that does not fit
+    is truncated (if enough budget remains), the rest are dropped. When all
+    sections together exceed the total budget, the lowest-priority sections are
+    shrunk first. The same input always produces the same prompt.
+    """
+
+    def __init__(self, total_budget: int):
+        self.total_budget = total_budget
+        self._reserved: Dict[str, int] = {}
+        self._sections: List[Dict[str, Any]] = []
+
+    def reserve(self, name: str, text: str | None) -> "PromptBuilder":
+        """Count text that is sent separately (e.g. the system prompt) against the budget."""
+        self._reserved[name] = self._reserved.get(name, 0) + _count_tokens(text)
+        return self
+
+    def add(
+        self,
+        name: str,
+        items: List[str] | str | None,
+        budget: int,
+        priority: int = 0,
+        header: str | None = None,
+        separator: str = "\n",
+        item_budget: int | None = None,
+        reverse: bool = False,
+    ) -> "PromptBuilder":
+        """Add a section; reverse=True renders the kept items in reverse (e.g. oldest first)."""
+        if isinstance(items, str):
+            items = [items]
+        cleaned = [str(item).strip() for item in items or [] if item and str(item).strip()]
+        if item_budget is not None:
+            cleaned = [_truncate_to_tokens(item, item_budget) for item in cleaned]
+        self._sections.append(
+            {
+                "name": name,
+                "items": cleaned,
+                "budget": budget,
+                "priority": priority,
+                "header": header,
+                "separator": separator,
+                "reverse": reverse,
+            }
+        )
+        return self
+
+    @staticmethod
+    def _fit(items: List[str], budget: int) -> tuple[List[str], int]:
+        kept: List[str] = []
+        used = 0
+        for item in items:
+            cost = _count_tokens(item)
+            if used + cost <= budget:
+                kept.append(item)
+                used += cost
+                continue
+            remaining = budget - used
+            if remaining >= PROMPT_MIN_ITEM_TOKENS or (not kept and remaining > 0):
+                cut = _truncate_to_tokens(item, remaining)
+                kept.append(cut)
+                used += _count_tokens(cut)
+            break
+        return kept, used
+
+    def build(self) -> Dict[str, Any]:
+        """Return {"text", "tokens", "sections", "dropped"}; tokens include reserved text."""
+        fitted = {s["name"]: self._fit(s["items"], s["budget"]) for s in self._sections}
+        available = max(self.total_budget - sum(self._reserved.values()), 0)
+        overflow = sum(used for _, used in fitted.values()) - available
+        for section in sorted(self._sections, key=lambda s: s["priority"]):
+            if overflow <= 0:
+                break
+            _, used = fitted[section["name"]]
+            kept, shrunk = self._fit(section["items"], max(used - overflow, 0))
+            fitted[section["name"]] = (kept, shrunk)
+            overflow -= used - shrunk
+
+        parts = []
+        for section in self._sections:
+            kept, _ = fitted[section["name"]]
+            if not kept:
+                continue
+            ordered = list(reversed(kept)) if section["reverse"] else kept
+            body = section["separator"].join(ordered)
+            parts.append(f"{section['header']}\n{body}" if section["header"] else body)
+        text = "\n\n".join(parts)
+
+        sections = dict(self._reserved)
+        sections.update({name: used for name, (_, used) in fitted.items()})
+        return {
+            "text": text,
+            "tokens": _count_tokens(text) + sum(self._reserved.values()),
+            "sections": sections,
+            "dropped": {
+                s["name"]: len(s["items"]) - len(fitted[s["name"]][0]) for s in self._sections
+            },
+        }
+
+
+def _log_prompt_usage(endpoint: str, prompt: Dict[str, Any]) -> None:
+    logger.info(
+        "%s prompt tokens: total=%s sections=%s dropped=%s",
+        endpoint,
+        prompt["tokens"],
+        prompt["sections"],
+        {k: v for k, v in prompt["dropped"].items() if v},
+    )
+
+
 def _agent_instructions(agent_id: str) -> str | None:
     agent_id = (agent_id or "").strip()
     if agent_id == "reasoner":
@@ -571,15 +2358,10 @@ def _agent_instructions(agent_id: str) -> str | None:
     return None
 
 
-@https_fn.on_request()
-def api(req: https_fn.Request) -> https_fn.Response:
-    if req.method == "OPTIONS":
-        return https_fn.Response("", status=204, headers=_cors_headers())
-
-    path = (req.path or "").rstrip("/") or "/"
-
+def _handle_corti(req: https_fn.Request, path: str) -> https_fn.Response:
+    """Placeholders for the Node /api/corti and /api/agents routes."""
     if path == "/api/corti/transcribe":
-        return transcribe_audio(req)
+        return _handle_transcribe_audio(req)
 
     if path == "/api/corti/dictate":
         return _json_response(
@@ -635,97 +2417,583 @@ def api(req: https_fn.Request) -> https_fn.Response:
     )
 
 
-@https_fn.on_request()
-def transcribe_audio(req: https_fn.Request) -> https_fn.Response:
-    logger.info(
-        "Incoming transcription request: method=%s content_type=%s",
-        req.method,
-        req.content_type,
+TRANSCRIBE_STREAMING = os.getenv("TRANSCRIBE_STREAMING", "").strip().lower() in ("1", "true", "yes")
+TRANSCRIBE_STREAM_CHUNK_BYTES = _env_int("TRANSCRIBE_STREAM_CHUNK_BYTES", 256 * 1024)
+TRANSCRIBE_MAX_FIELD_BYTES = _env_int("TRANSCRIBE_MAX_FIELD_BYTES", 64 * 1024)
+TRANSCRIBE_FORM_FIELDS = ("model", "language", "prompt", "response_format", "temperature")
+
+
+class _TranscribeFormError(ValueError):
+    """Invalid transcription form input."""
+
+
+def _transcribe_params(fields) -> Dict[str, Any]:
+    """Upstream transcription parameters from the submitted form fields."""
+    data: Dict[str, Any] = {"model": fields.get("model") or DEFAULT_TRANSCRIBE_MODEL}
+    for field in ("language", "prompt", "response_format"):
+        if fields.get(field):
+            data[field] = fields[field]
+    if fields.get("temperature"):
+        try:
+            data["temperature"] = float(fields["temperature"])
+        except ValueError:
+            raise _TranscribeFormError("temperature must be a number between 0 and 1.")
+    return data
+
+
+class _MultipartPassThrough:
+    """Re-frame an incoming multipart body for the upstream while it is read.
+
+    prime() reads up to the start of the audio part, collecting the form
+    fields sent before it. Iterating then yields the outgoing multipart body:
+    the audio bytes as they arrive, followed by the form fields (including
+    ones sent after the audio). Memory stays around one read chunk.
+    """
+
+    def __init__(self, stream, boundary: bytes, file_field: str = "file"):
+        from werkzeug.sansio.multipart import MultipartDecoder
+
+        self.fields: Dict[str, str] = {}
+        self.filename = "audio"
+        self.mimetype = "application/octet-stream"
+        self.bytes_read = 0
+        self.boundary = f"transcribe-{os.urandom(12).hex()}"
+        self._stream = stream
+        self._file_field = file_field
+        # The decoder's limit applies to its unconsumed buffer, which holds at
+        # most one read chunk plus a partial part header.
+        self._decoder = MultipartDecoder(
+            boundary,
+            max_form_memory_size=TRANSCRIBE_STREAM_CHUNK_BYTES + TRANSCRIBE_MAX_FIELD_BYTES,
+            max_parts=64,
+        )
+        self._events = self._decode_events()
+        self._field_name: str | None = None
+        self._field_data = bytearray()
+        self.audio_sha256 = hashlib.sha256()
+        self.cache_key: str | None = None
+        # Called with the upload once the whole body has been read, before the
+        # closing boundary is sent; raising here aborts the upstream request.
+        self.before_finish = None
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def _decode_events(self):
+        from werkzeug.sansio.multipart import Epilogue, NeedData
+
+        eof = False
+        while True:
+            event = self._decoder.next_event()
+            if isinstance(event, NeedData):
+                if eof:
+                    raise _TranscribeFormError("Truncated multipart body.")
+                chunk = self._stream.read(TRANSCRIBE_STREAM_CHUNK_BYTES)
+                self.bytes_read += len(chunk)
+                eof = not chunk
+                self._decoder.receive_data(chunk or None)
+                continue
+            if isinstance(event, Epilogue):
+                return
+            yield event
+
+    def _consume_field(self, event) -> None:
+        from werkzeug.sansio.multipart import Data, Field
+
+        if isinstance(event, Field):
+            self._field_name = event.name
+            self._field_data.clear()
+        elif isinstance(event, Data) and self._field_name is not None:
+            self._field_data += event.data
+            if len(self._field_data) > TRANSCRIBE_MAX_FIELD_BYTES:
+                raise _TranscribeFormError(f"Form field '{self._field_name}' is too large.")
+            if not event.more_data:
+                if self._field_name in TRANSCRIBE_FORM_FIELDS:
+                    self.fields[self._field_name] = self._field_data.decode("utf-8", "replace")
+                self._field_name = None
+        else:
+            # Other file parts are skipped.
+            self._field_name = None
+
+    def prime(self) -> bool:
+        """Read until the audio part starts; False if the body has no audio part."""
+        from werkzeug.sansio.multipart import File
+
+        for event in self._events:
+            if isinstance(event, File) and event.name == self._file_field:
+                self.filename = event.filename or "audio"
+                self.mimetype = event.headers.get("Content-Type") or self.mimetype
+                return True
+            self._consume_field(event)
+        return False
+
+    def upstream_fields(self) -> Dict[str, Any]:
+        return _transcribe_params(self.fields)
+
+    def _part_header(self, name: str, filename: str | None = None, mimetype: str | None = None) -> bytes:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            safe_name = re.sub(r'[\r\n"]', "_", filename)
+            disposition += f'; filename="{safe_name}"'
+        header = f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n"
+        if mimetype:
+            header += f"Content-Type: {mimetype}\r\n"
+        return (header + "\r\n").encode("utf-8")
+
+    def __iter__(self):
+        from werkzeug.sansio.multipart import Data, Field, File
+
+        yield self._part_header(self._file_field, self.filename, self.mimetype)
+        in_audio = True
+        for event in self._events:
+            if in_audio and isinstance(event, Data):
+                if event.data:
+                    self.audio_sha256.update(event.data)
+                    yield event.data
+                if not event.more_data:
+                    in_audio = False
+                    yield b"\r\n"
+                continue
+            if isinstance(event, (Field, File)):
+                in_audio = False
+            self._consume_field(event)
+        if self.before_finish is not None:
+            self.before_finish(self)
+        for name, value in self.upstream_fields().items():
+            yield self._part_header(name) + str(value).encode("utf-8") + b"\r\n"
+        yield f"--{self.boundary}--\r\n".encode("utf-8")
+
+
+def _transcribe_streaming_requested(req: https_fn.Request) -> bool:
+    flag = (req.args.get("stream") or "").strip().lower()
+    if flag:
+        return flag in ("1", "true", "yes")
+    return TRANSCRIBE_STREAMING
+
+
+# Transcripts of identical uploads (same audio bytes and parameters) are served
+# from memory; clinicians often re-submit a recording after a UI error.
+TRANSCRIBE_CACHE_TTL_SECONDS = _env_float("TRANSCRIBE_CACHE_TTL_SECONDS", 6 * 3600.0)
+TRANSCRIBE_CACHE_MAX_ENTRIES = _env_int("TRANSCRIBE_CACHE_MAX_ENTRIES", 256)
+
+_transcript_cache = _TTLCache(TRANSCRIBE_CACHE_MAX_ENTRIES, TRANSCRIBE_CACHE_TTL_SECONDS)
+
+
+class _TranscriptCacheHit(Exception):
+    """Raised from a streamed upload to abort it when the transcript is cached."""
+
+    def __init__(self, cached: Dict[str, Any]):
+        super().__init__("transcript cached")
+        self.cached = cached
+
+
+def _hash_audio_stream(stream) -> str:
+    """sha256 of a seekable upload, read in chunks; leaves the stream rewound."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(TRANSCRIBE_STREAM_CHUNK_BYTES), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _transcript_cache_key(audio_sha256: str, data: Dict[str, Any]) -> str:
+    params = {field: data.get(field) for field in TRANSCRIBE_FORM_FIELDS}
+    return hashlib.sha256(
+        json.dumps({"audio": audio_sha256, **params}, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _check_transcript_cache(upload: "_MultipartPassThrough") -> None:
+    """before_finish hook for streamed uploads.
+
+    The audio hash is only known once the body has been read, so a hit aborts
+    the upload before the closing boundary is sent.
+    """
+    upload.cache_key = _transcript_cache_key(upload.audio_sha256.hexdigest(), upload.upstream_fields())
+    cached = _transcript_cache.get(upload.cache_key)
+    if cached is not None:
+        raise _TranscriptCacheHit(cached)
+
+
+def _cached_transcript_response(cached: Dict[str, Any]) -> https_fn.Response:
+    logger.info("Transcription served from cache: %s", _transcript_cache.stats())
+    response_headers = _cors_headers()
+    response_headers["Content-Type"] = cached["contentType"]
+    return https_fn.Response(
+        cached["body"],
+        status=200,
+        headers=response_headers,
+        content_type=cached["contentType"],
     )
 
-    if req.method == "OPTIONS":
-        return https_fn.Response(
-            "",
-            status=204,
-            headers=_cors_headers(),
+
+# Long recordings are split into overlapping segments with ffmpeg, transcribed
+# concurrently and stitched, so wall-clock follows the segment length.
+TRANSCRIBE_LONG_AUDIO_SECONDS = _env_float("TRANSCRIBE_LONG_AUDIO_SECONDS", 600.0)
+TRANSCRIBE_LONG_AUDIO_MIN_BYTES = _env_int("TRANSCRIBE_LONG_AUDIO_MIN_BYTES", 1024 * 1024)
+TRANSCRIBE_SEGMENT_SECONDS = _env_float("TRANSCRIBE_SEGMENT_SECONDS", 300.0)
+TRANSCRIBE_SEGMENT_OVERLAP_SECONDS = _env_float("TRANSCRIBE_SEGMENT_OVERLAP_SECONDS", 4.0)
+TRANSCRIBE_SEGMENT_CONCURRENCY = _env_int("TRANSCRIBE_SEGMENT_CONCURRENCY", 4)
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFMPEG_TIMEOUT_SECONDS = _env_float("FFMPEG_TIMEOUT_SECONDS", 300.0)
+# transcribe_audio, and api which routes it, decode and segment recordings of
+# up to an hour in memory-backed /tmp and wait on several waves of segment
+# calls, so they get this timeout and 2 GiB (a whole CPU at gcf_gen1 sizing).
+TRANSCRIBE_TIMEOUT_SECONDS = _env_int("TRANSCRIBE_TIMEOUT_SECONDS", 540)
+
+
+def _ffmpeg(*args: str) -> subprocess.CompletedProcess:
+    """Run ffmpeg quietly; raises RuntimeError when the binary is missing or fails."""
+    binary = shutil.which(FFMPEG_BINARY)
+    if not binary:
+        raise RuntimeError(f"{FFMPEG_BINARY} not found")
+    with _span("ffmpeg"):
+        result = subprocess.run(
+            [binary, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", *args],
+            capture_output=True,
+            text=True,
+            timeout=FFMPEG_TIMEOUT_SECONDS,
         )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-300:]}")
+    return result
 
-    if req.method != "POST":
-        return _error("Only POST requests are supported.", status=405)
 
-    if not OPENAI_API_KEY:
-        return _error("OPENAI_API_KEY is not configured.", status=500)
+def _probe_duration_seconds(path: str) -> float | None:
+    """Container duration from ffmpeg's input banner; None when the file has none."""
+    binary = shutil.which(FFMPEG_BINARY)
+    if not binary:
+        return None
+    with _span("ffprobe"):
+        result = subprocess.run(
+            [binary, "-nostdin", "-hide_banner", "-i", path],
+            capture_output=True,
+            text=True,
+            timeout=FFMPEG_TIMEOUT_SECONDS,
+        )
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _segment_windows(duration: float, segment: float, overlap: float) -> list[tuple[float, float]]:
+    """(start, length) windows covering duration; consecutive windows share overlap seconds."""
+    step = max(segment - overlap, 1.0)
+    windows = []
+    start = 0.0
+    while start < duration:
+        length = min(segment, duration - start)
+        windows.append((start, length))
+        if start + length >= duration:
+            break
+        start += step
+    return windows
+
+
+def _stitch_transcripts(texts: list[str], max_overlap_words: int) -> str:
+    """Join segment transcripts, dropping the words repeated in each overlap.
+
+    The longest run of (normalized) words shared by the end of the text so far
+    and the start of the next segment is kept once; without such a run the
+    texts are simply concatenated.
+    """
+    import difflib
+
+    def normalize(word: str) -> str:
+        return re.sub(r"[^\w]", "", word.lower())
+
+    words: list[str] = []
+    for text in texts:
+        incoming = text.split()
+        if not words:
+            words = incoming
+            continue
+        tail = words[-max_overlap_words:]
+        head = incoming[:max_overlap_words]
+        matcher = difflib.SequenceMatcher(
+            None, [normalize(w) for w in tail], [normalize(w) for w in head], autojunk=False
+        )
+        match = matcher.find_longest_match(0, len(tail), 0, len(head))
+        if match.size >= 3:
+            words = words[: len(words) - len(tail) + match.a] + incoming[match.b :]
+        else:
+            words += incoming
+    return " ".join(words)
 
-    if not req.content_type or "multipart/form-data" not in req.content_type:
-        return _error("Content-Type must be multipart/form-data.", status=400)
 
-    file_storage = req.files.get("file") if req.files else None
-    if not file_storage:
-        return _error("Missing audio file in 'file' field.", status=400)
+def _post_transcription_file(fh, filename: str, mimetype: str, data: Dict[str, Any]) -> requests.Response:
+    """Upload one file to the transcription endpoint with retries and telemetry."""
 
-    logger.info(
-        "Audio file received: name=%s mimetype=%s",
-        file_storage.filename,
-        file_storage.mimetype,
+    def attempt(remaining: float) -> requests.Response:
+        fh.seek(0)
+        return get_http_session().post(
+            OPENAI_TRANSCRIBE_URL,
+            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+            data=data,
+            files={"file": (filename, fh, mimetype)},
+            timeout=(OPENAI_CONNECT_TIMEOUT_SECONDS, min(remaining, REQUEST_TIMEOUT_SECONDS)),
+        )
+
+    started = time.perf_counter()
+    try:
+        response, retries = _call_upstream(openai_transcribe_breaker, attempt)
+    except Exception as exc:
+        _record_model_call(
+            "transcribe_audio",
+            None,
+            data["model"],
+            (time.perf_counter() - started) * 1000,
+            error=type(exc).__name__,
+        )
+        raise
+    _record_model_call(
+        "transcribe_audio",
+        None,
+        data["model"],
+        (time.perf_counter() - started) * 1000,
+        retries=retries,
+        error=None if response.ok else f"HTTP {response.status_code}",
+    )
+    return response
+
+
+def _transcription_error_response(openai_response: requests.Response) -> https_fn.Response:
+    logger.warning(
+        "OpenAI transcription failed: status=%s body=%s",
+        openai_response.status_code,
+        openai_response.text,
     )
+    try:
+        error_payload = openai_response.json()
+    except ValueError:
+        error_payload = {"message": openai_response.text}
+    error_payload = {
+        "error": "OpenAI transcription failed.",
+        "details": error_payload,
+    }
+    return _json_response(error_payload, status=openai_response.status_code)
+
+
+def _transcribe_long_audio(file_storage, data: Dict[str, Any]) -> https_fn.Response | None:
+    """Transcribe a long recording as overlapping segments in parallel.
 
+    Returns None when the upload should take the single-request path: short
+    audio, a response_format other than json, or ffmpeg not available.
+    """
+    if TRANSCRIBE_LONG_AUDIO_SECONDS <= 0 or data.get("response_format") not in (None, "json"):
+        return None
+    file_storage.stream.seek(0, os.SEEK_END)
+    size = file_storage.stream.tell()
     file_storage.stream.seek(0)
-    files = {
-        "file": (
-            file_storage.filename or "audio",
-            file_storage.stream,
-            file_storage.mimetype or "application/octet-stream",
+    if size < TRANSCRIBE_LONG_AUDIO_MIN_BYTES:
+        return None
+    if not shutil.which(FFMPEG_BINARY):
+        logger.warning("ffmpeg not found; sending %s bytes as a single transcription request", size)
+        return None
+
+    with tempfile.TemporaryDirectory(prefix="transcribe-") as workdir:
+        source = os.path.join(workdir, "source")
+        with open(source, "wb") as fh:
+            shutil.copyfileobj(file_storage.stream, fh)
+        file_storage.stream.seek(0)
+
+        duration = _probe_duration_seconds(source)
+        if duration is None:
+            # MediaRecorder webm has no duration header; decode once to find it.
+            normalized = os.path.join(workdir, "source.flac")
+            _ffmpeg("-i", source, "-vn", "-ac", "1", "-ar", "16000", "-c:a", "flac", normalized)
+            source = normalized
+            duration = _probe_duration_seconds(source)
+        if duration is None or duration <= TRANSCRIBE_LONG_AUDIO_SECONDS:
+            return None
+
+        windows = _segment_windows(
+            duration, TRANSCRIBE_SEGMENT_SECONDS, TRANSCRIBE_SEGMENT_OVERLAP_SECONDS
         )
-    }
+        segment_data = {**data, "response_format": "json"}
 
-    data: Dict[str, Any] = {
-        "model": req.form.get("model") or DEFAULT_TRANSCRIBE_MODEL,
-    }
+        def transcribe_segment(index: int, start: float, length: float) -> requests.Response:
+            path = os.path.join(workdir, f"segment-{index:03d}.flac")
+            _ffmpeg(
+                "-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", source,
+                "-vn", "-ac", "1", "-ar", "16000", "-c:a", "flac", path,
+            )
+            with open(path, "rb") as fh:
+                return _post_transcription_file(fh, os.path.basename(path), "audio/flac", segment_data)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(
+            max_workers=max(TRANSCRIBE_SEGMENT_CONCURRENCY, 1), thread_name_prefix="transcribe"
+        ) as pool:
+            futures = [
+                _submit_traced(pool, "segment", transcribe_segment, index, start, length)
+                for index, (start, length) in enumerate(windows)
+            ]
+            responses = [future.result() for future in futures]
 
-    optional_string_fields = (
-        "language",
-        "prompt",
-        "response_format",
+    for response in responses:
+        if not response.ok:
+            return _transcription_error_response(response)
+    texts = [str((response.json() or {}).get("text") or "") for response in responses]
+    text = _stitch_transcripts(texts, max_overlap_words=int(TRANSCRIBE_SEGMENT_OVERLAP_SECONDS * 5) + 10)
+    logger.info(
+        "Long audio transcribed: duration=%.0fs segments=%s elapsed=%.1fs",
+        duration,
+        len(windows),
+        time.perf_counter() - started,
+    )
+    return _json_response(
+        {"text": text, "segments": len(windows), "durationSeconds": round(duration, 1)},
+        status=200,
     )
-    for field in optional_string_fields:
-        value = req.form.get(field)
-        if value:
-            data[field] = value
 
-    temperature = req.form.get("temperature")
-    if temperature:
+
+# Optional preprocessing: browsers upload 48 kHz stereo WAV/WebM at high
+# bitrates, while speech transcribes as well from mono 16 kHz Opus, so
+# re-encoding first shrinks both the upload and what the upstream decodes.
+TRANSCRIBE_PREPROCESS = os.getenv("TRANSCRIBE_PREPROCESS", "").strip().lower() in ("1", "true", "yes")
+TRANSCRIBE_PREPROCESS_BITRATE = os.getenv("TRANSCRIBE_PREPROCESS_BITRATE", "24k")
+TRANSCRIBE_PREPROCESS_MIN_BYTES = _env_int("TRANSCRIBE_PREPROCESS_MIN_BYTES", 256 * 1024)
+TRANSCRIBE_PREPROCESS_MIN_KBPS = _env_float("TRANSCRIBE_PREPROCESS_MIN_KBPS", 48.0)
+TRANSCRIBE_TRIM_SILENCE = os.getenv("TRANSCRIBE_TRIM_SILENCE", "").strip().lower() in ("1", "true", "yes")
+TRANSCRIBE_SILENCE_THRESHOLD_DB = _env_float("TRANSCRIBE_SILENCE_THRESHOLD_DB", -45.0)
+TRANSCRIBE_SILENCE_MIN_SECONDS = _env_float("TRANSCRIBE_SILENCE_MIN_SECONDS", 1.0)
+
+
+def _transcribe_preprocess_requested(req: https_fn.Request) -> bool:
+    flag = (req.args.get("preprocess") or "").strip().lower()
+    if flag:
+        return flag in ("1", "true", "yes")
+    return TRANSCRIBE_PREPROCESS
+
+
+def _preprocess_audio(file_storage):
+    """Re-encode an upload as mono 16 kHz Opus, optionally trimming long silences.
+
+    Returns a new FileStorage over the re-encoded audio, or None when the
+    original should be sent: the upload is small or already low-bitrate,
+    ffmpeg is missing or fails, or the result would not be smaller.
+    """
+    from werkzeug.datastructures import FileStorage
+
+    file_storage.stream.seek(0, os.SEEK_END)
+    size = file_storage.stream.tell()
+    file_storage.stream.seek(0)
+    if size < TRANSCRIBE_PREPROCESS_MIN_BYTES or not shutil.which(FFMPEG_BINARY):
+        return None
+
+    filters = []
+    if TRANSCRIBE_TRIM_SILENCE:
+        threshold = f"{TRANSCRIBE_SILENCE_THRESHOLD_DB:g}dB"
+        # Keep a short pause where silence is cut so words stay separated.
+        filters.append(
+            f"silenceremove=start_periods=1:start_threshold={threshold}"
+            f":stop_periods=-1:stop_duration={TRANSCRIBE_SILENCE_MIN_SECONDS:g}"
+            f":stop_threshold={threshold}:stop_silence=0.3"
+        )
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="preprocess-") as workdir:
+        source = os.path.join(workdir, "source")
+        target = os.path.join(workdir, "speech.ogg")
+        with open(source, "wb") as fh:
+            shutil.copyfileobj(file_storage.stream, fh)
+        file_storage.stream.seek(0)
+        duration = _probe_duration_seconds(source)
+        if duration and size * 8 / duration / 1000 <= TRANSCRIBE_PREPROCESS_MIN_KBPS:
+            return None
         try:
-            data["temperature"] = float(temperature)
-        except ValueError:
-            return _error("temperature must be a number between 0 and 1.", status=400)
+            _ffmpeg(
+                "-i", source, "-vn", "-ac", "1", "-ar", "16000",
+                *(["-af", ",".join(filters)] if filters else []),
+                "-c:a", "libopus", "-b:a", TRANSCRIBE_PREPROCESS_BITRATE,
+                "-application", "voip", target,
+            )
+        except (RuntimeError, subprocess.TimeoutExpired):
+            logger.exception("Audio preprocessing failed; sending the original upload")
+            return None
+        processed_size = os.path.getsize(target)
+        if processed_size >= size:
+            return None
+        # The open handle keeps the file readable after the directory is removed.
+        stream = open(target, "rb")
+
+    logger.info(
+        "Audio preprocessed: bytes=%s->%s saved=%.0f%% trimSilence=%s elapsed=%.0fms",
+        size,
+        processed_size,
+        100.0 * (size - processed_size) / size,
+        TRANSCRIBE_TRIM_SILENCE,
+        (time.perf_counter() - started) * 1000,
+    )
+    base_name = os.path.splitext(file_storage.filename or "audio")[0] or "audio"
+    return FileStorage(stream=stream, filename=f"{base_name}.ogg", content_type="audio/ogg")
 
+
+def _run_transcription(
+    post_transcription,
+    data: Dict[str, Any],
+    cache_key: str | None = None,
+    upload: _MultipartPassThrough | None = None,
+) -> https_fn.Response:
+    """Send one transcription request through the breaker and build the response."""
+    transcribe_started = time.perf_counter()
+    transcribe_retries = 0
     try:
-        openai_response = requests.post(
-            OPENAI_TRANSCRIBE_URL,
-            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
-            data=data,
-            files=files,
-            timeout=REQUEST_TIMEOUT_SECONDS,
+        openai_response, transcribe_retries = _call_upstream(
+            openai_transcribe_breaker,
+            post_transcription,
+            # A streamed body is consumed by the first attempt.
+            max_attempts=1 if upload is not None else None,
         )
+    except _TranscriptCacheHit as hit:
+        return _cached_transcript_response(hit.cached)
+    except _TranscribeFormError as exc:
+        return _error(str(exc), status=400)
+    except _UpstreamUnavailable as exc:
+        _record_model_call(
+            "transcribe_audio",
+            None,
+            data["model"],
+            (time.perf_counter() - transcribe_started) * 1000,
+            error=type(exc).__name__,
+        )
+        logger.warning("OpenAI transcription unavailable: %s", exc)
+        return _upstream_unavailable_response(exc)
     except requests.RequestException as exc:
+        _record_model_call(
+            "transcribe_audio",
+            None,
+            data["model"],
+            (time.perf_counter() - transcribe_started) * 1000,
+            error=type(exc).__name__,
+        )
         logger.exception("Failed to call OpenAI transcription endpoint.")
         return _error(f"Failed to reach OpenAI: {exc}", status=502)
 
-    if not openai_response.ok:
-        logger.warning(
-            "OpenAI transcription failed: status=%s body=%s",
-            openai_response.status_code,
-            openai_response.text,
-        )
+    transcribe_usage: Dict[str, Any] = {}
+    if openai_response.ok and "json" in (openai_response.headers.get("Content-Type") or ""):
         try:
-            error_payload = openai_response.json()
-        except ValueError:
-            error_payload = {"message": openai_response.text}
-        error_payload = {
-            "error": "OpenAI transcription failed.",
-            "details": error_payload,
-        }
-        return _json_response(error_payload, status=openai_response.status_code)
+            transcribe_usage = (openai_response.json() or {}).get("usage") or {}
+        except (ValueError, AttributeError):
+            transcribe_usage = {}
+    _record_model_call(
+        "transcribe_audio",
+        None,
+        data["model"],
+        (time.perf_counter() - transcribe_started) * 1000,
+        prompt_tokens=_safe_int(transcribe_usage.get("input_tokens"), 0),
+        completion_tokens=_safe_int(transcribe_usage.get("output_tokens"), 0),
+        retries=transcribe_retries,
+        error=None if openai_response.ok else f"HTTP {openai_response.status_code}",
+    )
+
+    if not openai_response.ok:
+        return _transcription_error_response(openai_response)
 
     response_headers = _cors_headers()
     response_headers["Content-Type"] = "application/json"
@@ -735,6 +3003,13 @@ def transcribe_audio(req: https_fn.Request) -> https_fn.Response:
         openai_response.status_code,
     )
 
+    if upload is not None:
+        cache_key = upload.cache_key
+    if cache_key is not None:
+        _transcript_cache.set(
+            cache_key, {"body": openai_response.text, "contentType": "application/json"}
+        )
+
     return https_fn.Response(
         openai_response.text,
         status=openai_response.status_code,
@@ -743,11 +3018,84 @@ def transcribe_audio(req: https_fn.Request) -> https_fn.Response:
     )
 
 
-@https_fn.on_request()
-def openai_completion(req: https_fn.Request) -> https_fn.Response:
+def _transcribe_buffered(
+    file_storage,
+    data: Dict[str, Any],
+    audio_sha256: str | None = None,
+    preprocess: bool = False,
+) -> https_fn.Response:
+    """Transcribe a seekable upload: cache, optional preprocessing, then upstream.
+
+    The cache is keyed on the original audio so re-submissions hit it whether
+    or not they were preprocessed.
+    """
+    cache_key = _transcript_cache_key(
+        audio_sha256 or _hash_audio_stream(file_storage.stream), data
+    )
+    cached = _transcript_cache.get(cache_key)
+    if cached is not None:
+        return _cached_transcript_response(cached)
+
+    processed = _preprocess_audio(file_storage) if preprocess else None
+    if processed is None:
+        return _transcribe_upload(file_storage, data, cache_key)
+    try:
+        return _transcribe_upload(processed, data, cache_key)
+    finally:
+        processed.close()
+
+
+def _transcribe_upload(file_storage, data: Dict[str, Any], cache_key: str) -> https_fn.Response:
+    """Send a seekable upload upstream, as segments when it is a long recording."""
+    try:
+        long_audio_response = _transcribe_long_audio(file_storage, data)
+    except _UpstreamUnavailable as exc:
+        logger.warning("OpenAI transcription unavailable: %s", exc)
+        return _upstream_unavailable_response(exc)
+    except requests.RequestException as exc:
+        logger.exception("Failed to call OpenAI transcription endpoint.")
+        return _error(f"Failed to reach OpenAI: {exc}", status=502)
+    except (RuntimeError, subprocess.TimeoutExpired):
+        logger.exception("Long audio segmentation failed; sending as a single request")
+        long_audio_response = None
+    if long_audio_response is not None:
+        if long_audio_response.status_code == 200:
+            _transcript_cache.set(
+                cache_key,
+                {
+                    "body": long_audio_response.get_data(as_text=True),
+                    "contentType": "application/json",
+                },
+            )
+        return long_audio_response
+
+    files = {
+        "file": (
+            file_storage.filename or "audio",
+            file_storage.stream,
+            file_storage.mimetype or "application/octet-stream",
+        )
+    }
+
+    def post_transcription(remaining: float) -> requests.Response:
+        # Rewind so every retry uploads the whole file again.
+        file_storage.stream.seek(0)
+        return get_http_session().post(
+            OPENAI_TRANSCRIBE_URL,
+            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+            data=data,
+            files=files,
+            timeout=(OPENAI_CONNECT_TIMEOUT_SECONDS, min(remaining, REQUEST_TIMEOUT_SECONDS)),
+        )
+
+    return _run_transcription(post_transcription, data, cache_key=cache_key)
+
+
+def _handle_transcribe_audio(req: https_fn.Request) -> https_fn.Response:
     logger.info(
-        "Incoming OpenAI completion request: method=%s",
+        "Incoming transcription request: method=%s content_type=%s",
         req.method,
+        req.content_type,
     )
 
     if req.method == "OPTIONS":
@@ -760,134 +3108,473 @@ def openai_completion(req: https_fn.Request) -> https_fn.Response:
     if req.method != "POST":
         return _error("Only POST requests are supported.", status=405)
 
-    try:
-        request_data = req.get_json(silent=True)
-        if not request_data:
-            return _error("Request body must be valid JSON.", status=400)
+    if not OPENAI_API_KEY:
+        return _error("OPENAI_API_KEY is not configured.", status=500)
 
-        userprompt = request_data.get("userprompt")
-        if not userprompt:
-            return _error("Missing 'userprompt' in request body.", status=400)
+    if not req.content_type or "multipart/form-data" not in req.content_type:
+        return _error("Content-Type must be multipart/form-data.", status=400)
 
-        logger.info("Received userprompt: %s", userprompt)
+    if _transcribe_streaming_requested(req):
+        # Streaming proxy: never touch req.files, so Werkzeug does not buffer
+        # the body; the audio is forwarded with chunked transfer as it arrives.
+        # Preprocessing needs the whole file and does not apply here.
+        boundary = req.mimetype_params.get("boundary")
+        if not boundary:
+            return _error("Missing multipart boundary.", status=400)
+        upload = _MultipartPassThrough(req.stream, boundary.encode("latin-1"))
+        try:
+            if not upload.prime():
+                return _error("Missing audio file in 'file' field.", status=400)
+            data = upload.upstream_fields()
+        except _TranscribeFormError as exc:
+            return _error(str(exc), status=400)
+        except ValueError:
+            return _error("Malformed multipart body.", status=400)
 
-        # Initialize OpenAI client with API key from environment
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            logger.error("OPENAI_API_KEY is not set in environment variables.")
-            return _error("Server configuration error: Missing API key.", status=500)
+        logger.info(
+            "Audio stream received: name=%s mimetype=%s",
+            upload.filename,
+            upload.mimetype,
+        )
+        upload.before_finish = _check_transcript_cache
+
+        def post_transcription(remaining: float) -> requests.Response:
+            return get_http_session().post(
+                OPENAI_TRANSCRIBE_URL,
+                headers={
+                    "Authorization": f"Bearer {OPENAI_API_KEY}",
+                    "Content-Type": upload.content_type,
+                },
+                data=iter(upload),
+                timeout=(OPENAI_CONNECT_TIMEOUT_SECONDS, min(remaining, REQUEST_TIMEOUT_SECONDS)),
+            )
 
-        client = OpenAI(api_key=api_key)
+        return _run_transcription(post_transcription, data, upload=upload)
 
-        # Create completion using chat completions API
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # Using a valid model name
-            messages=[
-                {"role": "user", "content": userprompt}
-            ]
-        )
+    file_storage = req.files.get("file") if req.files else None
+    if not file_storage:
+        return _error("Missing audio file in 'file' field.", status=400)
 
-        # Extract the message content
-        message_output = response.choices[0].message.content
+    logger.info(
+        "Audio file received: name=%s mimetype=%s",
+        file_storage.filename,
+        file_storage.mimetype,
+    )
 
-        # Print to console log
-        logger.info("OpenAI completion output: %s", message_output)
-        print(f"OpenAI completion output: {message_output}")
+    try:
+        data = _transcribe_params(req.form)
+    except _TranscribeFormError as exc:
+        return _error(str(exc), status=400)
 
-        return _json_response(
-            {
-                "output": message_output,
-                "message": response.choices[0].message.model_dump()
-            },
-            status=200,
-        )
+    return _transcribe_buffered(file_storage, data, preprocess=_transcribe_preprocess_requested(req))
 
-    except Exception as exc:
-        logger.exception("Failed to process OpenAI completion request.")
-        return _error(f"Failed to process request: {exc}", status=500)
 
+@https_fn.on_request(
+    timeout_sec=TRANSCRIBE_TIMEOUT_SECONDS,
+    memory=MemoryOption.GB_2,
+    **_concurrency_options("transcribe_audio", HTTP_CONCURRENCY_TRANSCRIBE),
+)
+def transcribe_audio(req: https_fn.Request) -> https_fn.Response:
+    return _serve("transcribe_audio", _handle_transcribe_audio, req)
 
-def _format_entry_for_prompt(entry: Dict[str, Any]) -> str:
-    """Convert a journal entry dict to a short string for the prompt."""
-    title = entry.get("title") or "Ingen titel"
-    date_val = entry.get("date")
-    created_at = entry.get("createdAt")
 
-    date_str = ""
-    if hasattr(date_val, "isoformat"):
-        date_str = date_val.isoformat()
-    elif isinstance(date_val, str):
-        date_str = date_val
+# Asynchronous transcription jobs. Submitting stores the audio in Cloud Storage
+# and creates users/{uid}/transcriptionJobs/{jobId}; process_transcription_job
+# transcribes it in the background and writes the result to the same document,
+# which clients poll through transcribe_audio_job or listen to directly. A job
+# still processing TRANSCRIBE_JOB_STALE_SECONDS after it was claimed belongs
+# to a worker that crashed or hit its timeout; the next poll marks it failed.
+TRANSCRIBE_JOB_BUCKET = os.getenv("TRANSCRIBE_JOB_BUCKET") or None
+TRANSCRIBE_JOB_STORAGE_PREFIX = os.getenv("TRANSCRIBE_JOB_STORAGE_PREFIX", "transcriptionJobs")
+TRANSCRIBE_JOB_TIMEOUT_SECONDS = _env_int("TRANSCRIBE_JOB_TIMEOUT_SECONDS", 540)
+TRANSCRIBE_JOB_STALE_SECONDS = _env_int("TRANSCRIBE_JOB_STALE_SECONDS", TRANSCRIBE_JOB_TIMEOUT_SECONDS + 60)
+TRANSCRIBE_JOB_KEEP_AUDIO = os.getenv("TRANSCRIBE_JOB_KEEP_AUDIO", "").strip().lower() in ("1", "true", "yes")
+# Clients poll with GET, so the preflight must allow it.
+TRANSCRIBE_JOB_CORS_HEADERS = {**CORS_HEADERS, "Access-Control-Allow-Methods": "GET, POST, OPTIONS"}
 
-    if not date_str and hasattr(created_at, "isoformat"):
-        date_str = created_at.isoformat()
-    elif not date_str and isinstance(created_at, str):
-        date_str = created_at
 
-    content = entry.get("content") or entry.get("text") or ""
-    return f"Dato: {date_str or 'ukendt'}\nTitel: {title}\nNotat: {content}"
+def _transcription_jobs_col(user_id: str):
+    return get_db().collection("users").document(user_id).collection("transcriptionJobs")
 
 
-@https_fn.on_request()
-def summarize_journal(req: https_fn.Request) -> https_fn.Response:
-    logger.info("Incoming summarize_journal request: method=%s", req.method)
+def _transcription_job_bucket():
+    from firebase_admin import storage
 
-    if req.method == "OPTIONS":
-        return https_fn.Response("", status=204, headers=_cors_headers())
+    return storage.bucket(TRANSCRIBE_JOB_BUCKET, app=ensure_firebase_app())
 
-    if req.method != "POST":
-        return _error("Only POST requests are supported.", status=405)
 
-    if not OPENAI_API_KEY:
-        return _error("OPENAI_API_KEY is not configured.", status=500)
+def _transcription_job_result(status: int, body: str) -> Dict[str, Any]:
+    """Job document fields for a finished transcription response."""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = None
+    if status != 200:
+        error = payload.get("error") if isinstance(payload, dict) else None
+        fields: Dict[str, Any] = {
+            "status": "failed",
+            "httpStatus": status,
+            "error": str(error or body)[:2000],
+        }
+        if isinstance(payload, dict) and isinstance(payload.get("details"), dict):
+            fields["details"] = payload["details"]
+        return fields
+    fields: Dict[str, Any] = {"status": "done", "httpStatus": 200}
+    if isinstance(payload, dict):
+        fields["text"] = str(payload.get("text") or "")
+        for key in ("segments", "durationSeconds"):
+            if isinstance(payload.get(key), (int, float)):
+                fields[key] = payload[key]
+    else:
+        # text/srt/vtt response formats.
+        fields["text"] = body
+    return fields
+
+
+def _transcription_job_view(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+    view: Dict[str, Any] = {"jobId": job_id, "status": job.get("status")}
+    for key in (
+        "text",
+        "error",
+        "details",
+        "httpStatus",
+        "cached",
+        "filename",
+        "sizeBytes",
+        "segments",
+        "durationSeconds",
+        "createdAtIso",
+        "claimedAtIso",
+        "completedAtIso",
+        "processingMs",
+    ):
+        if job.get(key) is not None:
+            view[key] = job[key]
+    return view
+
+
+def _process_transcription_job(user_id: str, job_id: str) -> str:
+    """Transcribe a queued job; returns the outcome for logging.
+
+    The job is claimed with a precondition on its update time, so a duplicate
+    trigger delivery leaves it to the first worker.
+    """
+    job_ref = _transcription_jobs_col(user_id).document(job_id)
+    snapshot = job_ref.get()
+    if not snapshot.exists:
+        return "missing"
+    job = snapshot.to_dict() or {}
+    if job.get("status") != "queued":
+        return "skipped"
+    try:
+        job_ref.update(
+            {
+                "status": "processing",
+                "startedAt": firestore.SERVER_TIMESTAMP,
+                "claimedAtIso": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            },
+            option=get_db().write_option(last_update_time=snapshot.update_time),
+        )
+    except FailedPrecondition:
+        return "claimed"
+
+    from werkzeug.datastructures import FileStorage
+
+    started = time.perf_counter()
+    # Derived, not read from the job: clients could otherwise point a job at
+    # another user's upload. firestore.rules also keeps job documents read-only.
+    audio_path = f"{TRANSCRIBE_JOB_STORAGE_PREFIX}/{user_id}/{job_id}/audio"
+    blob = _transcription_job_bucket().blob(audio_path)
+    try:
+        if not OPENAI_API_KEY:
+            raise RuntimeError("OPENAI_API_KEY is not configured.")
+        with tempfile.TemporaryFile() as fh:
+            blob.download_to_file(fh)
+            fh.seek(0)
+            file_storage = FileStorage(
+                stream=fh,
+                filename=job.get("filename") or "audio",
+                content_type=job.get("mimetype") or "application/octet-stream",
+            )
+            response = _transcribe_buffered(
+                file_storage,
+                job.get("params") or {"model": DEFAULT_TRANSCRIBE_MODEL},
+                audio_sha256=job.get("audioSha256"),
+                preprocess=bool(job.get("preprocess")),
+            )
+        updates = _transcription_job_result(response.status_code, response.get_data(as_text=True))
+    except Exception as exc:
+        logger.exception("Transcription job failed: uid=%s jobId=%s", user_id, job_id)
+        updates = {"status": "failed", "error": f"{type(exc).__name__}: {exc}"[:2000]}
+
+    updates.update(
+        {
+            "processingMs": int((time.perf_counter() - started) * 1000),
+            "completedAt": firestore.SERVER_TIMESTAMP,
+            "completedAtIso": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        }
+    )
+    job_ref.update(updates)
+
+    if not TRANSCRIBE_JOB_KEEP_AUDIO:
+        try:
+            blob.delete()
+        except Exception:
+            logger.warning("Could not delete job audio %s", audio_path, exc_info=True)
+    return updates["status"]
+
+
+def _expire_stale_transcription_job(job_ref, snapshot) -> Dict[str, Any]:
+    """Fail a job whose worker claimed it and then died; returns the current job."""
+    job = snapshot.to_dict() or {}
+    if job.get("status") != "processing":
+        return job
+    claimed_at = _parse_iso_datetime(job.get("claimedAtIso"))
+    if claimed_at is None:
+        return job
+    stale_for = (datetime.now(timezone.utc) - claimed_at).total_seconds()
+    if stale_for < TRANSCRIBE_JOB_STALE_SECONDS:
+        return job
+    updates = {
+        "status": "failed",
+        "error": "Transcription job timed out.",
+        "httpStatus": 504,
+        "completedAt": firestore.SERVER_TIMESTAMP,
+        "completedAtIso": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }
+    try:
+        job_ref.update(updates, option=get_db().write_option(last_update_time=snapshot.update_time))
+    except FailedPrecondition:
+        # The worker (or another poller) wrote first.
+        return job_ref.get().to_dict() or {}
+    logger.warning("Transcription job expired: jobId=%s claimed %.0fs ago", job_ref.id, stale_for)
+    return {**job, **updates}
+
+
+def _handle_transcribe_audio_job(req: https_fn.Request) -> https_fn.Response:
+    """Submit (POST multipart) or poll (GET ?jobId=) an asynchronous transcription."""
+    if req.method == "OPTIONS":
+        return https_fn.Response(
+            "",
+            status=204,
+            headers=dict(TRANSCRIBE_JOB_CORS_HEADERS),
+        )
+
+    if req.method not in ("GET", "POST"):
+        return _error("Only GET and POST requests are supported.", status=405)
 
     try:
         # Ensure Firebase Admin SDK is initialized before using auth/firestore.
         ensure_firebase_app()
 
-        auth_header = req.headers.get("Authorization", "")
-        id_token = (
-            auth_header[len("Bearer "):].strip()
-            if auth_header.startswith("Bearer ")
-            else None
+        user_id, auth_error = _authenticate(req)
+        if auth_error is not None:
+            return auth_error
+
+        if req.method == "GET":
+            job_id = (req.args.get("jobId") or "").strip()
+            if not job_id:
+                return _error("Missing jobId.", status=400)
+            job_ref = _transcription_jobs_col(user_id).document(job_id)
+            snapshot = job_ref.get()
+            if not snapshot.exists:
+                return _error("Job not found.", status=404)
+            job = _expire_stale_transcription_job(job_ref, snapshot)
+            return _json_response(_transcription_job_view(job_id, job), status=200)
+
+        if not OPENAI_API_KEY:
+            return _error("OPENAI_API_KEY is not configured.", status=500)
+
+        if not req.content_type or "multipart/form-data" not in req.content_type:
+            return _error("Content-Type must be multipart/form-data.", status=400)
+
+        file_storage = req.files.get("file") if req.files else None
+        if not file_storage:
+            return _error("Missing audio file in 'file' field.", status=400)
+
+        try:
+            data = _transcribe_params(req.form)
+        except _TranscribeFormError as exc:
+            return _error(str(exc), status=400)
+
+        audio_sha256 = _hash_audio_stream(file_storage.stream)
+        file_storage.stream.seek(0, os.SEEK_END)
+        size = file_storage.stream.tell()
+        file_storage.stream.seek(0)
+
+        job_ref = _transcription_jobs_col(user_id).document()
+        job_id = job_ref.id
+        now_iso = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        job: Dict[str, Any] = {
+            "params": data,
+            "filename": file_storage.filename or "audio",
+            "mimetype": file_storage.mimetype or "application/octet-stream",
+            "sizeBytes": size,
+            "audioSha256": audio_sha256,
+            "preprocess": _transcribe_preprocess_requested(req),
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "createdAtIso": now_iso,
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        }
+
+        cached = _transcript_cache.get(_transcript_cache_key(audio_sha256, data))
+        if cached is not None:
+            job.update(_transcription_job_result(200, cached["body"]))
+            job.update({"cached": True, "completedAtIso": now_iso})
+            job_ref.set(job)
+            logger.info("Transcription job served from cache: uid=%s jobId=%s", user_id, job_id)
+            return _json_response(_transcription_job_view(job_id, job), status=200)
+
+        audio_path = f"{TRANSCRIBE_JOB_STORAGE_PREFIX}/{user_id}/{job_id}/audio"
+        with _span("storage.upload"):
+            _transcription_job_bucket().blob(audio_path).upload_from_file(
+                file_storage.stream,
+                size=size,
+                content_type=job["mimetype"],
+                rewind=True,
+            )
+        job.update({"status": "queued", "audioPath": audio_path})
+        job_ref.set(job)
+
+        logger.info(
+            "Transcription job queued: uid=%s jobId=%s bytes=%s",
+            user_id,
+            job_id,
+            size,
         )
-        if not id_token:
-            return _error("Missing auth token.", status=401)
+        return _json_response(_transcription_job_view(job_id, job), status=202)
+    except Exception as exc:
+        logger.exception("transcribe_audio_job failed")
+        return _error(f"Transcription job request failed: {exc}", status=500)
 
-        decoded = auth.verify_id_token(id_token)
-        user_id = decoded.get("uid")
-        if not user_id:
-            return _error("Invalid auth token.", status=401)
 
-        data = req.get_json(silent=True) or {}
-        client_id = data.get("clientId")
-        if not client_id:
-            return _error("Missing clientId.", status=400)
+@https_fn.on_request(**_concurrency_options("transcribe_audio_job", HTTP_CONCURRENCY_TRANSCRIBE))
+def transcribe_audio_job(req: https_fn.Request) -> https_fn.Response:
+    return _serve("transcribe_audio_job", _handle_transcribe_audio_job, req)
 
-        entries_ref = (
-            get_db()
-            .collection("users")
-            .document(user_id)
-            .collection("clients")
-            .document(client_id)
-            .collection("journalEntries")
-            .order_by("createdAt", direction=firestore.Query.DESCENDING)
-            .limit(10)
+
+@firestore_fn.on_document_created(
+    document="users/{uid}/transcriptionJobs/{jobId}",
+    database=FIRESTORE_DATABASE_ID,
+    timeout_sec=TRANSCRIBE_JOB_TIMEOUT_SECONDS,
+    memory=MemoryOption.GB_1,
+)
+def process_transcription_job(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]) -> None:
+    try:
+        outcome = _process_transcription_job(event.params["uid"], event.params["jobId"])
+        logger.info(
+            "Transcription job: uid=%s jobId=%s outcome=%s",
+            event.params["uid"],
+            event.params["jobId"],
+            outcome,
         )
-        docs = list(entries_ref.stream())
+    except Exception:
+        logger.exception("Transcription job processing failed")
 
-        if not docs:
-            return _json_response(
-                {"summary": "Der er endnu ingen journalindlæg for denne klient."},
-                status=200,
-            )
 
-        # Oldest to newest for readable chronology
-        parsed_entries: List[Dict[str, Any]] = [doc.to_dict() for doc in reversed(docs)]
-        notes = [_format_entry_for_prompt(entry) for entry in parsed_entries]
-        journal_text = "\n\n".join(notes)
+def _handle_openai_completion(req: https_fn.Request) -> https_fn.Response:
+    if req.method == "OPTIONS":
+        return https_fn.Response(
+            "",
+            status=204,
+            headers=_cors_headers(),
+        )
+
+    if req.method != "POST":
+        return _error("Only POST requests are supported.", status=405)
 
-        prompt = f"""
+    try:
+        request_data = _parse_request_json(req)
+        if not request_data:
+            return _error("Request body must be valid JSON.", status=400)
+
+        userprompt = request_data.get("userprompt")
+        if not userprompt:
+            return _error("Missing 'userprompt' in request body.", status=400)
+
+        built = (
+            PromptBuilder(COMPLETION_PROMPT_BUDGET)
+            .add("prompt", str(userprompt), budget=COMPLETION_PROMPT_BUDGET)
+            .build()
+        )
+        _log_prompt_usage("openai_completion", built)
+        userprompt = built["text"]
+
+        if not OPENAI_API_KEY:
+            logger.error("OPENAI_API_KEY is not set in environment variables.")
+            return _error("Server configuration error: Missing API key.", status=500)
+
+        # Create completion using chat completions API
+        response = _chat_completion(
+            "openai_completion",
+            None,
+            coalesce=True,
+            model="gpt-4o-mini",  # Using a valid model name
+            messages=[
+                {"role": "user", "content": userprompt}
+            ]
+        )
+
+        # Extract the message content
+        message_output = response.choices[0].message.content
+
+        _log_event(
+            "completion",
+            prompt=userprompt,
+            promptTokens=built["tokens"],
+            output=message_output,
+        )
+
+        return _json_response(
+            {
+                "output": message_output,
+                "message": response.choices[0].message.model_dump()
+            },
+            status=200,
+        )
+
+    except _UpstreamUnavailable as exc:
+        logger.warning("%s", exc)
+        return _upstream_unavailable_response(exc)
+    except Exception as exc:
+        logger.exception("Failed to process OpenAI completion request.")
+        return _error(f"Failed to process request: {exc}", status=500)
+
+
+@https_fn.on_request(**_concurrency_options("openai_completion", HTTP_CONCURRENCY_LLM))
+def openai_completion(req: https_fn.Request) -> https_fn.Response:
+    return _serve("openai_completion", _handle_openai_completion, req)
+
+
+def _entry_date_str(entry: Dict[str, Any]) -> str:
+    date_val = entry.get("date")
+    created_at = entry.get("createdAt")
+
+    date_str = ""
+    if hasattr(date_val, "isoformat"):
+        date_str = date_val.isoformat()
+    elif isinstance(date_val, str):
+        date_str = date_val
+
+    if not date_str and hasattr(created_at, "isoformat"):
+        date_str = created_at.isoformat()
+    elif not date_str and isinstance(created_at, str):
+        date_str = created_at
+    return date_str
+
+
+def _format_entry_for_prompt(entry: Dict[str, Any]) -> str:
+    """Convert a journal entry dict to a short string for the prompt."""
+    title = entry.get("title") or "Ingen titel"
+    date_str = _entry_date_str(entry)
+    content = entry.get("content") or entry.get("text") or ""
+    return f"Dato: {date_str or 'ukendt'}\nTitel: {title}\nNotat: {content}"
+
+
+SUMMARIZE_JOURNAL_PROMPT = """
 Du er en erfaren fysioterapeut.
 Du får en række journalnoter for én patient. Lav en kort opsummering på DANSK til fysioterapeuten, som skal se patienten nu.
 Strukturér svaret sådan:
@@ -897,40 +3584,218 @@ Strukturér svaret sådan:
 4) Hjemmeøvelser og adherence (hvis beskrevet)
 5) Vigtige opmærksomhedspunkter (røde flag, psykosociale forhold, kontraindikationer)
 Skriv i korte punkter, ingen patient-identificerbare detaljer ud over det, der står.
+""".strip()
 
-Journalnoter:
-{journal_text}
-        """.strip()
 
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.3,
-        )
+def _journal_entries_query(user_id: str, client_id: str, limit: int = 10):
+    return (
+        get_db()
+        .collection("users")
+        .document(user_id)
+        .collection("clients")
+        .document(client_id)
+        .collection("journalEntries")
+        .order_by("createdAt", direction=firestore.Query.DESCENDING)
+        .limit(limit)
+    )
 
-        summary = (
-            completion.choices[0].message.content
-            if completion.choices and completion.choices[0].message
-            else None
+
+def _journal_summary_ref(user_id: str, client_id: str):
+    return (
+        get_db()
+        .collection("users")
+        .document(user_id)
+        .collection("clients")
+        .document(client_id)
+        .collection("journalSummaries")
+        .document("latest")
+    )
+
+
+def _journal_fingerprint(docs: list) -> str:
+    """Hash of the entries a summary was built from; changes on any add/edit."""
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(doc.id.encode("utf-8"))
+        digest.update(_format_entry_for_prompt(doc.to_dict() or {}).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _generate_journal_summary(
+    docs: list, owner_uid: str | None = None, endpoint: str = "summarize_journal"
+) -> str | None:
+    """Summarize journal entry snapshots (newest first) with the model."""
+    # Newest entries get the budget first; rendered oldest to newest for
+    # readable chronology.
+    notes = [_format_entry_for_prompt(doc.to_dict() or {}) for doc in docs]
+    built = (
+        PromptBuilder(SUMMARIZE_PROMPT_BUDGET)
+        .reserve("instructions", SUMMARIZE_JOURNAL_PROMPT)
+        .add(
+            "journal",
+            notes,
+            budget=SUMMARIZE_PROMPT_BUDGET,
+            separator="\n\n",
+            item_budget=SUMMARIZE_ENTRY_TOKENS,
+            reverse=True,
         )
+        .build()
+    )
+    _log_prompt_usage("summarize_journal", built)
+
+    prompt = f"{SUMMARIZE_JOURNAL_PROMPT}\n\nJournalnoter:\n{built['text']}"
+
+    completion = _chat_completion(
+        endpoint,
+        owner_uid,
+        coalesce=True,
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0.3,
+    )
 
-        if not summary:
-            summary = "Kunne ikke generere opsummering."
+    return (
+        completion.choices[0].message.content
+        if completion.choices and completion.choices[0].message
+        else None
+    )
 
-        return _json_response({"summary": summary}, status=200)
 
-    except Exception as exc:
-        logger.exception("summarize_journal error")
-        return _error(f"Internal error: {exc}", status=500)
+def _store_journal_summary(
+    user_id: str, client_id: str, summary: str, fingerprint: str, source: str
+) -> None:
+    _journal_summary_ref(user_id, client_id).set(
+        {
+            "summary": summary,
+            "fingerprint": fingerprint,
+            "source": source,
+            "generatedAtMs": _now_ms(),
+            "ownerUid": user_id,
+        }
+    )
 
 
-@https_fn.on_request()
-def suggest_next_appointment(req: https_fn.Request) -> https_fn.Response:
-    logger.info("Incoming suggest_next_appointment request: method=%s", req.method)
+class _RequestPacer:
+    """Spaces upstream calls across worker threads and applies shared 429 back-off."""
+
+    def __init__(self, per_minute: int):
+        self._interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self._interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+    def back_off(self, seconds: float) -> None:
+        with self._lock:
+            self._next_at = max(self._next_at, time.monotonic() + seconds)
+
+
+def _refresh_journal_summary(user_id: str, client_id: str, pacer: _RequestPacer) -> str:
+    """Regenerate the stored summary for one client if its journal changed."""
+    docs = list(_journal_entries_query(user_id, client_id).stream())
+    if not docs:
+        return "empty"
+    fingerprint = _journal_fingerprint(docs)
+    stored_snap = _journal_summary_ref(user_id, client_id).get()
+    if stored_snap.exists and (stored_snap.to_dict() or {}).get("fingerprint") == fingerprint:
+        return "fresh"
+
+    for attempt in range(1, CASELOAD_SUMMARY_MAX_ATTEMPTS + 1):
+        pacer.wait()
+        try:
+            summary = _generate_journal_summary(docs, user_id, endpoint="caseload_summary")
+            break
+        except _UpstreamUnavailable as exc:
+            if attempt == CASELOAD_SUMMARY_MAX_ATTEMPTS:
+                raise
+            delay = max(exc.retry_after, 2.0 ** attempt)
+            logger.warning(
+                "Caseload summary upstream unavailable; backing off %.1fs (attempt %s)", delay, attempt
+            )
+            pacer.back_off(delay)
+    if not summary:
+        return "failed"
+    _store_journal_summary(user_id, client_id, summary, fingerprint, source="batch")
+    return "generated"
+
+
+def _precompute_caseload_summaries(target_date: date | None = None) -> Dict[str, int]:
+    """Precompute journal summaries for every client with an appointment on target_date.
+
+    Defaults to tomorrow in the clinic time zone. Returns counters per outcome.
+    """
+    try:
+        tzinfo = ZoneInfo(WORK_HOURS_TIMEZONE)
+    except Exception:
+        tzinfo = timezone.utc
+    if target_date is None:
+        target_date = datetime.now(tzinfo).date() + timedelta(days=1)
+
+    day_start_local = datetime(target_date.year, target_date.month, target_date.day, tzinfo=tzinfo)
+    day_end_local = day_start_local + timedelta(days=1)
+    appointment_docs = (
+        get_db()
+        .collection_group("appointments")
+        .where("start", ">=", _to_utc_iso(day_start_local))
+        .where("start", "<", _to_utc_iso(day_end_local))
+        .stream()
+    )
+
+    targets = set()
+    appointments = 0
+    for doc in appointment_docs:
+        appointments += 1
+        owner_ref = doc.reference.parent.parent
+        client_id = (doc.to_dict() or {}).get("clientId")
+        if owner_ref is not None and client_id:
+            targets.add((owner_ref.id, str(client_id)))
+
+    stats = {"appointments": appointments, "clients": len(targets)}
+    pacer = _RequestPacer(CASELOAD_SUMMARY_MAX_PER_MINUTE)
+    with ThreadPoolExecutor(
+        max_workers=max(CASELOAD_SUMMARY_CONCURRENCY, 1), thread_name_prefix="caseload"
+    ) as executor:
+        futures = {
+            executor.submit(_refresh_journal_summary, owner_uid, client_id, pacer): (owner_uid, client_id)
+            for owner_uid, client_id in sorted(targets)
+        }
+        for future, (owner_uid, client_id) in futures.items():
+            try:
+                outcome = future.result()
+            except Exception:
+                logger.exception(
+                    "Caseload summary failed: ownerUid=%s clientId=%s", owner_uid, client_id
+                )
+                outcome = "failed"
+            stats[outcome] = stats.get(outcome, 0) + 1
+
+    logger.info("Caseload summaries for %s: %s", target_date.isoformat(), stats)
+    return stats
+
+
+@scheduler_fn.on_schedule(
+    schedule=CASELOAD_SUMMARY_SCHEDULE,
+    timezone=scheduler_fn.Timezone(WORK_HOURS_TIMEZONE),
+    timeout_sec=1800,
+)
+def precompute_caseload_summaries(event: scheduler_fn.ScheduledEvent) -> None:
+    if not OPENAI_API_KEY:
+        logger.warning("Skipping caseload summaries: OPENAI_API_KEY is not configured.")
+        return
+    _precompute_caseload_summaries()
+
+
+def _handle_summarize_journal(req: https_fn.Request) -> https_fn.Response:
+    logger.info("Incoming summarize_journal request: method=%s", req.method)
 
     if req.method == "OPTIONS":
         return https_fn.Response("", status=204, headers=_cors_headers())
@@ -945,34 +3810,60 @@ def suggest_next_appointment(req: https_fn.Request) -> https_fn.Response:
         # Ensure Firebase Admin SDK is initialized before using auth/firestore.
         ensure_firebase_app()
 
-        id_token = _parse_bearer_token(req)
-        if not id_token:
-            return _error("Missing auth token.", status=401)
-
-        decoded = auth.verify_id_token(id_token)
-        user_id = decoded.get("uid")
-        if not user_id:
-            return _error("Invalid auth token.", status=401)
+        user_id, auth_error = _authenticate(req)
+        if auth_error is not None:
+            return auth_error
 
-        data = req.get_json(silent=True) or {}
+        data = _parse_request_json(req) or {}
         client_id = data.get("clientId")
-        last_appointment_iso = data.get("lastAppointmentIso")
-        diagnosis = data.get("diagnosis") or "Ukendt diagnose"
-        session_count = data.get("sessionCount")
-        journal_summary = data.get("journalSummary")
-        duration_minutes = _safe_int(data.get("durationMinutes"), 60)
+        if not client_id:
+            return _error("Missing clientId.", status=400)
 
-        if not client_id or not last_appointment_iso:
-            return _error("Missing clientId or lastAppointmentIso.", status=400)
+        summary_future = _submit_traced(
+            get_io_executor(), "storedSummary", _journal_summary_ref(user_id, client_id).get
+        )
+        with _span("journal"):
+            docs = list(_journal_entries_query(user_id, client_id).stream())
+        stored_snap = summary_future.result()
 
-        try:
-            last_dt = __import__("datetime").datetime.fromisoformat(
-                str(last_appointment_iso).replace("Z", "+00:00")
+        if not docs:
+            return _json_response(
+                {"summary": "Der er endnu ingen journalindlæg for denne klient."},
+                status=200,
             )
-        except Exception:
-            return _error("Invalid lastAppointmentIso.", status=400)
 
-        system_prompt = """
+        fingerprint = _journal_fingerprint(docs)
+        stored = stored_snap.to_dict() if stored_snap.exists else {}
+        if stored.get("fingerprint") == fingerprint and stored.get("summary"):
+            logger.info(
+                "summarize_journal served stored summary: clientId=%s source=%s",
+                client_id,
+                stored.get("source"),
+            )
+            return _json_response({"summary": stored["summary"], "precomputed": True}, status=200)
+
+        summary = _generate_journal_summary(docs, user_id)
+        if summary:
+            _store_journal_summary(user_id, client_id, summary, fingerprint, source="request")
+        else:
+            summary = "Kunne ikke generere opsummering."
+
+        return _json_response({"summary": summary}, status=200)
+
+    except _UpstreamUnavailable as exc:
+        logger.warning("%s", exc)
+        return _upstream_unavailable_response(exc)
+    except Exception as exc:
+        logger.exception("summarize_journal error")
+        return _error(f"Internal error: {exc}", status=500)
+
+
+@https_fn.on_request(**_concurrency_options("summarize_journal", HTTP_CONCURRENCY_LLM))
+def summarize_journal(req: https_fn.Request) -> https_fn.Response:
+    return _serve("summarize_journal", _handle_summarize_journal, req)
+
+
+SUGGEST_INTERVAL_PROMPT = """
 Du er en erfaren fysioterapeut, der hjælper med at planlægge næste kontroltid.
 
 Du skal foreslå, hvor mange dage der bør gå til næste aftale ud fra:
@@ -992,45 +3883,301 @@ Svar KUN i JSON med felterne:
   "clinicalRationale": string,
   "safetyNote": string
 }
-        """.strip()
-
-        user_content = {
-            "clientId": client_id,
-            "diagnosis": diagnosis,
-            "lastAppointmentIso": str(last_appointment_iso),
-            "sessionCount": session_count,
-            "journalSummary": journal_summary,
-        }
+""".strip()
+
+# Deterministic interval rules mirroring SUGGEST_INTERVAL_PROMPT. Keywords
+# match at the start of a word, so inflections ("akutte") match but "akut"
+# does not match inside "subakut". Rules are checked in order; the first match
+# wins. Diagnoses that match no rule fall back to the model. Intervals are
+# (early course, later course) in days.
+SUGGEST_INTERVAL_RULES = [
+    {
+        "rule": "subacute",
+        "fields": ("diagnosis",),
+        "keywords": ("subakut", "subacute", "sub-acute"),
+        "intervalDays": (5, 7),
+        "rationale": "Subakut tilstand; opfølgning efter 3–7 dage.",
+        "safetyNote": "",
+    },
+    {
+        "rule": "acute",
+        "fields": ("diagnosis",),
+        "keywords": (
+            "akut", "acute", "traume", "trauma", "distorsion", "forstuvning", "whiplash",
+            "fraktur", "brud", "luksation", "operation", "opereret", "postoperativ", "post-op",
+        ),
+        "intervalDays": (2, 3),
+        "rationale": "Akut/ustabil tilstand; tæt opfølgning (1–3 dage) anbefales.",
+        "safetyNote": "",
+    },
+    {
+        "rule": "chronic",
+        "fields": ("diagnosis",),
+        "keywords": (
+            "kronisk", "chronic", "langvarig", "artrose", "slidgigt", "osteoarthritis",
+            "tendinopati", "tendinopathy", "fibromyalgi", "vedligehold",
+        ),
+        "intervalDays": (14, 21),
+        "rationale": "Stabil/kronisk tilstand; opfølgning efter 7–21 dage med fokus på egenmestring.",
+        "safetyNote": "",
+    },
+]
+# Any mention of red flags or worsening goes to the model, which can tell
+# "røde flag" from "ingen røde flag"; keyword rules cannot.
+SUGGEST_DEFER_KEYWORDS = (
+    "rødt flag", "røde flag", "red flag", "forværring", "forværret", "worsening", "cauda equina",
+    "nattesmerter", "night pain", "vægttab", "weight loss", "feber", "fever",
+    "blæreforstyrrelse", "ridebukseanæstesi", "saddle anaesthesia", "saddle anesthesia",
+)
+SUGGEST_LATER_COURSE_SESSIONS = _env_int("SUGGEST_LATER_COURSE_SESSIONS", 4)
+SUGGEST_RULES_ENABLED = os.getenv("SUGGEST_RULES_ENABLED", "true").lower() in ("1", "true", "yes")
+SUGGEST_SNAP_SEARCH_DAYS = _env_int("SUGGEST_SNAP_SEARCH_DAYS", 7)
+SUGGEST_CACHE_TTL_SECONDS = _env_float("SUGGEST_CACHE_TTL_SECONDS", 3600.0)
+SUGGEST_CACHE_MAX_ENTRIES = _env_int("SUGGEST_CACHE_MAX_ENTRIES", 512)
+
+# Parsed model answers keyed by normalized clinical inputs; the date arithmetic
+# and slot snapping are still done per request.
+_suggest_interval_cache = _TTLCache(SUGGEST_CACHE_MAX_ENTRIES, SUGGEST_CACHE_TTL_SECONDS)
+
+
+def _suggest_cache_key(diagnosis: str, session_count: Any, journal_summary: str | None) -> str:
+    def normalize(value: Any) -> str:
+        return " ".join(str(value or "").lower().split())
+
+    normalized = {
+        "model": os.getenv("OPENAI_SUGGEST_MODEL", "gpt-4o-mini"),
+        "diagnosis": normalize(diagnosis),
+        "sessionCount": _safe_int(session_count, -1),
+        "journalSummary": normalize(journal_summary),
+    }
+    return hashlib.sha256(
+        json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
 
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        completion = client.chat.completions.create(
-            model=os.getenv("OPENAI_SUGGEST_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": json.dumps(user_content, ensure_ascii=False)},
-            ],
-            temperature=0.3,
-            response_format={"type": "json_object"},
-        )
 
-        raw = completion.choices[0].message.content if completion.choices else "{}"
+@functools.lru_cache(maxsize=None)
+def _keyword_pattern(keywords: tuple[str, ...]) -> re.Pattern:
+    alternatives = "|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alternatives})")
+
+
+def _matches_keywords(text: str, keywords: tuple[str, ...]) -> bool:
+    """True when a keyword starts a word in text (inflected forms included)."""
+    return _keyword_pattern(keywords).search(text) is not None
+
+
+def _rule_based_interval(
+    diagnosis: str, session_count: Any, journal_summary: str | None
+) -> Dict[str, Any] | None:
+    """Answer common cases from SUGGEST_INTERVAL_RULES; None means ask the model."""
+    if not SUGGEST_RULES_ENABLED:
+        return None
+    texts = {
+        "diagnosis": str(diagnosis or "").lower(),
+        "journalSummary": str(journal_summary or "").lower(),
+    }
+    if _matches_keywords(" ".join(texts.values()), SUGGEST_DEFER_KEYWORDS):
+        return None
+    later_course = _safe_int(session_count, 0) >= SUGGEST_LATER_COURSE_SESSIONS
+    for rule in SUGGEST_INTERVAL_RULES:
+        haystack = " ".join(texts[field] for field in rule["fields"])
+        if _matches_keywords(haystack, rule["keywords"]):
+            early_days, later_days = rule["intervalDays"]
+            return {
+                "intervalDays": later_days if later_course else early_days,
+                "rationale": rule["rationale"],
+                "safetyNote": rule["safetyNote"],
+                "rule": rule["rule"],
+            }
+    return None
+
+
+def _llm_suggest_interval(user_content: Dict[str, Any], owner_uid: str | None = None) -> Dict[str, Any]:
+    logger.info(
+        "suggest_next_appointment prompt tokens: total=%s",
+        _count_tokens(SUGGEST_INTERVAL_PROMPT)
+        + _count_tokens(json.dumps(user_content, ensure_ascii=False)),
+    )
+    completion = _chat_completion(
+        "suggest_next_appointment",
+        owner_uid,
+        model=os.getenv("OPENAI_SUGGEST_MODEL", "gpt-4o-mini"),
+        messages=[
+            {"role": "system", "content": SUGGEST_INTERVAL_PROMPT},
+            {"role": "user", "content": json.dumps(user_content, ensure_ascii=False)},
+        ],
+        temperature=0.3,
+        response_format={"type": "json_object"},
+    )
+
+    raw = completion.choices[0].message.content if completion.choices else "{}"
+    try:
+        parsed = json.loads(raw or "{}")
+    except Exception:
+        parsed = {}
+
+    interval_days = _safe_int(parsed.get("recommendedIntervalDays"), 7)
+    if interval_days < 1:
+        interval_days = 1
+    if interval_days > 60:
+        interval_days = 60
+
+    return {
+        "intervalDays": interval_days,
+        "rationale": str(parsed.get("clinicalRationale") or "").strip(),
+        "safetyNote": str(parsed.get("safetyNote") or "").strip(),
+    }
+
+
+def _snap_to_free_slot(
+    uid: str, proposed: datetime, last_dt: datetime, duration_minutes: int
+) -> Dict[str, datetime] | None:
+    """Find the free slot closest to proposed in the clinician's calendar.
+
+    Uses the same work hours, slot grid and busy-range rules as
+    publicGetAvailability. Searches up to SUGGEST_SNAP_SEARCH_DAYS either side,
+    never before now or the last appointment. Returns local {"start", "end"}
+    datetimes, or None when no work hours are configured or nothing is free.
+    """
+    try:
+        tzinfo = ZoneInfo(WORK_HOURS_TIMEZONE)
+    except Exception:
+        tzinfo = timezone.utc
+    if proposed.tzinfo is None:
+        proposed = proposed.replace(tzinfo=tzinfo)
+    if last_dt.tzinfo is None:
+        last_dt = last_dt.replace(tzinfo=tzinfo)
+    not_before = max(datetime.now(timezone.utc), last_dt)
+
+    clinic_docs = list(
+        get_db().collection("publicClinics").where("ownerUid", "==", uid).limit(1).stream()
+    )
+    clinic_data = (clinic_docs[0].to_dict() or {}) if clinic_docs else {}
+    owner_uid = clinic_data.get("ownerUid") or uid
+    slot_minutes = _safe_int(clinic_data.get("slotMinutes"), 15)
+    if slot_minutes <= 0:
+        slot_minutes = 15
+
+    work_hours, _ = _resolve_staff_work_hours(clinic_data, uid)
+    if not isinstance(work_hours, dict):
+        return None
+
+    proposed_date = proposed.astimezone(tzinfo).date()
+    first_date = proposed_date - timedelta(days=SUGGEST_SNAP_SEARCH_DAYS)
+    range_start = datetime(first_date.year, first_date.month, first_date.day, tzinfo=tzinfo)
+    range_end = range_start + timedelta(days=2 * SUGGEST_SNAP_SEARCH_DAYS + 1)
+    busy_ranges = _load_busy_ranges(owner_uid, uid, "", range_start, range_end)
+
+    best: tuple[float, Dict[str, Any]] | None = None
+    for distance in range(SUGGEST_SNAP_SEARCH_DAYS + 1):
+        for offset in sorted({distance, -distance}, reverse=True):
+            target_date = proposed_date + timedelta(days=offset)
+            window = _resolve_work_window(work_hours, target_date)
+            if "startMinutes" not in window:
+                continue
+            day = _compute_day_slots(
+                window, target_date, duration_minutes, slot_minutes, tzinfo, busy_ranges
+            )
+            for slot in day["slots"]:
+                slot_start = _parse_iso_datetime(slot["startIso"])
+                if slot_start < not_before:
+                    continue
+                diff = abs((slot_start - proposed).total_seconds())
+                if best is None or diff < best[0]:
+                    best = (diff, slot)
+        # Slots on days further out are at least `distance` days away.
+        if best is not None and best[0] <= distance * 86400:
+            break
+
+    if best is None:
+        return None
+    return {
+        "start": _parse_iso_datetime(best[1]["startIso"]).astimezone(tzinfo),
+        "end": _parse_iso_datetime(best[1]["endIso"]).astimezone(tzinfo),
+    }
+
+
+def _handle_suggest_next_appointment(req: https_fn.Request) -> https_fn.Response:
+    logger.info("Incoming suggest_next_appointment request: method=%s", req.method)
+
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204, headers=_cors_headers())
+
+    if req.method != "POST":
+        return _error("Only POST requests are supported.", status=405)
+
+    try:
+        # Ensure Firebase Admin SDK is initialized before using auth/firestore.
+        ensure_firebase_app()
+
+        user_id, auth_error = _authenticate(req)
+        if auth_error is not None:
+            return auth_error
+
+        data = _parse_request_json(req) or {}
+        client_id = data.get("clientId")
+        last_appointment_iso = data.get("lastAppointmentIso")
+        diagnosis = data.get("diagnosis") or "Ukendt diagnose"
+        session_count = data.get("sessionCount")
+        journal_summary = data.get("journalSummary")
+        duration_minutes = _safe_int(data.get("durationMinutes"), 60)
+
+        if not client_id or not last_appointment_iso:
+            return _error("Missing clientId or lastAppointmentIso.", status=400)
+
         try:
-            parsed = json.loads(raw or "{}")
+            last_dt = __import__("datetime").datetime.fromisoformat(
+                str(last_appointment_iso).replace("Z", "+00:00")
+            )
         except Exception:
-            parsed = {}
+            return _error("Invalid lastAppointmentIso.", status=400)
 
-        interval_days = _safe_int(parsed.get("recommendedIntervalDays"), 7)
-        if interval_days < 1:
-            interval_days = 1
-        if interval_days > 60:
-            interval_days = 60
+        if journal_summary:
+            journal_summary = _truncate_to_tokens(str(journal_summary), SUGGEST_SUMMARY_TOKEN_BUDGET)
+
+        suggestion = _rule_based_interval(diagnosis, session_count, journal_summary)
+        source = "rules"
+        if suggestion is None:
+            cache_key = _suggest_cache_key(diagnosis, session_count, journal_summary)
+            suggestion = _suggest_interval_cache.get(cache_key)
+            source = "cache"
+            logger.info(
+                "suggest_next_appointment interval cache: hit=%s %s",
+                suggestion is not None,
+                _suggest_interval_cache.stats(),
+            )
+        if suggestion is None:
+            if not OPENAI_API_KEY:
+                return _error("OPENAI_API_KEY is not configured.", status=500)
+            suggestion = _llm_suggest_interval(
+                {
+                    "clientId": client_id,
+                    "diagnosis": diagnosis,
+                    "lastAppointmentIso": str(last_appointment_iso),
+                    "sessionCount": session_count,
+                    "journalSummary": journal_summary,
+                },
+                owner_uid=user_id,
+            )
+            _suggest_interval_cache.set(cache_key, suggestion)
+            source = "llm"
 
-        rationale = str(parsed.get("clinicalRationale") or "").strip()
-        safety_note = str(parsed.get("safetyNote") or "").strip()
+        interval_days = suggestion["intervalDays"]
+        rationale = suggestion["rationale"]
+        safety_note = suggestion["safetyNote"]
 
         next_dt = last_dt + __import__("datetime").timedelta(days=interval_days)
         end_dt = next_dt + __import__("datetime").timedelta(minutes=duration_minutes)
 
+        slot = None
+        try:
+            slot = _snap_to_free_slot(user_id, next_dt, last_dt, duration_minutes)
+        except Exception:
+            logger.exception("suggest_next_appointment slot snapping failed")
+        if slot:
+            next_dt = slot["start"]
+            end_dt = slot["end"]
+
         suggested = {
             "startDate": _format_date_ddmmyyyy(next_dt),
             "startTime": _format_time_hhmm(next_dt),
@@ -1038,22 +4185,644 @@ Svar KUN i JSON med felterne:
             "endTime": _format_time_hhmm(end_dt),
         }
 
+        logger.info(
+            "suggest_next_appointment source=%s rule=%s intervalDays=%s snapped=%s",
+            source,
+            suggestion.get("rule") or "-",
+            interval_days,
+            bool(slot),
+        )
+
         return _json_response(
             {
                 "suggested": suggested,
                 "rationale": rationale,
                 "safetyNote": safety_note,
                 "intervalDays": interval_days,
+                "source": source,
+                "snapped": bool(slot),
+                "slot": (
+                    {"startIso": _to_utc_iso(slot["start"]), "endIso": _to_utc_iso(slot["end"])}
+                    if slot
+                    else None
+                ),
             },
             status=200,
         )
-    except Exception as exc:
-        logger.exception("suggest_next_appointment error")
-        return _error("Intern fejl ved forslag af næste aftale.", status=500)
+    except _UpstreamUnavailable as exc:
+        logger.warning("%s", exc)
+        return _upstream_unavailable_response(exc)
+    except Exception as exc:
+        logger.exception("suggest_next_appointment error")
+        return _error("Intern fejl ved forslag af næste aftale.", status=500)
+
+
+@https_fn.on_request(**_concurrency_options("suggest_next_appointment", HTTP_CONCURRENCY_LLM))
+def suggest_next_appointment(req: https_fn.Request) -> https_fn.Response:
+    return _serve("suggest_next_appointment", _handle_suggest_next_appointment, req)
+
+
+AGENT_ACTION_PROMPT = """
+Du er en fysioterapeutisk assistent. Du får et udkast til journal (draftText), patientkontekst og shared historik mellem agenter.
+Du skal returnere JSON med:
+{
+  "text": "kort svar til brugeren",
+  "blocks": [
+    {"id": "block1", "title": "...", "text": "...", "defaultMode": "append"|"replace"}
+  ]
+}
+Hvis du får actionId, så producer blocks der matcher actionId:
+- journal_pack: 3 blocks (ræsonnering, plan/træning, guideline-check)
+- soap: 1 block (SOAP-notat)
+- missing: 1 block (Manglende data)
+- redflags: 1 block (Safety/Røde flag)
+- plan_check: 1 block (plan-review)
+- dosage: 1 block (dosering/progression)
+- patient_info: 1 block (kort patient-venlig tekst)
+- today_training: 1 block (dagens træning)
+- home_program: 1 block (hjemmeprogram + progression)
+- next_appt: 1 block (næste aftale + begrundelse)
+
+Feltet defaultMode skal være "append" som udgangspunkt; brug "replace" hvis block er et fuldt notat.
+""".strip()
+
+
+AGENT_FAN_OUT_ENABLED = os.getenv("AGENT_FAN_OUT", "").strip().lower() in ("1", "true", "yes")
+
+# Multi-block actions that can be split into one completion per block. Each
+# block runs with the matching agent's instructions; results are merged back
+# into the same ``blocks`` payload in this order.
+AGENT_FAN_OUT_ACTIONS: Dict[str, list[Dict[str, str]]] = {
+    "journal_pack": [
+        {"id": "block1", "agentId": "reasoner", "title": "Ræsonnering"},
+        {"id": "block2", "agentId": "planner", "title": "Plan/træning"},
+        {"id": "block3", "agentId": "guidelines", "title": "Guideline-check"},
+    ],
+}
+
+AGENT_BLOCK_PROMPT = """
+Du skal kun producere én block til et samlet journal-udkast: "{title}".
+Du får et udkast til journal (draftText) og patientkontekst.
+Returner JSON med:
+{{"title": "...", "text": "...", "defaultMode": "append"|"replace"}}
+Feltet defaultMode skal være "append" som udgangspunkt.
+""".strip()
+
+
+def _normalize_action_blocks(blocks: Any) -> list[Dict[str, Any]]:
+    valid_blocks = []
+    if not isinstance(blocks, list):
+        return valid_blocks
+    for i, b in enumerate(blocks):
+        if not isinstance(b, dict):
+            continue
+        title = str(b.get("title") or "").strip() or f"Block {i+1}"
+        bt = str(b.get("text") or "").strip()
+        if not bt:
+            continue
+        mode = b.get("defaultMode") or "append"
+        if mode not in ("append", "replace"):
+            mode = "append"
+        valid_blocks.append(
+            {
+                "id": b.get("id") or f"block{i+1}",
+                "title": title,
+                "text": bt,
+                "defaultMode": mode,
+            }
+        )
+    return valid_blocks
+
+
+def _generate_action_block(
+    owner_uid: str, spec: Dict[str, str], user_payload: Dict[str, Any]
+) -> Dict[str, Any] | None:
+    """Generate a single fan-out block with its agent's own instructions."""
+    system_prompt = "{}\n\n{}".format(
+        _agent_instructions(spec["agentId"]) or "",
+        AGENT_BLOCK_PROMPT.format(title=spec["title"]),
+    )
+    completion = _chat_completion(
+        "agent_chat",
+        owner_uid,
+        model=os.getenv("OPENAI_AGENT_CHAT_MODEL", "gpt-4o-mini"),
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
+        ],
+        temperature=0.2,
+        response_format={"type": "json_object"},
+    )
+    raw = completion.choices[0].message.content if completion.choices else "{}"
+    try:
+        parsed = json.loads(raw or "{}")
+    except Exception:
+        parsed = {}
+    if not isinstance(parsed, dict):
+        return None
+    parsed["id"] = spec["id"]
+    parsed["title"] = str(parsed.get("title") or "").strip() or spec["title"]
+    blocks = _normalize_action_blocks([parsed])
+    return blocks[0] if blocks else None
+
+
+def _format_chat_message(m: Dict[str, Any]) -> str:
+    role = m.get("role") or "unknown"
+    a = m.get("agentId") or "unknown"
+    who = "USER" if role == "user" else f"ASSISTANT({a})"
+    return f"{who}: {str(m.get('text') or '')}"
+
+
+def _compact_chat_history(uid: str, client_id: str) -> bool:
+    """Fold older shared aiChats turns into the rolling summary document.
+
+    Returns True when a new summary was written. A run first takes a lease on
+    the shared document with a last-update-time precondition, so only one run
+    per threshold crossing calls the model; the others return False.
+    """
+    db_client = get_db()
+    chat_ref = (
+        db_client.collection("users")
+        .document(uid)
+        .collection("clients")
+        .document(client_id)
+        .collection("aiChats")
+        .document("shared")
+    )
+    chat_snap = chat_ref.get()
+    chat_data = chat_snap.to_dict() if chat_snap.exists else {}
+    previous_summary = str(chat_data.get("compactSummary") or "").strip()
+    compacted_through_ms = _safe_int(chat_data.get("compactedThroughMs"), 0)
+
+    delta_docs = list(
+        chat_ref.collection("messages")
+        .where("createdAtMs", ">", compacted_through_ms)
+        .order_by("createdAtMs")
+        .limit(CHAT_COMPACT_TRIGGER_MESSAGES * 4)
+        .stream()
+    )
+    if len(delta_docs) <= CHAT_COMPACT_TRIGGER_MESSAGES:
+        return False
+    if _safe_int(chat_data.get("compactLeaseUntilMs"), 0) > _now_ms():
+        return False
+
+    lease = {"compactLeaseUntilMs": _now_ms() + CHAT_COMPACT_LEASE_SECONDS * 1000}
+    try:
+        if chat_snap.exists:
+            lease_write = chat_ref.update(
+                lease, option=db_client.write_option(last_update_time=chat_snap.update_time)
+            )
+        else:
+            lease_write = chat_ref.create(lease)
+    except (FailedPrecondition, Conflict):
+        return False
+    lease_option = db_client.write_option(last_update_time=lease_write.update_time)
+
+    summary = ""
+    try:
+        summary = _fold_chat_turns(uid, delta_docs, previous_summary)
+    finally:
+        if not summary:
+            with contextlib.suppress(FailedPrecondition):
+                chat_ref.update({"compactLeaseUntilMs": 0}, option=lease_option)
+    if not summary:
+        return False
+
+    to_fold = delta_docs[: len(delta_docs) - CHAT_COMPACT_KEEP_RECENT]
+    update = {
+        "compactSummary": summary,
+        "compactedThroughMs": _safe_int((to_fold[-1].to_dict() or {}).get("createdAtMs"), compacted_through_ms),
+        "compactedMessages": _safe_int(chat_data.get("compactedMessages"), 0) + len(to_fold),
+        "compactUpdatedAtMs": _now_ms(),
+        "compactLeaseUntilMs": 0,
+    }
+    try:
+        chat_ref.update(update, option=lease_option)
+    except FailedPrecondition as exc:
+        logger.info(
+            "aiChats compaction skipped (concurrent update): uid=%s clientId=%s error=%s",
+            uid,
+            client_id,
+            exc,
+        )
+        return False
+
+    logger.info(
+        "aiChats compaction: uid=%s clientId=%s folded=%s summaryChars=%s",
+        uid,
+        client_id,
+        len(to_fold),
+        len(summary),
+    )
+    return True
+
+
+def _fold_chat_turns(uid: str, delta_docs: list, previous_summary: str) -> str:
+    """Ask the model to fold all but the newest CHAT_COMPACT_KEEP_RECENT turns into the summary."""
+    to_fold = [d.to_dict() or {} for d in delta_docs[: len(delta_docs) - CHAT_COMPACT_KEEP_RECENT]]
+    new_turns = (
+        PromptBuilder(CHAT_COMPACT_INPUT_BUDGET)
+        .add(
+            "history",
+            [_format_chat_message(m) for m in to_fold],
+            budget=CHAT_COMPACT_INPUT_BUDGET,
+            item_budget=AGENT_HISTORY_ITEM_TOKENS,
+        )
+        .build()["text"]
+    )
+
+    completion = _chat_completion(
+        "compact_ai_chat_history",
+        uid,
+        model=os.getenv("OPENAI_COMPACT_MODEL", "gpt-4o-mini"),
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "Du vedligeholder et kompakt resumé af en samtale mellem en fysioterapeut og AI-agenter om én patient. "
+                    "Opdater det eksisterende resumé med de nye beskeder. Bevar kliniske fakta, beslutninger, planer, "
+                    "åbne spørgsmål og røde flag; udelad høflighedsfraser og gentagelser. "
+                    f"Svar kun med det opdaterede resumé i korte punkter, højst {CHAT_SUMMARY_MAX_CHARS} tegn."
+                ),
+            },
+            {
+                "role": "user",
+                "content": f"Eksisterende resumé:\n{previous_summary or '(tomt)'}\n\nNye beskeder:\n{new_turns}",
+            },
+        ],
+        temperature=0.2,
+    )
+    summary = (completion.choices[0].message.content if completion.choices else "") or ""
+    return summary.strip()[:CHAT_SUMMARY_MAX_CHARS]
+
+
+@firestore_fn.on_document_created(
+    document="users/{uid}/clients/{clientId}/aiChats/shared/messages/{messageId}",
+    database=FIRESTORE_DATABASE_ID,
+)
+def compact_ai_chat_history(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]) -> None:
+    if not OPENAI_API_KEY:
+        return
+    try:
+        _compact_chat_history(event.params["uid"], event.params["clientId"])
+    except Exception:
+        logger.exception("aiChats compaction failed")
+
+
+# Per-client journal retrieval index: one document per journal entry under
+# clients/{clientId}/journalIndex with passage vectors, kept in sync by the
+# index_journal_entry trigger. agent_chat ranks passages against the request.
+# clients/{clientId}/journalIndexMeta/state holds a version bumped on every
+# index change and backfilledSignature, written only once a backfill has
+# indexed the client's existing entries. A turn reads only that document and
+# ranks against the newest AGENT_RETRIEVAL_MAX_ENTRIES entries, which are
+# cached per instance until the version moves. Until backfilledSignature
+# matches the current signature the index is treated as incomplete (the
+# trigger alone only covers entries written since), and one backfill is
+# claimed per JOURNAL_BACKFILL_RETRY_SECONDS.
+JOURNAL_INDEX_PROVIDER = os.getenv("JOURNAL_INDEX_PROVIDER", "openai" if OPENAI_API_KEY else "local")
+JOURNAL_INDEX_EMBEDDING_MODEL = os.getenv("JOURNAL_INDEX_EMBEDDING_MODEL", "text-embedding-3-small")
+JOURNAL_INDEX_DIMENSIONS = _env_int("JOURNAL_INDEX_DIMENSIONS", 256)
+JOURNAL_INDEX_MAX_ENTRIES = _env_int("JOURNAL_INDEX_MAX_ENTRIES", 200)
+JOURNAL_PASSAGE_TOKENS = _env_int("JOURNAL_PASSAGE_TOKENS", 160)
+AGENT_RETRIEVAL_TOP_K = _env_int("AGENT_RETRIEVAL_TOP_K", 8)
+AGENT_RETRIEVAL_QUERY_TOKENS = _env_int("AGENT_RETRIEVAL_QUERY_TOKENS", 1000)
+AGENT_RETRIEVAL_MAX_ENTRIES = _env_int("AGENT_RETRIEVAL_MAX_ENTRIES", 100)
+AGENT_RETRIEVAL_CACHE_ENTRIES = _env_int("AGENT_RETRIEVAL_CACHE_ENTRIES", 32)
+AGENT_RETRIEVAL_CACHE_TTL_SECONDS = _env_float("AGENT_RETRIEVAL_CACHE_TTL_SECONDS", 1800.0)
+JOURNAL_BACKFILL_RETRY_SECONDS = _env_int("JOURNAL_BACKFILL_RETRY_SECONDS", 3600)
+
+# (uid, clientId) -> (version, [(createdAtMs, text, vector)]).
+_journal_candidates_cache = _TTLCache(AGENT_RETRIEVAL_CACHE_ENTRIES, AGENT_RETRIEVAL_CACHE_TTL_SECONDS)
+
+openai_embeddings_breaker = _CircuitBreaker(
+    "openai_embeddings", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS
+)
+
+
+def _journal_index_signature() -> str:
+    """Identify the embedding space; vectors from other providers are ignored."""
+    if JOURNAL_INDEX_PROVIDER == "local":
+        return f"local:{JOURNAL_INDEX_DIMENSIONS}"
+    return f"openai:{JOURNAL_INDEX_EMBEDDING_MODEL}:{JOURNAL_INDEX_DIMENSIONS}"
+
+
+def _local_embedding(text: str, dims: int) -> list[float]:
+    """Hashed bag-of-words vector (words, 5-char stems, bigrams); no network needed."""
+    words = re.findall(r"\w+", text.lower())
+    features = words + [w[:5] for w in words if len(w) > 5]
+    features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector = [0.0] * dims
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dims
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector] if norm else vector
+
+
+def _embed_texts(texts: list[str], owner_uid: str | None = None) -> list[list[float]]:
+    """Embed texts with the configured provider; vectors are L2-normalized."""
+    if not texts:
+        return []
+    if JOURNAL_INDEX_PROVIDER == "local":
+        return [_local_embedding(text, JOURNAL_INDEX_DIMENSIONS) for text in texts]
+
+    import httpx
+
+    client = get_openai_client()
+    started = time.perf_counter()
+    try:
+        response, retries = _call_upstream(
+            openai_embeddings_breaker,
+            lambda remaining: client.embeddings.create(
+                model=JOURNAL_INDEX_EMBEDDING_MODEL,
+                input=texts,
+                dimensions=JOURNAL_INDEX_DIMENSIONS,
+                timeout=httpx.Timeout(
+                    min(remaining, OPENAI_TIMEOUT_SECONDS), connect=OPENAI_CONNECT_TIMEOUT_SECONDS
+                ),
+            ),
+        )
+    except Exception as exc:
+        _record_model_call(
+            "journal_index",
+            owner_uid,
+            JOURNAL_INDEX_EMBEDDING_MODEL,
+            (time.perf_counter() - started) * 1000,
+            error=type(exc).__name__,
+        )
+        raise
+    _record_model_call(
+        "journal_index",
+        owner_uid,
+        JOURNAL_INDEX_EMBEDDING_MODEL,
+        (time.perf_counter() - started) * 1000,
+        prompt_tokens=getattr(getattr(response, "usage", None), "prompt_tokens", 0) or 0,
+        retries=retries,
+    )
+    vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    normalized = []
+    for vector in vectors:
+        norm = sum(v * v for v in vector) ** 0.5
+        normalized.append([v / norm for v in vector] if norm else list(vector))
+    return normalized
+
+
+def _split_journal_passages(entry: Dict[str, Any]) -> list[str]:
+    """Split a journal entry into passages of about JOURNAL_PASSAGE_TOKENS each."""
+    content = str(entry.get("content") or entry.get("text") or "").strip()
+    if not content:
+        return []
+    prefix = f"[{_entry_date_str(entry) or 'ukendt'}] {entry.get('title') or 'Ingen titel'}: "
+
+    units: list[str] = []
+    for paragraph in re.split(r"\n\s*\n|\n", content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if _count_tokens(paragraph) <= JOURNAL_PASSAGE_TOKENS:
+            units.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            if sentence.strip():
+                units.append(_truncate_to_tokens(sentence.strip(), JOURNAL_PASSAGE_TOKENS))
+
+    passages: list[str] = []
+    current: list[str] = []
+    used = 0
+    for unit in units:
+        cost = _count_tokens(unit)
+        if current and used + cost > JOURNAL_PASSAGE_TOKENS:
+            passages.append(prefix + " ".join(current))
+            current, used = [], 0
+        current.append(unit)
+        used += cost
+    if current:
+        passages.append(prefix + " ".join(current))
+    return passages
+
+
+def _entry_created_ms(entry: Dict[str, Any]) -> int:
+    created_at = entry.get("createdAt") or entry.get("createdAtIso")
+    if hasattr(created_at, "timestamp"):
+        return int(created_at.timestamp() * 1000)
+    if isinstance(created_at, str):
+        try:
+            return int(datetime.fromisoformat(created_at.replace("Z", "+00:00")).timestamp() * 1000)
+        except ValueError:
+            return 0
+    return 0
+
+
+def _journal_index_col(user_id: str, client_id: str):
+    return (
+        get_db()
+        .collection("users")
+        .document(user_id)
+        .collection("clients")
+        .document(client_id)
+        .collection("journalIndex")
+    )
+
+
+def _journal_index_meta_ref(user_id: str, client_id: str):
+    return (
+        get_db()
+        .collection("users")
+        .document(user_id)
+        .collection("clients")
+        .document(client_id)
+        .collection("journalIndexMeta")
+        .document("state")
+    )
+
+
+def _bump_journal_index_version(user_id: str, client_id: str, **fields: Any) -> None:
+    _journal_index_meta_ref(user_id, client_id).set(
+        {"version": firestore.Increment(1), "updatedAtMs": _now_ms(), **fields},
+        merge=True,
+    )
+
+
+def _index_journal_entry(
+    user_id: str, client_id: str, entry_id: str, entry: Dict[str, Any] | None
+) -> str:
+    """Bring one entry's index document in line with the entry.
+
+    Returns "deleted", "unchanged" or "indexed". Content that did not change
+    (e.g. an updatedAt-only write) is not re-embedded.
+    """
+    index_ref = _journal_index_col(user_id, client_id).document(entry_id)
+    passages = _split_journal_passages(entry or {})
+    signature = _journal_index_signature()
+    if not passages:
+        index_ref.delete()
+        _bump_journal_index_version(user_id, client_id)
+        return "deleted"
+
+    content_hash = hashlib.sha256(
+        "\n".join([signature, *passages]).encode("utf-8")
+    ).hexdigest()
+    existing = index_ref.get()
+    if existing.exists and (existing.to_dict() or {}).get("contentHash") == content_hash:
+        return "unchanged"
+
+    vectors = _embed_texts(passages, owner_uid=user_id)
+    index_ref.set(
+        {
+            "entryId": entry_id,
+            "signature": signature,
+            "contentHash": content_hash,
+            "createdAtMs": _entry_created_ms(entry or {}),
+            "indexedAtMs": _now_ms(),
+            "passages": [
+                {"text": text, "vector": [round(v, 5) for v in vector]}
+                for text, vector in zip(passages, vectors)
+            ],
+        }
+    )
+    _bump_journal_index_version(user_id, client_id)
+    return "indexed"
+
+
+def _claim_journal_backfill(user_id: str, client_id: str) -> bool:
+    """Mark a client's backfill as started; False if one already is (or recently was)."""
+    signature = _journal_index_signature()
+    meta_ref = _journal_index_meta_ref(user_id, client_id)
+    snapshot = meta_ref.get()
+    meta = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    if meta.get("backfilledSignature") == signature:
+        return False
+    started_ms = _safe_int(meta.get("backfillStartedAtMs"), 0)
+    if (
+        meta.get("backfillSignature") == signature
+        and _now_ms() - started_ms < JOURNAL_BACKFILL_RETRY_SECONDS * 1000
+    ):
+        return False
+    claim = {"backfillSignature": signature, "backfillStartedAtMs": _now_ms()}
+    try:
+        if snapshot.exists:
+            meta_ref.update(claim, option=get_db().write_option(last_update_time=snapshot.update_time))
+        else:
+            meta_ref.create(claim)
+    except (FailedPrecondition, Conflict):
+        return False
+    return True
+
+
+def _backfill_journal_index(user_id: str, client_id: str) -> Dict[str, int]:
+    """Index a client's existing entries (e.g. written before the trigger existed).
+
+    Runs only for the caller that claims the backfill; others get {"skipped": 1}.
+    """
+    if not _claim_journal_backfill(user_id, client_id):
+        return {"skipped": 1}
+    stats: Dict[str, int] = {}
+    entry_docs = (
+        get_db()
+        .collection("users")
+        .document(user_id)
+        .collection("clients")
+        .document(client_id)
+        .collection("journalEntries")
+        .order_by("createdAt", direction=firestore.Query.DESCENDING)
+        .limit(JOURNAL_INDEX_MAX_ENTRIES)
+        .stream()
+    )
+    for doc in entry_docs:
+        try:
+            outcome = _index_journal_entry(user_id, client_id, doc.id, doc.to_dict() or {})
+        except Exception:
+            logger.exception("Journal index backfill failed for entryId=%s", doc.id)
+            outcome = "failed"
+        stats[outcome] = stats.get(outcome, 0) + 1
+    if not stats.get("failed"):
+        # Only now does the index cover entries written before the trigger.
+        _bump_journal_index_version(user_id, client_id, backfilledSignature=_journal_index_signature())
+    logger.info("Journal index backfill: uid=%s clientId=%s %s", user_id, client_id, stats)
+    return stats
+
+
+def _journal_candidates(user_id: str, client_id: str, signature: str, version: int) -> list:
+    """Passages of the newest indexed entries, cached until the index version changes."""
+    cache_key = f"{user_id}/{client_id}"
+    cached = _journal_candidates_cache.get(cache_key)
+    if cached is not None and cached[0] == (signature, version):
+        return cached[1]
+    candidates = []
+    for doc in (
+        _journal_index_col(user_id, client_id)
+        .order_by("createdAtMs", direction=firestore.Query.DESCENDING)
+        .limit(AGENT_RETRIEVAL_MAX_ENTRIES)
+        .stream()
+    ):
+        data = doc.to_dict() or {}
+        if data.get("signature") != signature:
+            continue
+        created_ms = _safe_int(data.get("createdAtMs"), 0)
+        for passage in data.get("passages") or []:
+            if passage.get("text"):
+                candidates.append((created_ms, passage["text"], array("f", passage.get("vector") or [])))
+    _journal_candidates_cache.set(cache_key, ((signature, version), candidates))
+    return candidates
+
+
+def _retrieve_journal_passages(user_id: str, client_id: str, query: str) -> list[str] | None:
+    """Return the top-k passages for query, most relevant first.
+
+    Returns None when the client has no usable index yet, so callers can fall
+    back to the newest notes and start a backfill. Read and embedding errors
+    propagate.
+    """
+    signature = _journal_index_signature()
+    meta_snapshot = _journal_index_meta_ref(user_id, client_id).get()
+    meta = (meta_snapshot.to_dict() or {}) if meta_snapshot.exists else {}
+    if meta.get("backfilledSignature") != signature:
+        return None
+    candidates = _journal_candidates(user_id, client_id, signature, _safe_int(meta.get("version"), 0))
+    if not candidates:
+        return []
+
+    query = _truncate_to_tokens(query, AGENT_RETRIEVAL_QUERY_TOKENS)
+    if not query:
+        # Nothing to rank against: newest passages first.
+        return [text for _, text, _ in candidates[:AGENT_RETRIEVAL_TOP_K]]
+
+    query_vector = _embed_texts([query], owner_uid=user_id)[0]
+    scored = [
+        (sum(a * b for a, b in zip(query_vector, vector)), created_ms, text)
+        for created_ms, text, vector in candidates
+    ]
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [text for _, _, text in scored[:AGENT_RETRIEVAL_TOP_K]]
+
+
+@firestore_fn.on_document_written(
+    document="users/{uid}/clients/{clientId}/journalEntries/{entryId}",
+    database=FIRESTORE_DATABASE_ID,
+)
+def index_journal_entry(
+    event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]],
+) -> None:
+    after = event.data.after if event.data is not None else None
+    entry = after.to_dict() if after is not None and after.exists else None
+    try:
+        outcome = _index_journal_entry(
+            event.params["uid"], event.params["clientId"], event.params["entryId"], entry
+        )
+        logger.info(
+            "Journal index: uid=%s clientId=%s entryId=%s outcome=%s",
+            event.params["uid"],
+            event.params["clientId"],
+            event.params["entryId"],
+            outcome,
+        )
+    except Exception:
+        logger.exception("Journal indexing failed")
 
 
-@https_fn.on_request()
-def agent_chat(req: https_fn.Request) -> https_fn.Response:
+def _handle_agent_chat(req: https_fn.Request) -> https_fn.Response:
     logger.info("Incoming agent_chat request: method=%s", req.method)
 
     if req.method == "OPTIONS":
@@ -1068,21 +4837,17 @@ def agent_chat(req: https_fn.Request) -> https_fn.Response:
     try:
         ensure_firebase_app()
 
-        id_token = _parse_bearer_token(req)
-        if not id_token:
-            return _error("Missing auth token.", status=401)
+        uid, auth_error = _authenticate(req)
+        if auth_error is not None:
+            return auth_error
 
-        decoded = auth.verify_id_token(id_token)
-        uid = decoded.get("uid")
-        if not uid:
-            return _error("Invalid auth token.", status=401)
-
-        payload = req.get_json(silent=True) or {}
-        agent_id = str(payload.get("agentId") or "").strip()
-        client_id = str(payload.get("clientId") or "").strip()
-        message = str(payload.get("message") or "").strip()
-        action_id = str(payload.get("actionId") or "").strip() or None
-        draft_text = str(payload.get("draftText") or "").strip()
+        payload = _parse_request_json(req) or {}
+        fields = _decode_fields(_AgentChatRequest, payload)
+        agent_id = fields["agentId"]
+        client_id = fields["clientId"]
+        message = fields["message"]
+        action_id = fields["actionId"] or None
+        draft_text = fields["draftText"]
 
         instructions = _agent_instructions(agent_id)
         if not instructions:
@@ -1107,64 +4872,118 @@ def agent_chat(req: https_fn.Request) -> https_fn.Response:
             .collection("messages")
         )
 
-        # 1) Save user message if it's a chat (not pure action without text)
-        if message:
-            messages_col.document().set(
-                {
-                    "role": "user",
-                    "text": message,
-                    "agentId": agent_id,
-                    "createdAtMs": now_ms,
-                    "createdAtIso": now_iso,
-                    "ownerUid": uid,
-                }
-            )
+        request_started = time.perf_counter()
+        timings: Dict[str, float] = {}
 
-        # 2) Load shared history (last 30)
-        history_snap = (
-            messages_col.order_by("createdAtMs", direction=firestore.Query.DESCENDING)
-            .limit(30)
-            .stream()
+        # 1) Save user message if it's a chat (not pure action without text).
+        # The write overlaps with the context reads below; the new message is
+        # merged into the history locally if the read doesn't see it yet.
+        user_message_ref = messages_col.document() if message else None
+        user_message_payload = (
+            {
+                "role": "user",
+                "text": message,
+                "agentId": agent_id,
+                "createdAtMs": now_ms,
+                "createdAtIso": now_iso,
+                "ownerUid": uid,
+            }
+            if message
+            else None
         )
-        history_docs = list(history_snap)
-        history_items = [d.to_dict() for d in reversed(history_docs)]
 
-        def fmt_history(m: Dict[str, Any]) -> str:
-            role = m.get("role") or "unknown"
-            a = m.get("agentId") or "unknown"
-            who = "USER" if role == "user" else f"ASSISTANT({a})"
-            txt = str(m.get("text") or "")
-            if len(txt) > 1200:
-                txt = txt[:1200] + "…"
-            return f"{who}: {txt}"
+        def load_history() -> list:
+            # 2) Load shared history (last 30); turns already folded into the
+            # rolling summary are filtered out below.
+            return list(
+                messages_col.order_by("createdAtMs", direction=firestore.Query.DESCENDING)
+                .limit(30)
+                .stream()
+            )
+
+        def load_chat_summary():
+            return messages_col.parent.get()
+
+        def load_client():
+            # 3) Client + recent journal (optional)
+            return (
+                db_client.collection("users").document(uid).collection("clients").document(client_id).get()
+            )
+
+        retrieval_query = "\n".join(part for part in (message, draft_text) if part)
 
-        shared_history = "\n".join([fmt_history(m) for m in history_items])
+        def load_passages() -> list[str] | None:
+            try:
+                return _retrieve_journal_passages(uid, client_id, retrieval_query)
+            except Exception:
+                # [] rather than None: the index exists, so no backfill.
+                logger.warning("agent_chat journal retrieval failed; using newest notes", exc_info=True)
+                return []
+
+        def load_journal() -> list:
+            return list(
+                db_client.collection("users")
+                .document(uid)
+                .collection("clients")
+                .document(client_id)
+                .collection("journalEntries")
+                .order_by("createdAt", direction=firestore.Query.DESCENDING)
+                .limit(3)
+                .stream()
+            )
 
-        # 3) Client + recent journal (optional)
-        client_doc = (
-            db_client.collection("users").document(uid).collection("clients").document(client_id).get()
+        executor = get_io_executor()
+        write_future = (
+            _submit_traced(executor, "saveMessage", _timed_call, user_message_ref.set, user_message_payload)
+            if user_message_ref is not None
+            else None
         )
+        history_future = _submit_traced(executor, "history", _timed_call, load_history)
+        summary_future = _submit_traced(executor, "chatSummary", _timed_call, load_chat_summary)
+        client_future = _submit_traced(executor, "client", _timed_call, load_client)
+        journal_future = _submit_traced(executor, "journal", _timed_call, load_journal)
+        passages_future = _submit_traced(executor, "passages", _timed_call, load_passages)
+
+        history_docs, timings["history_ms"] = history_future.result()
+        summary_doc, timings["summary_ms"] = summary_future.result()
+        client_doc, timings["client_ms"] = client_future.result()
+        journal_docs, timings["journal_ms"] = journal_future.result()
+        passages, timings["retrieval_ms"] = passages_future.result()
+        timings["context_ms"] = (time.perf_counter() - request_started) * 1000
+
+        history_items = [d.to_dict() for d in reversed(history_docs)]
+        if user_message_ref is not None and user_message_ref.id not in {
+            d.id for d in history_docs
+        }:
+            history_items.append(user_message_payload)
+            history_items = history_items[-30:]
+
+        summary_data = summary_doc.to_dict() if summary_doc and summary_doc.exists else {}
+        conversation_summary = str(summary_data.get("compactSummary") or "").strip()
+        compacted_through_ms = _safe_int(summary_data.get("compactedThroughMs"), 0)
+        history_items = [
+            m
+            for m in history_items
+            if _safe_int(m.get("createdAtMs"), 0) > compacted_through_ms
+        ]
+
         client_data = client_doc.to_dict() if client_doc and client_doc.exists else {}
 
-        journal_snap = (
-            db_client.collection("users")
-            .document(uid)
-            .collection("clients")
-            .document(client_id)
-            .collection("journalEntries")
-            .order_by("createdAt", direction=firestore.Query.DESCENDING)
-            .limit(3)
-            .stream()
-        )
-        journal_docs = list(journal_snap)
         recent_notes = []
         for d in journal_docs:
             data = d.to_dict() or {}
             content = data.get("content") or data.get("text") or ""
             if content:
-                recent_notes.append(str(content)[:900])
-
-        recent_notes_text = "\n".join([f"- [{i+1}] {t}" for i, t in enumerate(recent_notes)])
+                recent_notes.append(f"- [{len(recent_notes) + 1}] {content}")
+        if passages:
+            journal_header = "RelevantJournal:"
+            journal_items = [f"- {p}" for p in passages]
+        else:
+            journal_header = "RecentJournal:"
+            journal_items = recent_notes
+            if passages is None and journal_docs:
+                # No index yet for this client: build it for the next request.
+                executor.submit(_backfill_journal_index, uid, client_id)
 
         client_name = (
             client_data.get("navn")
@@ -1179,14 +4998,44 @@ def agent_chat(req: https_fn.Request) -> https_fn.Response:
         ]
         if client_data.get("goal"):
             context_parts.append(f"Goal: {client_data.get('goal')}")
-        if recent_notes_text:
-            context_parts.append(f"RecentJournal:\n{recent_notes_text}")
-        if shared_history:
-            context_parts.append(f"SharedHistory:\n{shared_history}")
 
-        user_input = "\n\n".join(context_parts)
-
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        system_prompt = f"{instructions}\n\n{AGENT_ACTION_PROMPT}" if action_id else instructions
+        if action_id:
+            draft_text = _truncate_to_tokens(draft_text, AGENT_DRAFT_TOKEN_BUDGET)
+
+        prompt = (
+            PromptBuilder(AGENT_CHAT_PROMPT_BUDGET)
+            .reserve("instructions", system_prompt)
+            .reserve("draft", draft_text if action_id else "")
+            .add("client", context_parts, budget=AGENT_CLIENT_TOKEN_BUDGET, priority=40)
+            .add(
+                "journal",
+                journal_items,
+                budget=AGENT_JOURNAL_TOKEN_BUDGET,
+                priority=20,
+                header=journal_header,
+                item_budget=AGENT_JOURNAL_ITEM_TOKENS,
+            )
+            .add(
+                "summary",
+                conversation_summary,
+                budget=AGENT_SUMMARY_TOKEN_BUDGET,
+                priority=30,
+                header="ConversationSummary:",
+            )
+            .add(
+                "history",
+                [_format_chat_message(m) for m in reversed(history_items)],
+                budget=CHAT_HISTORY_TOKEN_BUDGET,
+                priority=10,
+                header="SharedHistory:",
+                item_budget=AGENT_HISTORY_ITEM_TOKENS,
+                reverse=True,
+            )
+            .build()
+        )
+        _log_prompt_usage("agent_chat", prompt)
+        user_input = prompt["text"]
 
         # Helper: save assistant message
         def save_assistant(text: str, blocks: list[dict] | None = None):
@@ -1204,85 +5053,93 @@ def agent_chat(req: https_fn.Request) -> https_fn.Response:
             }
             if blocks:
                 payload_to_store["blocks"] = blocks
-            messages_col.document().set(payload_to_store)
+            if write_future is not None:
+                _, timings["write_ms"] = write_future.result()
+            _, timings["save_ms"] = _timed_call(messages_col.document().set, payload_to_store)
+            timings["total_ms"] = (time.perf_counter() - request_started) * 1000
+            logger.info(
+                "agent_chat timings: mode=%s %s",
+                "action" if action_id else "chat",
+                " ".join(f"{k}={v:.0f}" for k, v in timings.items()),
+            )
             return payload_to_store
 
         # If actionId is present, run action-mode (return blocks)
         if action_id:
-            action_prompt = f"""
-Du er en fysioterapeutisk assistent. Du får et udkast til journal (draftText), patientkontekst og shared historik mellem agenter.
-Du skal returnere JSON med:
-{{
-  "text": "kort svar til brugeren",
-  "blocks": [
-    {{"id": "block1", "title": "...", "text": "...", "defaultMode": "append"|"replace"}}
-  ]
-}}
-Hvis du får actionId, så producer blocks der matcher actionId:
-- journal_pack: 3 blocks (ræsonnering, plan/træning, guideline-check)
-- soap: 1 block (SOAP-notat)
-- missing: 1 block (Manglende data)
-- redflags: 1 block (Safety/Røde flag)
-- plan_check: 1 block (plan-review)
-- dosage: 1 block (dosering/progression)
-- patient_info: 1 block (kort patient-venlig tekst)
-- today_training: 1 block (dagens træning)
-- home_program: 1 block (hjemmeprogram + progression)
-- next_appt: 1 block (næste aftale + begrundelse)
-
-Feltet defaultMode skal være "append" som udgangspunkt; brug "replace" hvis block er et fuldt notat.
-            """.strip()
-
             user_payload = {
                 "actionId": action_id,
                 "draftText": draft_text,
                 "clientContext": user_input,
             }
 
-            completion = client.chat.completions.create(
-                model=os.getenv("OPENAI_AGENT_CHAT_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": instructions + "\n\n" + action_prompt},
-                    {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
-                ],
-                temperature=0.2,
-                response_format={"type": "json_object"},
-            )
-
-            raw = completion.choices[0].message.content if completion.choices else "{}"
-            try:
-                parsed = json.loads(raw or "{}")
-            except Exception:
-                parsed = {}
-
-            text_out = str(parsed.get("text") or "").strip()
-            blocks = parsed.get("blocks")
-            valid_blocks = []
-            if isinstance(blocks, list):
-                for i, b in enumerate(blocks):
-                    if not isinstance(b, dict):
-                        continue
-                    title = str(b.get("title") or "").strip() or f"Block {i+1}"
-                    bt = str(b.get("text") or "").strip()
-                    if not bt:
-                        continue
-                    mode = b.get("defaultMode") or "append"
-                    if mode not in ("append", "replace"):
-                        mode = "append"
-                    valid_blocks.append(
-                        {
-                            "id": b.get("id") or f"block{i+1}",
-                            "title": title,
-                            "text": bt,
-                            "defaultMode": mode,
-                        }
+            fan_out_specs = AGENT_FAN_OUT_ACTIONS.get(action_id)
+            fan_out = payload.get("fanOut")
+            fan_out = AGENT_FAN_OUT_ENABLED if fan_out is None else fan_out is True
+            if fan_out_specs and fan_out:
+                # One concurrent completion per block: wall-clock is the
+                # slowest block instead of the sum of all of them.
+                llm_started = time.perf_counter()
+                block_futures = [
+                    (
+                        spec,
+                        _submit_traced(
+                            get_llm_executor(), "actionBlock", _timed_call, _generate_action_block, uid, spec, user_payload
+                        ),
                     )
+                    for spec in fan_out_specs
+                ]
+                valid_blocks = []
+                block_error: Exception | None = None
+                for spec, future in block_futures:
+                    try:
+                        block, timings[f"llm_{spec['agentId']}_ms"] = future.result()
+                    except Exception as exc:
+                        block_error = exc
+                        logger.exception(
+                            "agent_chat fan-out block failed: actionId=%s agentId=%s",
+                            action_id,
+                            spec["agentId"],
+                        )
+                        continue
+                    if block:
+                        valid_blocks.append(block)
+                timings["llm_ms"] = (time.perf_counter() - llm_started) * 1000
+                if not valid_blocks and isinstance(block_error, _UpstreamUnavailable):
+                    raise block_error
+                if not valid_blocks:
+                    raise RuntimeError(f"All fan-out blocks failed for actionId={action_id}")
+                text_out = "Udkast klar: " + ", ".join(b["title"] for b in valid_blocks)
+            else:
+                completion, timings["llm_ms"] = _timed_call(
+                    _chat_completion,
+                    "agent_chat",
+                    uid,
+                    model=os.getenv("OPENAI_AGENT_CHAT_MODEL", "gpt-4o-mini"),
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
+                    ],
+                    temperature=0.2,
+                    response_format={"type": "json_object"},
+                )
+
+                raw = completion.choices[0].message.content if completion.choices else "{}"
+                try:
+                    parsed = json.loads(raw or "{}")
+                except Exception:
+                    parsed = {}
+
+                text_out = str(parsed.get("text") or "").strip()
+                valid_blocks = _normalize_action_blocks(parsed.get("blocks"))
 
             saved = save_assistant(text_out, valid_blocks if valid_blocks else None)
             return _json_response({"output_text": text_out, "blocks": saved.get("blocks")}, status=200)
 
         # Else: chat mode
-        completion = client.chat.completions.create(
+        completion, timings["llm_ms"] = _timed_call(
+            _chat_completion,
+            "agent_chat",
+            uid,
             model=os.getenv("OPENAI_AGENT_CHAT_MODEL", "gpt-4o-mini"),
             messages=[
                 {"role": "system", "content": instructions},
@@ -1295,13 +5152,20 @@ Feltet defaultMode skal være "append" som udgangspunkt; brug "replace" hvis blo
 
         save_assistant(output)
         return _json_response({"output_text": output}, status=200)
+    except _UpstreamUnavailable as exc:
+        logger.warning("%s", exc)
+        return _upstream_unavailable_response(exc)
     except Exception:
         logger.exception("agent_chat failed")
         return _error("agent_chat failed", status=500)
 
 
-@https_fn.on_request()
-def createClientFromBooking(req: https_fn.Request) -> https_fn.Response:
+@https_fn.on_request(**_concurrency_options("agent_chat", HTTP_CONCURRENCY_LLM))
+def agent_chat(req: https_fn.Request) -> https_fn.Response:
+    return _serve("agent_chat", _handle_agent_chat, req)
+
+
+def _handle_createClientFromBooking(req: https_fn.Request) -> https_fn.Response:
     logger.info("Incoming createClientFromBooking request: method=%s", req.method)
 
     origin = req.headers.get("Origin")
@@ -1312,19 +5176,25 @@ def createClientFromBooking(req: https_fn.Request) -> https_fn.Response:
     if req.method != "POST":
         return _booking_error("Only POST requests are supported.", status=405, origin=origin)
 
-    data = req.get_json(silent=True) or {}
-    clinic_slug = str(data.get("clinicSlug") or "").strip().lower()
-    service_id = data.get("serviceId") or None
-    start_iso = str(data.get("startIso") or "").strip()
-    end_iso = str(data.get("endIso") or "").strip()
-    first_name = str(data.get("firstName") or "").strip()
-    last_name = str(data.get("lastName") or "").strip()
-    email = str(data.get("email") or "").strip()
+    fields = _decode_fields(_BookingRequest, _parse_request_json(req) or {})
+    clinic_slug = fields["clinicSlug"].lower()
+    service_id = fields["serviceId"] or None
+    start_iso = fields["startIso"]
+    end_iso = fields["endIso"]
+    first_name = fields["firstName"]
+    last_name = fields["lastName"]
+    email = fields["email"]
     email_lower = _normalize_email(email)
-    phone = str(data.get("phone") or "").strip()
-    notes = str(data.get("notes") or "").strip()
-    privacy_accepted = data.get("privacyAccepted") is True
-    marketing_opt_in = data.get("marketingOptIn") is True
+    phone = fields["phone"]
+    notes = fields["notes"]
+    privacy_accepted = fields["privacyAccepted"]
+    marketing_opt_in = fields["marketingOptIn"]
+
+    retry_after = _rate_limit_retry_after(req, "createClientFromBooking", clinic_slug)
+    if retry_after:
+        response = _booking_error("Too many requests. Please retry shortly.", status=429, origin=origin)
+        response.headers["Retry-After"] = _retry_after_header(retry_after)
+        return response
 
     if not clinic_slug:
         return _booking_error("Missing clinicSlug.", status=400, origin=origin)
@@ -1350,7 +5220,8 @@ def createClientFromBooking(req: https_fn.Request) -> https_fn.Response:
     telefon_komplet = phone or ""
 
     clinic_ref = get_db().collection("publicClinics").document(clinic_slug)
-    clinic_snap = clinic_ref.get()
+    with _span("clinic"):
+        clinic_snap = clinic_ref.get()
     if not clinic_snap.exists:
         return _booking_error("Clinic not found.", status=404, origin=origin)
 
@@ -1451,8 +5322,12 @@ def createClientFromBooking(req: https_fn.Request) -> https_fn.Response:
     )
 
 
-@https_fn.on_request()
-def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
+@https_fn.on_request(**_concurrency_options("createClientFromBooking", HTTP_CONCURRENCY_PUBLIC))
+def createClientFromBooking(req: https_fn.Request) -> https_fn.Response:
+    return _serve("createClientFromBooking", _handle_createClientFromBooking, req)
+
+
+def _handle_publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
     if req.method == "OPTIONS":
         return _public_booking_empty_response(req, status=204)
 
@@ -1463,19 +5338,24 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
     if data is None:
         return _public_booking_error(req, "Invalid JSON.", status=400)
 
-    clinic_slug = str(data.get("clinicSlug") or "").strip().lower()
-    staff_uid = str(data.get("staffUid") or "").strip()
-    first_name = str(data.get("firstName") or "").strip()
-    last_name = str(data.get("lastName") or "").strip()
-    email = str(data.get("email") or "").strip()
+    fields = _decode_fields(_BookingRequest, data)
+    clinic_slug = fields["clinicSlug"].lower()
+    staff_uid = fields["staffUid"]
+    first_name = fields["firstName"]
+    last_name = fields["lastName"]
+    email = fields["email"]
     email_lower = _normalize_email(email)
-    service_id = str(data.get("serviceId") or "").strip()
-    start_iso = str(data.get("startIso") or "").strip()
-    end_iso = str(data.get("endIso") or "").strip()
-    phone = str(data.get("phone") or "").strip()
-    notes = str(data.get("notes") or "").strip()
-    privacy_accepted = data.get("privacyAccepted") is True
-    marketing_opt_in = data.get("marketingOptIn") is True
+    service_id = fields["serviceId"]
+    start_iso = fields["startIso"]
+    end_iso = fields["endIso"]
+    phone = fields["phone"]
+    notes = fields["notes"]
+    privacy_accepted = fields["privacyAccepted"]
+    marketing_opt_in = fields["marketingOptIn"]
+
+    limited = _public_rate_limited(req, "publicBookAppointment", clinic_slug)
+    if limited is not None:
+        return limited
 
     missing = []
     if _is_blank(clinic_slug):
@@ -1513,7 +5393,8 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
         )
 
     clinic_ref = get_db().collection("publicClinics").document(clinic_slug)
-    clinic_snap = clinic_ref.get()
+    with _span("clinic"):
+        clinic_snap = clinic_ref.get()
     if not clinic_snap.exists:
         return _public_booking_error(req, "Clinic not found.", status=404)
 
@@ -1541,14 +5422,15 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
         tzinfo = timezone.utc
         timezone_name = "UTC"
 
-    staff_doc = (
-        get_db()
-        .collection("users")
-        .document(owner_uid)
-        .collection("team")
-        .document(staff_uid)
-        .get()
-    )
+    with _span("staff"):
+        staff_doc = (
+            get_db()
+            .collection("users")
+            .document(owner_uid)
+            .collection("team")
+            .document(staff_uid)
+            .get()
+        )
     staff_data = staff_doc.to_dict() if staff_doc.exists else {}
     staff_name = staff_data.get("name") or ""
     if not staff_name:
@@ -1595,9 +5477,12 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
         .document(owner_uid)
         .collection("appointments")
     )
-    overlapping_docs = appointments_ref.where("start", ">=", _to_utc_iso(day_start)).where(
-        "start", "<", _to_utc_iso(day_end)
-    ).stream()
+    with _span("appointments"):
+        overlapping_docs = list(
+            appointments_ref.where("start", ">=", _to_utc_iso(day_start))
+            .where("start", "<", _to_utc_iso(day_end))
+            .stream()
+        )
 
     for doc in overlapping_docs:
         appt = doc.to_dict() or {}
@@ -1633,9 +5518,10 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
 
     telefon_komplet = phone or f"{telefon_land} {telefon_value}".strip()
 
-    owner_profile = (
-        get_db().collection("users").document(calendar_owner_id).get()
-    )
+    with _span("owner"):
+        owner_profile = (
+            get_db().collection("users").document(calendar_owner_id).get()
+        )
     owner_data = owner_profile.to_dict() if owner_profile.exists else {}
     owner_email = owner_data.get("email") or owner_data.get("ownerEmail") or ""
     owner_name = (
@@ -1656,9 +5542,10 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
     )
     existing_client = None
     if phone_norm:
-        existing_client = list(
-            clients_ref.where("phoneNorm", "==", phone_norm).limit(1).stream()
-        )
+        with _span("client"):
+            existing_client = list(
+                clients_ref.where("phoneNorm", "==", phone_norm).limit(1).stream()
+            )
 
     now_iso = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
     if existing_client:
@@ -1691,7 +5578,8 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
         if _is_blank(client_data.get("ownerIdentifier")) and owner_identifier:
             updates["ownerIdentifier"] = owner_identifier
         if len(updates) > 1:
-            client_doc.reference.set(updates, merge=True)
+            with _span("client.write"):
+                client_doc.reference.set(updates, merge=True)
         client_upsert_action = "found"
     else:
         client_payload = {
@@ -1713,7 +5601,8 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
             "updatedAt": firestore.SERVER_TIMESTAMP,
         }
         client_ref = clients_ref.document()
-        client_ref.set(client_payload)
+        with _span("client.write"):
+            client_ref.set(client_payload)
         client_id = client_ref.id
 
     logger.info(
@@ -1767,7 +5656,8 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
         "createdAt": firestore.SERVER_TIMESTAMP,
         "updatedAt": firestore.SERVER_TIMESTAMP,
     }
-    appointment_ref.set(appointment_payload)
+    with _span("appointment.write"):
+        appointment_ref.set(appointment_payload)
 
     return _public_booking_json_response(
         req,
@@ -1776,8 +5666,12 @@ def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
     )
 
 
-@https_fn.on_request()
-def publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
+@https_fn.on_request(**_concurrency_options("publicBookAppointment", HTTP_CONCURRENCY_PUBLIC))
+def publicBookAppointment(req: https_fn.Request) -> https_fn.Response:
+    return _serve("publicBookAppointment", _handle_publicBookAppointment, req)
+
+
+def _handle_publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
     if req.method == "OPTIONS":
         return _public_booking_empty_response(req, status=204)
 
@@ -1788,30 +5682,15 @@ def publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
     if data is None:
         return _public_booking_error(req, "Invalid JSON.", status=400)
 
-    query_params = dict(req.args or {})
-    clinic_slug = str(
-        (query_params.get("clinicSlug") if query_params else None) or data.get("clinicSlug") or ""
-    ).strip().lower()
-    staff_uid = str(
-        (query_params.get("staffUid") if query_params else None) or data.get("staffUid") or ""
-    ).strip()
-    date_iso = str(
-        (query_params.get("dateIso") if query_params else None) or data.get("dateIso") or ""
-    ).strip()
-    service_id = str(
-        (query_params.get("serviceId") if query_params else None) or data.get("serviceId") or ""
-    ).strip()
+    fields = _decode_fields(_AvailabilityRequest, data, req.args)
+    clinic_slug = fields["clinicSlug"].lower()
+    staff_uid = fields["staffUid"]
+    date_iso = fields["dateIso"]
+    service_id = fields["serviceId"]
 
-    logger.info(
-        "publicGetAvailability params: %s",
-        {
-            "clinicSlug": clinic_slug,
-            "staffUid": staff_uid,
-            "dateIso": date_iso,
-            "serviceId": service_id,
-            "method": req.method,
-        },
-    )
+    limited = _public_rate_limited(req, "publicGetAvailability", clinic_slug)
+    if limited is not None:
+        return limited
 
     missing = []
     if _is_blank(clinic_slug):
@@ -1831,7 +5710,8 @@ def publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
         )
 
     clinic_ref = get_db().collection("publicClinics").document(clinic_slug)
-    clinic_snap = clinic_ref.get()
+    with _span("clinic"):
+        clinic_snap = clinic_ref.get()
     if not clinic_snap.exists:
         return _public_booking_error(req, "Clinic not found.", status=404)
 
@@ -1878,7 +5758,8 @@ def publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
         .collection("services")
         .document(service_id)
     )
-    service_snap = service_ref.get()
+    with _span("service"):
+        service_snap = service_ref.get()
     if not service_snap.exists:
         return _public_booking_error(
             req,
@@ -1892,34 +5773,32 @@ def publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
         context=f"serviceId:{service_id}",
     )
 
-    staff_doc = (
-        get_db()
-        .collection("users")
-        .document(owner_uid)
-        .collection("team")
-        .document(staff_uid)
-        .get()
-    )
+    with _span("staff"):
+        staff_doc = (
+            get_db()
+            .collection("users")
+            .document(owner_uid)
+            .collection("team")
+            .document(staff_uid)
+            .get()
+        )
     staff_data = staff_doc.to_dict() if staff_doc.exists else {}
 
     day_key = _get_weekday_key_long(parsed_date)
     work_hours, resolved_staff_uid = _resolve_staff_work_hours(
         clinic_data, staff_uid, staff_data
     )
-    work_day = work_hours.get(day_key) if isinstance(work_hours, dict) else None
-    if not isinstance(work_day, dict) or work_day.get("enabled") is not True:
-        logger.info(
-            "publicGetAvailability workHours closed clinicSlug=%s staffUid=%s dateIso=%s serviceId=%s resolvedStaffUid=%s weekday=%s workStart=%s workEnd=%s slotsBefore=%s slotsAfter=%s",
-            clinic_slug,
-            staff_uid,
-            date_iso,
-            service_id,
-            resolved_staff_uid or "-",
-            day_key,
-            "-",
-            "-",
-            0,
-            0,
+    window = _resolve_work_window(work_hours, parsed_date)
+    if window.get("reason") == "CLOSED":
+        _log_event(
+            "availability",
+            clinicSlug=clinic_slug,
+            staffUid=staff_uid,
+            dateIso=date_iso,
+            serviceId=service_id,
+            resolvedStaffUid=resolved_staff_uid,
+            weekday=day_key,
+            reason="CLOSED",
         )
         return _public_booking_json_response(
             req,
@@ -1932,27 +5811,14 @@ def publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
             },
             status=200,
         )
+    if window.get("error"):
+        return _public_booking_error(req, window["error"], status=400)
 
-    start_raw = work_day.get("start")
-    end_raw = work_day.get("end")
-    if not isinstance(start_raw, str) or not isinstance(end_raw, str) or not start_raw or not end_raw:
-        return _public_booking_error(
-            req,
-            f"workHours missing start/end for {day_key}.",
-            status=400,
-        )
-
-    start_minutes = _parse_time_minutes(start_raw)
-    end_minutes = _parse_time_minutes(end_raw)
-    if start_minutes is None or end_minutes is None or end_minutes <= start_minutes:
-        return _public_booking_error(
-            req,
-            f"Invalid workHours for {day_key}.",
-            status=400,
-        )
-
-    work_start_label = _format_minutes_as_time(start_minutes)
-    work_end_label = _format_minutes_as_time(end_minutes)
+    staff_name = staff_data.get("name") or ""
+    if not staff_name:
+        first = staff_data.get("firstName") or ""
+        last = staff_data.get("lastName") or ""
+        staff_name = f"{first} {last}".strip()
 
     day_start_local = datetime(
         parsed_date.year,
@@ -1962,74 +5828,32 @@ def publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
         0,
         tzinfo=tzinfo,
     )
-    day_end_local = day_start_local + timedelta(days=1)
-    day_start_iso = _to_utc_iso(day_start_local)
-    day_end_iso = _to_utc_iso(day_end_local)
-
-    staff_name = staff_data.get("name") or ""
-    if not staff_name:
-        first = staff_data.get("firstName") or ""
-        last = staff_data.get("lastName") or ""
-        staff_name = f"{first} {last}".strip()
-
-    appointments_ref = (
-        get_db()
-        .collection("users")
-        .document(owner_uid)
-        .collection("appointments")
-    )
-    appointment_docs = appointments_ref.where("start", ">=", day_start_iso).where(
-        "start", "<", day_end_iso
-    ).stream()
-
-    busy_ranges = []
-    for doc in appointment_docs:
-        appt = doc.to_dict() or {}
-        if not _appointment_matches_staff(appt, staff_uid, staff_name, owner_uid):
-            continue
-        appt_start = _parse_iso_datetime(appt.get("start") or appt.get("startIso"))
-        appt_end = _parse_iso_datetime(appt.get("end") or appt.get("endIso"))
-        if not appt_start or not appt_end:
-            continue
-        busy_ranges.append((appt_start, appt_end))
-
-    candidate_slots = []
-    slot_start_minutes = start_minutes
-    while slot_start_minutes + service_minutes <= end_minutes:
-        slot_start_local = day_start_local + timedelta(minutes=slot_start_minutes)
-        slot_end_local = slot_start_local + timedelta(minutes=service_minutes)
-        candidate_slots.append((slot_start_local, slot_end_local))
-        slot_start_minutes += slot_minutes
-
-    slots = []
-    for slot_start_local, slot_end_local in candidate_slots:
-        slot_start = slot_start_local.astimezone(timezone.utc)
-        slot_end = slot_end_local.astimezone(timezone.utc)
-        overlaps = False
-        for busy_start, busy_end in busy_ranges:
-            if slot_start < busy_end and slot_end > busy_start:
-                overlaps = True
-                break
-        if not overlaps:
-            slots.append(
-                {
-                    "startIso": _to_utc_iso(slot_start_local),
-                    "endIso": _to_utc_iso(slot_end_local),
-                }
-            )
-
-    logger.info(
-        "publicGetAvailability workHours clinicSlug=%s staffUid=%s dateIso=%s serviceId=%s resolvedStaffUid=%s weekday=%s workStart=%s workEnd=%s slotsBefore=%s slotsAfter=%s",
-        clinic_slug,
+    busy_ranges = _load_busy_ranges(
+        owner_uid,
         staff_uid,
-        date_iso,
-        service_id,
-        resolved_staff_uid or "-",
-        day_key,
-        work_start_label or "-",
-        work_end_label or "-",
-        len(candidate_slots),
-        len(slots),
+        staff_name,
+        day_start_local,
+        day_start_local + timedelta(days=1),
+    )
+    day = _compute_day_slots(
+        window, parsed_date, service_minutes, slot_minutes, tzinfo, busy_ranges
+    )
+    slots = day["slots"]
+    work_start_label = day["workStart"]
+    work_end_label = day["workEnd"]
+
+    _log_event(
+        "availability",
+        clinicSlug=clinic_slug,
+        staffUid=staff_uid,
+        dateIso=date_iso,
+        serviceId=service_id,
+        resolvedStaffUid=resolved_staff_uid,
+        weekday=day_key,
+        workStart=work_start_label,
+        workEnd=work_end_label,
+        slotsBefore=day["candidateCount"],
+        slotsAfter=len(slots),
     )
 
     return _public_booking_json_response(
@@ -2044,8 +5868,12 @@ def publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
     )
 
 
-@https_fn.on_request()
-def getClinicStaffPublic(req: https_fn.Request) -> https_fn.Response:
+@https_fn.on_request(**_concurrency_options("publicGetAvailability", HTTP_CONCURRENCY_PUBLIC))
+def publicGetAvailability(req: https_fn.Request) -> https_fn.Response:
+    return _serve("publicGetAvailability", _handle_publicGetAvailability, req)
+
+
+def _handle_getClinicStaffPublic(req: https_fn.Request) -> https_fn.Response:
     if req.method == "OPTIONS":
         return _public_booking_empty_response(req, status=204)
 
@@ -2056,11 +5884,12 @@ def getClinicStaffPublic(req: https_fn.Request) -> https_fn.Response:
     if data is None:
         return _public_booking_error(req, "Invalid JSON.", status=400)
 
-    clinic_slug = (
-        str((req.args.get("clinicSlug") if req.args else None) or data.get("clinicSlug") or "")
-        .strip()
-        .lower()
-    )
+    fields = _decode_fields(_ClinicRequest, data, req.args)
+    clinic_slug = fields["clinicSlug"].lower()
+
+    limited = _public_rate_limited(req, "getClinicStaffPublic", clinic_slug)
+    if limited is not None:
+        return limited
     if _is_blank(clinic_slug):
         return _public_booking_error(
             req,
@@ -2070,7 +5899,8 @@ def getClinicStaffPublic(req: https_fn.Request) -> https_fn.Response:
         )
 
     clinic_ref = get_db().collection("publicClinics").document(clinic_slug)
-    clinic_snap = clinic_ref.get()
+    with _span("clinic"):
+        clinic_snap = clinic_ref.get()
     if not clinic_snap.exists:
         return _public_booking_error(req, "Clinic not found.", status=404)
 
@@ -2138,8 +5968,12 @@ def getClinicStaffPublic(req: https_fn.Request) -> https_fn.Response:
     )
 
 
-@https_fn.on_request()
-def getClinicServicesPublic(req: https_fn.Request) -> https_fn.Response:
+@https_fn.on_request(**_concurrency_options("getClinicStaffPublic", HTTP_CONCURRENCY_PUBLIC))
+def getClinicStaffPublic(req: https_fn.Request) -> https_fn.Response:
+    return _serve("getClinicStaffPublic", _handle_getClinicStaffPublic, req)
+
+
+def _handle_getClinicServicesPublic(req: https_fn.Request) -> https_fn.Response:
     if req.method == "OPTIONS":
         return _public_booking_empty_response(req, status=204)
 
@@ -2150,14 +5984,12 @@ def getClinicServicesPublic(req: https_fn.Request) -> https_fn.Response:
     if data is None:
         return _public_booking_error(req, "Invalid JSON.", status=400)
 
-    query_params = dict(req.args or {})
-    clinic_slug = str(
-        (query_params.get("clinicSlug") if query_params else None)
-        or (query_params.get("slug") if query_params else None)
-        or data.get("clinicSlug")
-        or data.get("slug")
-        or ""
-    ).strip().lower()
+    fields = _decode_fields(_ClinicRequest, data, req.args)
+    clinic_slug = (fields["clinicSlug"] or fields["slug"]).lower()
+
+    limited = _public_rate_limited(req, "getClinicServicesPublic", clinic_slug)
+    if limited is not None:
+        return limited
 
     if _is_blank(clinic_slug):
         return _public_booking_error(
@@ -2167,7 +5999,8 @@ def getClinicServicesPublic(req: https_fn.Request) -> https_fn.Response:
         )
 
     clinic_ref = get_db().collection("publicClinics").document(clinic_slug)
-    clinic_snap = clinic_ref.get()
+    with _span("clinic"):
+        clinic_snap = clinic_ref.get()
     if not clinic_snap.exists:
         return _public_booking_error(req, "Clinic not found", status=404)
 
@@ -2224,13 +6057,17 @@ def getClinicServicesPublic(req: https_fn.Request) -> https_fn.Response:
             }
         )
 
-    logger.info("getClinicServicesPublic clinicSlug=%s services=%s", clinic_slug, len(services))
+    _log_event("public_services", route="getClinicServicesPublic", clinicSlug=clinic_slug, services=len(services))
 
     return _public_booking_json_response(req, {"services": services}, status=200)
 
 
-@https_fn.on_request()
-def publicGetServices(req: https_fn.Request) -> https_fn.Response:
+@https_fn.on_request(**_concurrency_options("getClinicServicesPublic", HTTP_CONCURRENCY_PUBLIC))
+def getClinicServicesPublic(req: https_fn.Request) -> https_fn.Response:
+    return _serve("getClinicServicesPublic", _handle_getClinicServicesPublic, req)
+
+
+def _handle_publicGetServices(req: https_fn.Request) -> https_fn.Response:
     if req.method == "OPTIONS":
         return _public_booking_empty_response(req, status=204)
 
@@ -2241,12 +6078,12 @@ def publicGetServices(req: https_fn.Request) -> https_fn.Response:
     if data is None:
         return _public_booking_error(req, "Invalid JSON.", status=400)
 
-    query_params = dict(req.args or {})
-    clinic_slug = str(
-        (query_params.get("clinicSlug") if query_params else None)
-        or data.get("clinicSlug")
-        or ""
-    ).strip().lower()
+    fields = _decode_fields(_ClinicRequest, data, req.args)
+    clinic_slug = fields["clinicSlug"].lower()
+
+    limited = _public_rate_limited(req, "publicGetServices", clinic_slug)
+    if limited is not None:
+        return limited
 
     if _is_blank(clinic_slug):
         return _public_booking_error(
@@ -2256,7 +6093,8 @@ def publicGetServices(req: https_fn.Request) -> https_fn.Response:
         )
 
     clinic_ref = get_db().collection("publicClinics").document(clinic_slug)
-    clinic_snap = clinic_ref.get()
+    with _span("clinic"):
+        clinic_snap = clinic_ref.get()
     if not clinic_snap.exists:
         return _public_booking_error(req, "Clinic not found", status=404)
 
@@ -2319,6 +6157,182 @@ def publicGetServices(req: https_fn.Request) -> https_fn.Response:
             }
         )
 
-    logger.info("publicGetServices clinicSlug=%s services=%s", clinic_slug, len(services))
+    _log_event("public_services", route="publicGetServices", clinicSlug=clinic_slug, services=len(services))
 
     return _public_booking_json_response(req, {"services": services}, status=200)
+
+
+@https_fn.on_request(**_concurrency_options("publicGetServices", HTTP_CONCURRENCY_PUBLIC))
+def publicGetServices(req: https_fn.Request) -> https_fn.Response:
+    return _serve("publicGetServices", _handle_publicGetServices, req)
+
+
+# Per-instance bookkeeping: the first request an instance serves is logged as a
+# cold start with the route that woke it, so cold-start frequency can be read
+# from the logs per deployed function (see scripts/measure_cold_starts.py).
+_INSTANCE_ID = os.urandom(4).hex()
+_instance_lock = threading.Lock()
+_instance_requests = 0
+
+
+def _serve(route: str, handler, req: https_fn.Request) -> https_fn.Response:
+    """Call a route's handler, logging the instance's first request as a cold start."""
+    global _instance_requests
+    with _instance_lock:
+        _instance_requests += 1
+        cold = _instance_requests == 1
+    if cold:
+        _log_event(
+            "cold_start",
+            route=route,
+            function=os.getenv("FUNCTION_TARGET") or os.getenv("K_SERVICE") or "local",
+            instance=_INSTANCE_ID,
+            moduleLoadMs=round(_MODULE_LOAD_MS, 1),
+            sinceLoadMs=round((time.perf_counter() - _MODULE_LOAD_STARTED) * 1000, 1),
+        )
+        if _WARMUP_ENABLED:
+            _start_warm_up()
+    if not REQUEST_TRACING:
+        try:
+            return _compress_response(req, handler(req))
+        finally:
+            _flush_model_telemetry_if_due()
+
+    trace = _RequestTrace(route)
+    token = _current_trace.set(trace)
+    response = None
+    try:
+        response = handler(req)
+        with _span("compress"):
+            response = _compress_response(req, response)
+        return response
+    finally:
+        _current_trace.reset(token)
+        _finish_trace(trace, req, response)
+        _flush_model_telemetry_if_due()
+
+
+# Single routed entry point. Every HTTP endpoint is also served by `api` at
+# /api/<functionName> (or /<functionName> on the function's own URL), so traffic
+# can be consolidated onto one warm instance pool; the per-endpoint functions
+# above remain deployed as aliases for existing clients.
+API_ROUTES: Dict[str, Any] = {
+    "transcribe_audio": _handle_transcribe_audio,
+    "transcribe_audio_job": _handle_transcribe_audio_job,
+    "openai_completion": _handle_openai_completion,
+    "summarize_journal": _handle_summarize_journal,
+    "suggest_next_appointment": _handle_suggest_next_appointment,
+    "agent_chat": _handle_agent_chat,
+    "createClientFromBooking": _handle_createClientFromBooking,
+    "publicBookAppointment": _handle_publicBookAppointment,
+    "publicGetAvailability": _handle_publicGetAvailability,
+    "getClinicStaffPublic": _handle_getClinicStaffPublic,
+    "getClinicServicesPublic": _handle_getClinicServicesPublic,
+    "publicGetServices": _handle_publicGetServices,
+}
+
+
+# Uploads served by api that hold audio and ffmpeg work in memory.
+_API_TRANSCRIBE_ROUTES = frozenset({"transcribe_audio", "transcribe_audio_job", "corti/transcribe"})
+_api_transcribe_slots = threading.BoundedSemaphore(max(API_TRANSCRIBE_CONCURRENCY, 1))
+
+
+@https_fn.on_request(
+    timeout_sec=TRANSCRIBE_TIMEOUT_SECONDS,
+    memory=MemoryOption.GB_2,
+    **_concurrency_options("api", HTTP_CONCURRENCY_API),
+)
+def api(req: https_fn.Request) -> https_fn.Response:
+    path = (req.path or "").rstrip("/") or "/"
+    if req.method != "POST" or _api_route(path) not in _API_TRANSCRIBE_ROUTES:
+        return _route_api(req, path)
+    if not _api_transcribe_slots.acquire(timeout=API_TRANSCRIBE_WAIT_SECONDS):
+        response = _error("Too many transcriptions in progress. Please retry shortly.", status=503)
+        response.headers["Retry-After"] = "5"
+        return response
+    try:
+        return _route_api(req, path)
+    finally:
+        _api_transcribe_slots.release()
+
+
+def _api_route(path: str) -> str:
+    """Route name for /api/<route> or /<route> on api's own URL."""
+    return path[len("/api/") :] if path.startswith("/api/") else path.lstrip("/")
+
+
+def _route_api(req: https_fn.Request, path: str) -> https_fn.Response:
+    route = _api_route(path)
+    handler = API_ROUTES.get(route)
+    if handler is not None:
+        # Handlers answer their own CORS preflight.
+        return _serve(route, handler, req)
+
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204, headers=_cors_headers())
+    return _serve("api", lambda r: _handle_corti(r, path), req)
+
+
+# Optional instance warm-up (WARMUP_ON_START=1). In the serving process, a
+# background thread opens the Firestore channel, loads the booking time zone,
+# prefetches the ID-token certificates and, for functions that call the model,
+# imports the OpenAI SDK, so the first request does not pay for them. The
+# functions framework imports this module in the gunicorn master and then
+# forks the worker; gRPC channels do not survive fork and a lock held at fork
+# time never gets released, so the thread starts in the forked worker (or on
+# the first request when nothing forks), never at import.
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "").strip().lower() in ("1", "true", "yes")
+WARMUP_OPENAI_FUNCTIONS = {
+    "api",
+    "openai_completion",
+    "summarize_journal",
+    "suggest_next_appointment",
+    "agent_chat",
+}
+
+
+_warm_up_started = False
+
+
+def _start_warm_up() -> None:
+    global _warm_up_started
+    with _instance_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+
+def _warm_up() -> Dict[str, float]:
+    """Initialise shared clients; returns per-step milliseconds."""
+    timings: Dict[str, float] = {}
+
+    def step(name: str, fn) -> None:
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            logger.warning("Warm-up step %s failed", name, exc_info=True)
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    step("zoneinfo", lambda: ZoneInfo(WORK_HOURS_TIMEZONE))
+    # A single document read opens the gRPC channel, not just the client.
+    step("firestore", lambda: get_db().document("_warmup/ping").get())
+    step("authCerts", lambda: _refresh_auth_certs(force=False))
+    if OPENAI_API_KEY and os.getenv("FUNCTION_TARGET", "api") in WARMUP_OPENAI_FUNCTIONS:
+        step("openai", get_openai_client)
+    _log_event("warm_up", **timings)
+    return timings
+
+
+# Match the framework's request threads to this function's concurrency, so
+# requests are neither queued behind too few threads nor given idle ones.
+if os.getenv("FUNCTION_TARGET") in _function_concurrency:
+    os.environ.setdefault("THREADS", str(_function_concurrency[os.environ["FUNCTION_TARGET"]]))
+
+_MODULE_LOAD_MS = (time.perf_counter() - _MODULE_LOAD_STARTED) * 1000
+
+# Not during deploy-time discovery, which imports this module too.
+_WARMUP_ENABLED = WARMUP_ON_START and bool(os.getenv("K_SERVICE") or os.getenv("FUNCTIONS_EMULATOR"))
+if _WARMUP_ENABLED:
+    os.register_at_fork(after_in_child=_start_warm_up)
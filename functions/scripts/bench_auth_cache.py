@@ -0,0 +1,178 @@
+"""Benchmark per-request ID-token verification: Admin SDK vs the shared token cache.
+
+Signs RS256 Firebase-style ID tokens with a throwaway key and serves the
+matching certificate from a local endpoint with a realistic Cache-Control
+header. No network access or real service account is needed, and the numbers isolate
+signature and claim verification::
+
+    python scripts/bench_auth_cache.py --requests 500
+"""
+
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROJECT_ID = "bench-project"
+KEY_ID = "bench-key"
+
+
+def _signing_material() -> tuple[str, str]:
+    """(private key PEM, self-signed certificate PEM)."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.system.gserviceaccount.com")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    return key_pem, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def _id_token(key_pem: str, uid: str) -> str:
+    from google.auth import crypt, jwt
+
+    now = int(time.time())
+    payload = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": PROJECT_ID,
+        "sub": uid,
+        "user_id": uid,
+        "auth_time": now,
+        "iat": now,
+        "exp": now + 3600,
+    }
+    signer = crypt.RSASigner.from_string(key_pem, key_id=KEY_ID)
+    return jwt.encode(signer, payload).decode()
+
+
+def _start_cert_server(cert_pem: str) -> tuple[ThreadingHTTPServer, dict]:
+    stats = {"fetches": 0}
+    body = json.dumps({KEY_ID: cert_pem}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):  # noqa: A002 - signature from BaseHTTPRequestHandler
+            return
+
+        def do_GET(self):  # noqa: N802 - http.server naming
+            stats["fetches"] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Cache-Control", "public, max-age=20000, must-revalidate, no-transform")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def _report(label: str, samples: list[float]) -> None:
+    ordered = sorted(samples)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(
+        f"{label:<34} mean={statistics.mean(samples) * 1000:8.1f}us "
+        f"p50={statistics.median(samples) * 1000:8.1f}us p95={p95 * 1000:8.1f}us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--sessions", type=int, default=20, help="Distinct tokens cycled through.")
+    args = parser.parse_args()
+
+    os.environ.pop("FIREBASE_AUTH_EMULATOR_HOST", None)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+
+    import firebase_admin
+    from firebase_admin import auth, credentials
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    import main as functions_main
+
+    key_pem, cert_pem = _signing_material()
+    # A local service-account credential; nothing here calls Google APIs.
+    credential = credentials.Certificate(
+        {
+            "type": "service_account",
+            "project_id": PROJECT_ID,
+            "private_key": key_pem,
+            "client_email": f"bench@{PROJECT_ID}.iam.gserviceaccount.com",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }
+    )
+    app = firebase_admin.initialize_app(credential, options={"projectId": PROJECT_ID})
+    server, cert_stats = _start_cert_server(cert_pem)
+    verifier = auth._get_client(app)._token_verifier
+    verifier.id_token_verifier.cert_url = f"http://127.0.0.1:{server.server_port}/certs"
+
+    requests = [
+        EnvironBuilder(
+            method="POST", headers={"Authorization": f"Bearer {_id_token(key_pem, f'user-{i}')}"}
+        ).get_request(Request)
+        for i in range(args.sessions)
+    ]
+
+    def run(clear_cache: bool) -> list[float]:
+        samples = []
+        for i in range(args.requests):
+            if clear_cache:
+                functions_main._id_token_cache = functions_main._TTLCache(
+                    functions_main.AUTH_TOKEN_CACHE_MAX_ENTRIES, 3600.0
+                )
+            started = time.perf_counter()
+            uid, error = functions_main._authenticate(requests[i % len(requests)])
+            samples.append((time.perf_counter() - started) * 1000)
+            assert error is None and uid, error
+        return samples
+
+    # First call pays the certificate fetch, as a cold instance would.
+    started = time.perf_counter()
+    functions_main._authenticate(requests[0])
+    print(f"cold first request (cert fetch)     {(time.perf_counter() - started) * 1000:8.1f}ms")
+
+    uncached = run(clear_cache=True)
+    cached = run(clear_cache=False)
+    _report("verify_id_token every request", uncached)
+    _report("shared token cache", cached)
+    saved = statistics.mean(uncached) - statistics.mean(cached)
+    print(
+        f"\nsaved per request: {saved * 1000:.0f}us "
+        f"({statistics.mean(uncached) / max(statistics.mean(cached), 1e-9):.0f}x)  "
+        f"cert fetches: {cert_stats['fetches']}  cache: {functions_main._id_token_cache.stats()}"
+    )
+
+    bad = EnvironBuilder(method="POST", headers={"Authorization": "Bearer not-a-token"}).get_request(Request)
+    _, error = functions_main._authenticate(bad)
+    print(f"invalid token -> {error.status_code} {error.get_data(as_text=True)}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
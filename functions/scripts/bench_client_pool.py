@@ -0,0 +1,104 @@
+"""Benchmark per-request upstream overhead: fresh clients vs the shared pools.
+
+Runs against the local mock server, so the numbers isolate client construction
+and connection setup from model latency::
+
+    python scripts/bench_client_pool.py --requests 200
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_openai import start_mock_server  # noqa: E402
+
+
+def _timed(fn, count: int) -> list[float]:
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def _report(label: str, samples: list[float]) -> None:
+    ordered = sorted(samples)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(
+        f"{label:<32} mean={statistics.mean(samples):7.2f}ms "
+        f"p50={statistics.median(samples):7.2f}ms p95={p95:7.2f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = start_mock_server()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_TRANSCRIBE_URL"] = f"{base_url}/audio/transcriptions"
+
+    import requests
+    from openai import OpenAI
+
+    import main as functions_main
+
+    for noisy in ("httpx", "httpx2", "openai", "urllib3"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    messages = [{"role": "user", "content": "ping"}]
+    audio = b"\0" * 32_000
+
+    def chat_fresh():
+        OpenAI(api_key=functions_main.OPENAI_API_KEY).chat.completions.create(
+            model="gpt-4o-mini", messages=messages
+        )
+
+    def chat_pooled():
+        functions_main.get_openai_client().chat.completions.create(
+            model="gpt-4o-mini", messages=messages
+        )
+
+    def transcribe_fresh():
+        requests.post(
+            functions_main.OPENAI_TRANSCRIBE_URL,
+            data={"model": "gpt-4o-mini-transcribe"},
+            files={"file": ("audio.webm", audio, "audio/webm")},
+            timeout=10,
+        )
+
+    def transcribe_pooled():
+        functions_main.get_http_session().post(
+            functions_main.OPENAI_TRANSCRIBE_URL,
+            data={"model": "gpt-4o-mini-transcribe"},
+            files={"file": ("audio.webm", audio, "audio/webm")},
+            timeout=10,
+        )
+
+    for label, fn in (
+        ("chat: new client per request", chat_fresh),
+        ("chat: shared client", chat_pooled),
+        ("transcribe: requests.post", transcribe_fresh),
+        ("transcribe: shared session", transcribe_pooled),
+    ):
+        fn()  # warm-up (imports, first connection)
+        before = dict(server.RequestHandlerClass.stats)
+        samples = _timed(fn, args.requests)
+        opened = server.RequestHandlerClass.stats["connections"] - before["connections"]
+        _report(label, samples)
+        print(f"{'':<32} connections opened={opened}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
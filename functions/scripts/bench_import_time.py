@@ -0,0 +1,130 @@
+"""Measure how long importing main takes, and fail when it exceeds the budget.
+
+Each run imports the module in a fresh interpreter under ``-X importtime``, as
+a new instance would. The same is done for the framework modules main cannot
+avoid (the function decorators and the Admin SDK clients), the floor every
+function pays. The script reports the median of both, the extra milliseconds main adds on top, and the heaviest modules
+main pulls in. It also lists any module from the budget's ``forbiddenModules``
+that got imported. Those should only load on the request paths that need them.
+Runs with ``K_SERVICE`` set, like a deployed instance::
+
+    python scripts/bench_import_time.py --runs 7
+    python scripts/bench_import_time.py --budget scripts/import_time_budget.json
+
+Exits 1 when the extra time or the forbidden modules break the budget.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET = os.path.join(FUNCTIONS_DIR, "scripts", "import_time_budget.json")
+
+FLOOR_MODULES = (
+    "firebase_functions.https_fn",
+    "firebase_functions.firestore_fn",
+    "firebase_admin.auth",
+    "firebase_admin.firestore",
+)
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def _import(modules: tuple[str, ...], forbidden: list[str]) -> tuple[int, dict[str, int], list[str]]:
+    """Import ``modules`` in a fresh interpreter.
+
+    Returns their total cumulative microseconds, the cumulative microseconds of
+    each module they import directly, and the forbidden modules that were loaded.
+    """
+    env = dict(os.environ)
+    env.setdefault("K_SERVICE", "bench-import-time")
+    env.setdefault("OPENAI_API_KEY", "sk-bench")
+    env.pop("WARMUP_ON_START", None)
+    code = (
+        f"import sys, json; import {', '.join(modules)}; "
+        f"print(json.dumps([m for m in {forbidden!r} if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=FUNCTIONS_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Children are printed before their parent, one level deeper. A module
+    # already loaded by an earlier one in the list is not reported again.
+    total = 0
+    children: dict[str, int] = {}
+    pending: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        depth, name, micros = len(match.group(3)), match.group(4), int(match.group(2))
+        if depth == 3:
+            pending[name] = micros
+        elif depth == 1:
+            if name in modules:
+                total += micros
+                children.update(pending)
+            pending = {}
+    return total, children, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", default=DEFAULT_BUDGET)
+    parser.add_argument("--top", type=int, default=10, help="Heaviest imports to list.")
+    args = parser.parse_args()
+
+    with open(args.budget, encoding="utf-8") as fh:
+        budget = json.load(fh)
+    forbidden = list(budget.get("forbiddenModules") or [])
+
+    floor_ms, main_ms, loaded = [], [], set()
+    heaviest: dict[str, list[int]] = {}
+    for _ in range(args.runs):
+        floor, _, _ = _import(FLOOR_MODULES, [])
+        floor_ms.append(floor / 1000)
+        total, imports, found = _import(("main",), forbidden)
+        main_ms.append(total / 1000)
+        loaded.update(found)
+        for name, micros in imports.items():
+            heaviest.setdefault(name, []).append(micros)
+
+    floor = statistics.median(floor_ms)
+    total = statistics.median(main_ms)
+    extra = total - floor
+    print(f"{args.runs} runs, median of each")
+    print(f"  framework floor          {floor:8.0f}ms")
+    print(f"  import main              {total:8.0f}ms")
+    print(f"  extra over the floor     {extra:8.0f}ms (budget {budget.get('maxExtraMs')}ms)")
+
+    print("\nheaviest imports under main:")
+    nested = sorted(
+        ((statistics.median(micros) / 1000, name) for name, micros in heaviest.items()),
+        reverse=True,
+    )
+    for ms, name in nested[: args.top]:
+        print(f"  {name:<40} {ms:8.1f}ms")
+
+    failed = False
+    if loaded:
+        print(f"\nforbidden modules imported: {', '.join(sorted(loaded))}")
+        failed = True
+    max_extra = budget.get("maxExtraMs")
+    if max_extra is not None and extra > float(max_extra):
+        print(f"\nimport main is {extra - float(max_extra):.0f}ms over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
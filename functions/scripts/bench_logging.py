@@ -0,0 +1,147 @@
+"""Per-request cost of the hot-path log lines, before and after _log_event.
+
+Replays the logging one request does on three paths: a public booking
+response, publicGetAvailability, and openai_completion with a --prompt-chars
+prompt and reply. The old lines (plain formatted messages, plus the print of
+the model output) and the new structured events go through a stream handler
+writing to /dev/null, like the console handler of a deployed function. Each
+path is timed at the default sample rates and with sampling off (rate 1). It
+reports microseconds and bytes of log output per request::
+
+    python scripts/bench_logging.py --rounds 20000 --prompt-chars 4000
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _CountingDevNull(io.TextIOBase):
+    def __init__(self):
+        self.chars = 0
+        self._sink = open(os.devnull, "w", encoding="utf-8")
+
+    def write(self, text: str) -> int:
+        self.chars += len(text)
+        return self._sink.write(text)
+
+
+def _old_public_response(logger, req) -> None:
+    logger.info(
+        "public booking response: method=%s origin=%s status=%s",
+        req.method,
+        req.headers.get("Origin"),
+        200,
+    )
+
+
+def _old_availability(logger, fields: dict) -> None:
+    logger.info(
+        "publicGetAvailability params: %s",
+        {key: fields[key] for key in ("clinicSlug", "staffUid", "dateIso", "serviceId")},
+    )
+    logger.info(
+        "publicGetAvailability workHours clinicSlug=%s staffUid=%s dateIso=%s serviceId=%s resolvedStaffUid=%s weekday=%s workStart=%s workEnd=%s slotsBefore=%s slotsAfter=%s",
+        *fields.values(),
+    )
+
+
+def _old_completion(logger, prompt: str, output: str) -> None:
+    logger.info("Incoming OpenAI completion request: method=%s", "POST")
+    logger.info("Received userprompt: %s", prompt)
+    logger.info("OpenAI completion output: %s", output)
+    print(f"OpenAI completion output: {output}")
+
+
+def _time(fn, rounds: int, sink: _CountingDevNull) -> tuple[float, float]:
+    sink.chars = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = time.perf_counter() - started
+    return elapsed / rounds * 1e6, sink.chars / rounds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20000)
+    parser.add_argument("--prompt-chars", type=int, default=4000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    import main as functions_main
+
+    sink = _CountingDevNull()
+    logger = functions_main.logger
+    logging.getLogger().handlers.clear()
+    logger.handlers = [logging.StreamHandler(sink)]
+    logger.handlers[0].setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    req = EnvironBuilder(headers={"Origin": "https://klinik.lovable.app"}).get_request(Request)
+    availability = {
+        "clinicSlug": "klinik-nord",
+        "staffUid": "hT3kq9ZxV2bW8mLrP0sYc4",
+        "dateIso": "2026-10-21",
+        "serviceId": "svc001-9f2c4e",
+        "resolvedStaffUid": "hT3kq9ZxV2bW8mLrP0sYc4",
+        "weekday": "wednesday",
+        "workStart": "08:00",
+        "workEnd": "16:00",
+        "slotsBefore": 32,
+        "slotsAfter": 21,
+    }
+    prompt = ("Patienten har haft smerter i lænden siden træning i sidste uge. " * 100)[: args.prompt_chars]
+    output = ("Anbefaling: rolig genoptræning, øvelser to gange dagligt og opfølgning. " * 100)[
+        : args.prompt_chars
+    ]
+
+    def new_availability():
+        functions_main._log_event("availability", **availability)
+
+    def new_completion():
+        functions_main._log_event("completion", prompt=prompt, promptTokens=900, output=output)
+
+    paths = {
+        "public response": (
+            lambda: _old_public_response(logger, req),
+            lambda: functions_main._public_booking_log(req, 200),
+        ),
+        "availability": (lambda: _old_availability(logger, availability), new_availability),
+        "completion": (lambda: _old_completion(logger, prompt, output), new_completion),
+    }
+
+    defaults = dict(functions_main.LOG_SAMPLE_RATES)
+    print(f"sample rates: {defaults or 'none'}; prompt and output {args.prompt_chars} chars\n")
+    print(f"{'path':<17} {'old us':>8} {'old B':>8} {'sampled us':>11} {'B':>6} {'rate 1 us':>10} {'B':>6}")
+    with contextlib.redirect_stdout(sink):
+        rows = []
+        for label, (old, new) in paths.items():
+            old_us, old_b = _time(old, args.rounds, sink)
+            functions_main.LOG_SAMPLE_RATES.clear()
+            functions_main.LOG_SAMPLE_RATES.update(defaults)
+            sampled_us, sampled_b = _time(new, args.rounds, sink)
+            functions_main.LOG_SAMPLE_RATES.clear()
+            full_us, full_b = _time(new, args.rounds, sink)
+            rows.append((label, old_us, old_b, sampled_us, sampled_b, full_us, full_b))
+        functions_main.LOG_SAMPLE_RATES.update(defaults)
+    for label, old_us, old_b, sampled_us, sampled_b, full_us, full_b in rows:
+        print(
+            f"{label:<17} {old_us:>8.2f} {old_b:>8.0f} {sampled_us:>11.2f} {sampled_b:>6.0f} "
+            f"{full_us:>10.2f} {full_b:>6.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Check which suggest_next_appointment inputs the keyword rules answer, and how.
+
+Each case is a diagnosis and journal summary with the rule expected to answer
+it, or None when the request must go to the model. Red flags and worsening
+always go to the model, negated or not::
+
+    python scripts/check_interval_rules.py
+
+Exits 1 if any case is answered differently.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# (diagnosis, journal summary, session count, expected rule, expected days)
+CASES = [
+    ("Subakutte lændesmerter", "", 1, "subacute", 5),
+    ("subacute low back pain", "", 1, "subacute", 5),
+    ("Sub-acute neck pain", "", 6, "subacute", 7),
+    ("Akutte lændesmerter", "", 1, "acute", 2),
+    ("Acute ankle sprain", "", 1, "acute", 2),
+    ("Postoperativ genoptræning, knæ", "", 1, "acute", 2),
+    ("Genoptræning, knæ", "", 1, None, None),
+    ("Kroniske nakkesmerter", "", 6, "chronic", 21),
+    ("Kroniske nakkesmerter", "Ingen røde flag.", 2, None, None),
+    ("Akutte lændesmerter", "Ingen forværring siden sidst.", 1, None, None),
+    ("Lændesmerter", "Røde flag: nattesmerter og feber.", 1, None, None),
+    ("Skuldersmerter", "", 1, None, None),
+]
+
+
+def main() -> int:
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["SUGGEST_RULES_ENABLED"] = "true"
+
+    import main as functions_main
+
+    failures = 0
+    for diagnosis, summary, sessions, rule, days in CASES:
+        result = functions_main._rule_based_interval(diagnosis, sessions, summary)
+        got = (result["rule"], result["intervalDays"]) if result else (None, None)
+        ok = got == (rule, days)
+        failures += not ok
+        label = f"{diagnosis!r} / {summary!r}"
+        print(f"{'PASS' if ok else 'FAIL'}  {label:<62} -> {got[0] or 'model'} {got[1] or ''}")
+    if failures:
+        print(f"\n{failures} case(s) failed")
+        return 1
+    print("\nAll cases passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""Check the public endpoints' rate limits against bursts from one or many clients.
+
+Runs the handlers in-process with small limits from RATE_LIMITS and checks
+several behaviours. Bursts past the per-IP and per-clinic buckets get a 429
+with Retry-After, which browsers can read. Other clients and clinics are
+still admitted, and buckets refill after the advertised wait. Each endpoint
+has its own limits. The client IP is read from X-Forwarded-For as
+configured, and IPv6 clients share a /64::
+
+    python scripts/check_rate_limits.py
+
+Admitted requests stop at request validation, so no Firestore is needed. With
+--emulators the shared Firestore budget is checked too, against the Firestore
+emulator (``firebase emulators:start --only firestore``). Exits 1 if any
+scenario does not behave as expected.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LIMITS = {
+    "publicGetAvailability": {
+        "ip": {"perSecond": 2, "burst": 5},
+        "clinic": {"perSecond": 100, "burst": 100},
+    },
+    "publicBookAppointment": {
+        "ip": {"perSecond": 100, "burst": 100},
+        "clinic": {"perSecond": 1, "burst": 3},
+    },
+    "createClientFromBooking": {"ip": {"perSecond": 1, "burst": 2}, "clinic": None},
+    "publicGetServices": None,
+}
+SHARED_LIMITS = {
+    "getClinicStaffPublic": {
+        "ip": None,
+        "clinic": {"perSecond": 100, "burst": 100, "sharedPerMinute": 5},
+    },
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emulators", action="store_true", help="Also check the shared Firestore budget.")
+    parser.add_argument("--firestore-host", default=os.getenv("FIRESTORE_EMULATOR_HOST", "127.0.0.1:7701"))
+    parser.add_argument("--project", default=os.getenv("GCLOUD_PROJECT", "actualbackend-3b454"))
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["RATE_LIMIT_ENABLED"] = "1"
+    os.environ["RATE_LIMIT_PROXY_HOPS"] = "1"
+    os.environ["RATE_LIMIT_SHARED_SYNC_SECONDS"] = "0"
+    os.environ["RATE_LIMITS"] = json.dumps({**LIMITS, **SHARED_LIMITS})
+    if args.emulators:
+        os.environ["FIRESTORE_EMULATOR_HOST"] = args.firestore_host
+        os.environ["GCLOUD_PROJECT"] = args.project
+
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    import main as functions_main
+
+    logging.getLogger("main").setLevel(logging.ERROR)
+    failures = []
+
+    def check(label: str, ok: bool, detail: str) -> None:
+        print(f"{'PASS' if ok else 'FAIL'}  {label:<48} {detail}")
+        if not ok:
+            failures.append(label)
+
+    def call(name: str, ip: str, clinic: str = "rate-clinic", forwarded: str | None = None):
+        headers = {"X-Forwarded-For": forwarded or ip}
+        if name in ("publicGetAvailability", "getClinicStaffPublic"):
+            # Admitted availability requests stop at the missing-fields check.
+            kwargs = {"method": "GET", "query_string": {"clinicSlug": clinic}}
+        else:
+            kwargs = {"method": "POST", "json": {"clinicSlug": clinic}}
+        request = EnvironBuilder(headers=headers, **kwargs).get_request(Request)
+        response = getattr(functions_main, name)(request)
+        return response.status_code, response.headers.get("Retry-After")
+
+    def burst(name: str, count: int, **kwargs) -> list[int]:
+        return [call(name, **kwargs)[0] for _ in range(count)]
+
+    statuses = burst("publicGetAvailability", 5, ip="203.0.113.10")
+    status, retry_after = call("publicGetAvailability", ip="203.0.113.10")
+    check(
+        "per-IP burst, then 429 with Retry-After",
+        429 not in statuses and status == 429 and retry_after == "1",
+        f"burst={statuses} next={status} Retry-After={retry_after}",
+    )
+
+    status, _ = call("publicGetAvailability", ip="203.0.113.11")
+    check("another IP is still admitted", status != 429, f"status={status}")
+
+    status, _ = call("createClientFromBooking", ip="203.0.113.10")
+    check("limits are per endpoint", status != 429, f"createClientFromBooking status={status}")
+
+    time.sleep(float(retry_after or 1))
+    status, _ = call("publicGetAvailability", ip="203.0.113.10")
+    check("bucket refills after Retry-After", status != 429, f"status={status}")
+
+    statuses = [call("publicBookAppointment", ip=f"198.51.100.{i}")[0] for i in range(4)]
+    check(
+        "per-clinic budget across many IPs",
+        statuses[:3].count(429) == 0 and statuses[3] == 429,
+        f"statuses={statuses}",
+    )
+    status, _ = call("publicBookAppointment", ip="198.51.100.9", clinic="other-clinic")
+    check("another clinic is still admitted", status != 429, f"status={status}")
+
+    statuses = burst("createClientFromBooking", 3, ip="192.0.2.1", clinic="")
+    check(
+        "createClientFromBooking answers 429 too",
+        statuses[-1] == 429,
+        f"statuses={statuses}",
+    )
+
+    burst("publicGetAvailability", 5, ip="203.0.113.40")
+    exposed = {}
+    for name, ip in (("publicGetAvailability", "203.0.113.40"), ("createClientFromBooking", "192.0.2.1")):
+        request = EnvironBuilder(
+            method="POST",
+            json={"clinicSlug": ""},
+            headers={"X-Forwarded-For": ip, "Origin": "https://klinik.lovable.app"},
+        ).get_request(Request)
+        response = getattr(functions_main, name)(request)
+        exposed[name] = (response.status_code, response.headers.get("Access-Control-Expose-Headers"))
+    check(
+        "browsers can read Retry-After",
+        all(status == 429 and "Retry-After" in (header or "") for status, header in exposed.values()),
+        f"{exposed}",
+    )
+
+    spoofed = [call("publicGetAvailability", ip="", forwarded=f"10.0.0.{i}, 203.0.113.20")[0] for i in range(6)]
+    check(
+        "spoofed X-Forwarded-For entries are ignored",
+        spoofed[-1] == 429,
+        f"statuses={spoofed}",
+    )
+
+    statuses = [call("publicGetAvailability", ip=f"2001:db8:1:2::{i:x}")[0] for i in range(1, 7)]
+    check("IPv6 clients share a /64", statuses[-1] == 429, f"statuses={statuses}")
+
+    request = EnvironBuilder(method="GET", query_string={"clinicSlug": "x"}).get_request(Request)
+    waits = [functions_main._rate_limit_retry_after(request, "publicGetServices", "x") for _ in range(50)]
+    check("a null endpoint limit turns it off", not any(waits), f"max wait={max(waits)}")
+
+    if args.emulators:
+        functions_main._rate_buckets.clear()
+        statuses = []
+        for _ in range(10):
+            statuses.append(call("getClinicStaffPublic", ip="203.0.113.30", clinic="shared-clinic")[0])
+            # Let the background sync land before the next request.
+            functions_main.get_io_executor().submit(lambda: None).result()
+            time.sleep(0.2)
+        status, retry_after = call("getClinicStaffPublic", ip="203.0.113.31", clinic="shared-clinic")
+        check(
+            "shared budget refuses for the rest of the minute",
+            status == 429 and retry_after is not None and 1 <= int(retry_after) <= 60,
+            f"statuses={statuses} next={status} Retry-After={retry_after}",
+        )
+    else:
+        print("skip  shared Firestore budget (run with --emulators)")
+
+    if failures:
+        print(f"\n{len(failures)} scenario(s) failed")
+        return 1
+    print("\nAll scenarios passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
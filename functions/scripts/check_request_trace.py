@@ -0,0 +1,118 @@
+"""Check the Firestore reads and writes that request tracing counts.
+
+Runs one request through _serve against the Firestore emulator
+(``firebase emulators:start --only firestore``). The handler makes a fixed
+set of calls. A batch get of one existing and one missing document is two
+reads. A query matching three documents is three reads, and an empty query
+is billed one read. A batch of two sets is two writes::
+
+    python scripts/check_request_trace.py --firestore-host 127.0.0.1:7701
+
+The counts depend on private parts of google-cloud-firestore (see
+_trace_firestore_client), so run this after upgrading it. It checks the
+request_trace event and the Server-Timing header, and exits 1 if either is
+off.
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EXPECTED_READS = 6
+EXPECTED_WRITES = 2
+EXPECTED_SPANS = {"firestore.get": 1, "firestore.query": 2, "firestore.commit": 1}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--firestore-host", default=os.getenv("FIRESTORE_EMULATOR_HOST", "127.0.0.1:7701"))
+    parser.add_argument("--project", default=os.getenv("GCLOUD_PROJECT", "actualbackend-3b454"))
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["FIRESTORE_EMULATOR_HOST"] = args.firestore_host
+    os.environ["GCLOUD_PROJECT"] = args.project
+    os.environ["REQUEST_TRACING"] = "1"
+    os.environ["SERVER_TIMING_HEADER"] = "1"
+
+    from firebase_functions import https_fn
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    import main as functions_main
+
+    db = functions_main.get_db()
+    docs = db.collection("traceChecks").document(uuid.uuid4().hex).collection("docs")
+    for n in (1, 2, 3):
+        docs.document(f"seed{n}").set({"n": n})
+
+    def handler(req):
+        list(db.get_all([docs.document("seed1"), docs.document("missing")]))
+        list(docs.where("n", ">=", 1).stream())
+        list(docs.where("n", ">", 100).stream())
+        batch = db.batch()
+        batch.set(docs.document("write1"), {"written": True})
+        batch.set(docs.document("write2"), {"written": True})
+        batch.commit()
+        return https_fn.Response("ok")
+
+    events = []
+    log_event = functions_main._log_event
+
+    def capture(event, level=logging.INFO, **fields):
+        if event == "request_trace":
+            events.append(fields)
+        log_event(event, level, **fields)
+
+    functions_main._log_event = capture
+    try:
+        request = EnvironBuilder(method="GET").get_request(Request)
+        response = functions_main._serve("trace_check", handler, request)
+    finally:
+        functions_main._log_event = log_event
+
+    failures = []
+
+    def check(label: str, ok: bool, detail: str) -> None:
+        print(f"{'PASS' if ok else 'FAIL'}  {label:<36} {detail}")
+        if not ok:
+            failures.append(label)
+
+    trace = events[0] if events else {}
+    check(
+        "request_trace reads and writes",
+        (trace.get("reads"), trace.get("writes")) == (EXPECTED_READS, EXPECTED_WRITES),
+        f"reads={trace.get('reads')} writes={trace.get('writes')} "
+        f"(expected {EXPECTED_READS}/{EXPECTED_WRITES})",
+    )
+    spans = {name: span["n"] for name, span in (trace.get("spans") or {}).items() if name in EXPECTED_SPANS}
+    check("request_trace Firestore spans", spans == EXPECTED_SPANS, f"spans={spans}")
+
+    header = response.headers.get("Server-Timing") or ""
+    match = re.search(r'firestore;desc="reads=(\d+) writes=(\d+)"', header)
+    counts = tuple(int(value) for value in match.groups()) if match else None
+    check(
+        "Server-Timing reads and writes",
+        counts == (EXPECTED_READS, EXPECTED_WRITES),
+        f"firestore={counts}",
+    )
+    check(
+        "Server-Timing Firestore spans",
+        all(f"{name};dur=" in header for name in EXPECTED_SPANS),
+        header[:120],
+    )
+
+    if failures:
+        print(f"\n{len(failures)} check(s) failed")
+        return 1
+    print("\nAll checks passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Exercise the upstream retry/deadline/circuit-breaker layer against injected faults.
+
+Starts the mock OpenAI server in-process, injects 429/5xx responses and stalls,
+and checks how ``_chat_completion`` and ``transcribe_audio`` behave::
+
+    python scripts/check_resilience.py
+
+Exits non-zero if any scenario does not behave as expected.
+"""
+
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_openai import configure_faults, start_mock_server  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+def main() -> int:
+    server = start_mock_server()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_TRANSCRIBE_URL"] = f"{base_url}/audio/transcriptions"
+    os.environ.setdefault("UPSTREAM_MAX_ATTEMPTS", "3")
+    os.environ.setdefault("UPSTREAM_BACKOFF_BASE_SECONDS", "0.05")
+    os.environ.setdefault("UPSTREAM_DEADLINE_SECONDS", "1.5")
+    os.environ.setdefault("CIRCUIT_FAILURE_THRESHOLD", "3")
+    os.environ.setdefault("CIRCUIT_RESET_SECONDS", "1")
+
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    import main as functions_main
+
+    for noisy in ("httpx", "httpx2", "openai", "urllib3"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+    logging.getLogger("main").setLevel(logging.ERROR)
+
+    handler = server.RequestHandlerClass
+    failures = []
+
+    def check(label: str, ok: bool, detail: str) -> None:
+        print(f"{'PASS' if ok else 'FAIL'}  {label:<44} {detail}")
+        if not ok:
+            failures.append(label)
+
+    def reset(**faults) -> None:
+        configure_faults(server, **faults)
+        functions_main.openai_chat_breaker.record_success()
+        functions_main.openai_transcribe_breaker.record_success()
+
+    def chat() -> tuple[str, float]:
+        started = time.perf_counter()
+        try:
+            functions_main._chat_completion("check", None, model="gpt-4o-mini", messages=MESSAGES)
+            outcome = "ok"
+        except functions_main._UpstreamUnavailable as exc:
+            outcome = f"unavailable ({exc})"
+        return outcome, time.perf_counter() - started
+
+    def transcribe():
+        # Random audio so the transcript cache never answers instead of upstream.
+        request = EnvironBuilder(
+            method="POST", data={"file": (io.BytesIO(os.urandom(4096)), "clip.wav")}
+        ).get_request(Request)
+        return functions_main.transcribe_audio(request)
+
+    reset(fail_first=2, fail_status=429, retry_after=0.2)
+    outcome, elapsed = chat()
+    check(
+        "429 x2 with Retry-After then success",
+        outcome == "ok" and handler.stats["requests"] == 3 and elapsed >= 0.4,
+        f"outcome={outcome} requests={handler.stats['requests']} elapsed={elapsed:.2f}s",
+    )
+
+    reset(fail_rate=1.0, fail_status=503)
+    outcome, elapsed = chat()
+    check(
+        "persistent 503 exhausts retries",
+        outcome.startswith("unavailable") and handler.stats["requests"] == 3,
+        f"outcome={outcome} requests={handler.stats['requests']}",
+    )
+    outcome, elapsed = chat()
+    check(
+        "open circuit fails fast without upstream call",
+        outcome.startswith("unavailable") and handler.stats["requests"] == 3 and elapsed < 0.05,
+        f"requests={handler.stats['requests']} elapsed={elapsed * 1000:.1f}ms",
+    )
+
+    configure_faults(server)
+    time.sleep(float(os.environ["CIRCUIT_RESET_SECONDS"]) + 0.1)
+    outcome, _ = chat()
+    outcome_after, _ = chat()
+    check(
+        "half-open probe closes circuit",
+        outcome == "ok" and outcome_after == "ok",
+        f"probe={outcome} next={outcome_after}",
+    )
+
+    reset(fail_rate=1.0, fail_status=503)
+    chat()
+    configure_faults(server)
+    time.sleep(float(os.environ["CIRCUIT_RESET_SECONDS"]) + 0.1)
+    try:
+        functions_main._call_upstream(
+            functions_main.openai_chat_breaker, lambda timeout: None, deadline_seconds=1e-9
+        )
+    except functions_main._UpstreamUnavailable:
+        pass
+    outcome, _ = chat()
+    check("spent deadline does not hold the probe", outcome == "ok", f"next={outcome}")
+
+    reset(hang_seconds=5.0)
+    outcome, elapsed = chat()
+    check(
+        "stalled upstream bounded by deadline",
+        outcome.startswith("unavailable") and elapsed < 2.5,
+        f"outcome={outcome} elapsed={elapsed:.2f}s",
+    )
+
+    reset(fail_first=1, fail_status=502)
+    response = transcribe()
+    check(
+        "transcribe retries 502 and re-uploads",
+        response.status_code == 200 and handler.stats["requests"] == 2,
+        f"status={response.status_code} body={response.get_data(as_text=True)[:60]}",
+    )
+
+    reset(fail_rate=1.0, fail_status=503)
+    response = transcribe()
+    check(
+        "transcribe proxies upstream 503 after retries",
+        response.status_code == 503 and handler.stats["requests"] == 3,
+        f"status={response.status_code} requests={handler.stats['requests']}",
+    )
+    response = transcribe()
+    check(
+        "transcribe open circuit returns 503 + Retry-After",
+        response.status_code == 503
+        and handler.stats["requests"] == 3
+        and bool(response.headers.get("Retry-After")),
+        f"status={response.status_code} retryAfter={response.headers.get('Retry-After')}",
+    )
+
+    server.shutdown()
+    print(f"\n{len(failures)} failing scenario(s)" if failures else "\nAll scenarios passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
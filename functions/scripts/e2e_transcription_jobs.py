@@ -0,0 +1,147 @@
+"""End-to-end check of the asynchronous transcription job API on the emulators.
+
+Start the mock transcription server and point the functions at it, e.g. in
+``functions/.env.local``::
+
+    OPENAI_API_KEY=sk-mock
+    OPENAI_TRANSCRIBE_URL=http://127.0.0.1:8765/v1/audio/transcriptions
+
+then run ``firebase emulators:start --only auth,functions,firestore,storage``
+and::
+
+    python scripts/e2e_transcription_jobs.py --audio ../test.wav
+
+The mock server is started in-process on --mock-port unless --no-mock is
+given. The script checks that the CORS preflight allows the polling GET, signs
+up an emulator user, submits the audio, polls the job until it finishes, and
+resubmits it to check the cached path. It exits non-zero if the job does not
+complete.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_openai import start_mock_server  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _default_project() -> str:
+    try:
+        with open(os.path.join(REPO_ROOT, ".firebaserc"), encoding="utf-8") as fh:
+            return json.load(fh)["projects"]["default"]
+    except (OSError, KeyError, ValueError):
+        return "demo-project"
+
+
+def _emulator_id_token(auth_host: str) -> str:
+    response = requests.post(
+        f"http://{auth_host}/identitytoolkit.googleapis.com/v1/accounts:signUp?key=emulator",
+        json={"returnSecureToken": True},
+        timeout=10,
+    )
+    response.raise_for_status()
+    return response.json()["idToken"]
+
+
+def _submit(url: str, token: str, audio_path: str) -> tuple[requests.Response, float]:
+    started = time.perf_counter()
+    with open(audio_path, "rb") as fh:
+        response = requests.post(
+            url,
+            headers={"Authorization": f"Bearer {token}"},
+            files={"file": (os.path.basename(audio_path), fh, "audio/wav")},
+            data={"language": "da"},
+            timeout=60,
+        )
+    return response, time.perf_counter() - started
+
+
+def _poll(url: str, token: str, job_id: str, timeout: float) -> tuple[dict, float]:
+    started = time.perf_counter()
+    while True:
+        response = requests.get(
+            url, headers={"Authorization": f"Bearer {token}"}, params={"jobId": job_id}, timeout=10
+        )
+        response.raise_for_status()
+        job = response.json()
+        if job.get("status") in ("done", "failed"):
+            return job, time.perf_counter() - started
+        if time.perf_counter() - started > timeout:
+            return job, time.perf_counter() - started
+        time.sleep(0.5)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--project", default=_default_project())
+    parser.add_argument("--region", default="us-central1")
+    parser.add_argument("--functions-host", default="127.0.0.1:5601")
+    parser.add_argument("--auth-host", default="127.0.0.1:9099")
+    parser.add_argument("--audio", default=os.path.join(REPO_ROOT, "test.wav"))
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for the job.")
+    parser.add_argument("--mock-port", type=int, default=8765)
+    parser.add_argument("--mock-latency", type=float, default=1.0)
+    parser.add_argument("--no-mock", action="store_true", help="Use an already running mock/upstream.")
+    args = parser.parse_args()
+
+    server = None
+    if not args.no_mock:
+        server = start_mock_server(port=args.mock_port, latency_seconds=args.mock_latency)
+        print(f"Mock transcription server on http://127.0.0.1:{server.server_port}/v1")
+
+    url = f"http://{args.functions_host}/{args.project}/{args.region}/transcribe_audio_job"
+    token = _emulator_id_token(args.auth_host)
+    failures = []
+
+    preflight = requests.options(
+        url,
+        headers={
+            "Origin": "http://localhost:3000",
+            "Access-Control-Request-Method": "GET",
+            "Access-Control-Request-Headers": "authorization",
+        },
+        timeout=10,
+    )
+    allowed = preflight.headers.get("Access-Control-Allow-Methods", "")
+    print(f"preflight status={preflight.status_code} allow-methods={allowed!r}")
+    if "GET" not in allowed:
+        failures.append("preflight does not allow GET")
+
+    response, submit_seconds = _submit(url, token, args.audio)
+    print(f"submit  status={response.status_code} time={submit_seconds * 1000:.0f}ms {response.text[:120]}")
+    if response.status_code not in (200, 202):
+        return 1
+    job_id = response.json()["jobId"]
+
+    job, wait_seconds = _poll(url, token, job_id, args.timeout)
+    print(f"job     status={job.get('status')} waited={wait_seconds:.1f}s text={str(job.get('text'))[:60]!r}")
+    if job.get("status") != "done":
+        failures.append("job did not complete")
+    if server is not None and server.RequestHandlerClass.stats["requests"] < 1:
+        failures.append("mock transcription server was not called")
+
+    response, resubmit_seconds = _submit(url, token, args.audio)
+    body = response.json() if response.ok else {}
+    print(
+        f"resubmit status={response.status_code} time={resubmit_seconds * 1000:.0f}ms "
+        f"jobStatus={body.get('status')} cached={body.get('cached', False)}"
+    )
+    if not response.ok:
+        failures.append("resubmit failed")
+
+    if server is not None:
+        server.shutdown()
+    print("\n" + ("; ".join(failures) if failures else "Job API end-to-end OK"))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Cold starts with one instance pool per function vs one routed `api` pool.
+
+Without --logs, simulates a week of low traffic over the HTTP endpoints. Each
+request takes a warm idle instance from its pool if one exists, and cold-starts
+a new one otherwise; instances are reclaimed after --idle-minutes. The same
+trace is replayed against per-function pools (today's deployment) and a single
+shared pool (everything through `api`)::
+
+    python scripts/measure_cold_starts.py --days 7 --scale 1.0
+
+With --logs, counts the ``cold_start`` lines written by ``_serve`` in a Cloud
+Logging export, to compare deployments before and after consolidation::
+
+    gcloud logging read 'textPayload:"cold_start"' --freshness=7d --format=json > cold.json
+    python scripts/measure_cold_starts.py --logs cold.json
+"""
+
+import argparse
+import json
+import random
+import re
+from collections import Counter
+
+# Requests per hour at current traffic, and typical handler seconds.
+TRAFFIC = {
+    "publicGetAvailability": (30.0, 0.4),
+    "getClinicServicesPublic": (6.0, 0.2),
+    "publicGetServices": (6.0, 0.2),
+    "getClinicStaffPublic": (6.0, 0.2),
+    "publicBookAppointment": (2.0, 0.6),
+    "createClientFromBooking": (2.0, 0.5),
+    "transcribe_audio": (4.0, 15.0),
+    "transcribe_audio_job": (1.0, 0.5),
+    "openai_completion": (3.0, 4.0),
+    "summarize_journal": (4.0, 3.0),
+    "suggest_next_appointment": (2.0, 2.0),
+    "agent_chat": (6.0, 6.0),
+}
+
+
+def _daily_profile(hour: int) -> float:
+    """Clinic-hours weighting: busy 8-17, some evening traffic, quiet nights."""
+    if 8 <= hour < 17:
+        return 1.6
+    if 17 <= hour < 22:
+        return 0.6
+    return 0.05
+
+
+def _trace(days: float, scale: float, seed: int) -> list[tuple[float, str, float]]:
+    rng = random.Random(seed)
+    events = []
+    for route, (per_hour, seconds) in TRAFFIC.items():
+        t = 0.0
+        end = days * 86400
+        while t < end:
+            rate = per_hour * scale * _daily_profile(int(t // 3600) % 24) / 3600
+            t += rng.expovariate(rate)
+            if t < end:
+                events.append((t, route, rng.expovariate(1 / seconds)))
+    events.sort()
+    return events
+
+
+def _simulate(events, pool_of, idle_seconds: float, max_instances: int, cold_seconds: float) -> Counter:
+    pools: dict[str, list[float]] = {}
+    cold = Counter()
+    for t, route, duration in events:
+        # Each instance is the time it becomes free; one request at a time.
+        instances = [free for free in pools.get(pool_of(route), []) if t - free < idle_seconds]
+        idle = [free for free in instances if free <= t]
+        if idle:
+            instances.remove(max(idle))
+            instances.append(t + duration)
+        elif len(instances) < max_instances:
+            cold[route] += 1
+            instances.append(t + cold_seconds + duration)
+        else:
+            # At the cap: queue behind the instance that frees up first.
+            first = min(instances)
+            instances.remove(first)
+            instances.append(first + duration)
+        pools[pool_of(route)] = instances
+    return cold
+
+
+def _from_logs(path: str) -> None:
+    with open(path, encoding="utf-8") as fh:
+        text = fh.read()
+    try:
+        entries = json.loads(text)
+        lines = [str(entry.get("textPayload") or entry.get("jsonPayload", {}).get("message") or "") for entry in entries]
+    except ValueError:
+        lines = text.splitlines()
+    by_function: Counter = Counter()
+    by_route: Counter = Counter()
+    load_ms = []
+    for line in lines:
+        match = re.search(r"cold_start (\{.*\})", line)
+        if not match:
+            continue
+        payload = json.loads(match.group(1))
+        by_function[payload.get("function")] += 1
+        by_route[payload.get("route")] += 1
+        load_ms.append(float(payload.get("moduleLoadMs") or 0))
+    print(f"{sum(by_function.values())} cold starts")
+    for label, counter in (("function", by_function), ("route", by_route)):
+        print(f"\nby {label}:")
+        for name, count in counter.most_common():
+            print(f"  {name:<28} {count:>6}")
+    if load_ms:
+        print(f"\nmean module load: {sum(load_ms) / len(load_ms):.0f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logs", help="Cloud Logging JSON export (or plain log lines) to count.")
+    parser.add_argument("--days", type=float, default=7.0)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the traffic rates.")
+    parser.add_argument("--idle-minutes", type=float, default=15.0)
+    parser.add_argument("--max-instances", type=int, default=10)
+    parser.add_argument("--cold-seconds", type=float, default=3.0, help="Added to a cold request.")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.logs:
+        _from_logs(args.logs)
+        return
+
+    events = _trace(args.days, args.scale, args.seed)
+    idle = args.idle_minutes * 60
+    separate = _simulate(events, lambda route: route, idle, args.max_instances, args.cold_seconds)
+    shared = _simulate(events, lambda route: "api", idle, args.max_instances, args.cold_seconds)
+    requests = Counter(route for _, route, _ in events)
+
+    print(f"{len(events)} requests over {args.days:g} days, idle timeout {args.idle_minutes:g} min")
+    print(f"{'route':<28} {'requests':>9} {'per-function':>13} {'api pool':>9}")
+    for route in TRAFFIC:
+        print(f"{route:<28} {requests[route]:>9} {separate[route]:>13} {shared[route]:>9}")
+    total_separate = sum(separate.values())
+    total_shared = sum(shared.values())
+    print(
+        f"{'total':<28} {len(events):>9} {total_separate:>13} {total_shared:>9}\n"
+        f"cold-start rate: {100 * total_separate / len(events):.1f}% -> "
+        f"{100 * total_shared / len(events):.1f}% of requests"
+    )
+
+
+if __name__ == "__main__":
+    main()
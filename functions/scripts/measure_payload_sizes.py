@@ -0,0 +1,135 @@
+"""Response sizes and encode times for the public booking payloads.
+
+Builds the bodies publicGetAvailability and getClinicServicesPublic return.
+Slots come from the same _compute_day_slots code, for a --hours working day
+with --slot-minutes steps. Services are a --services-long list of clinic
+services with Danish descriptions. Each body is encoded the old way
+(``json.dumps``) and with the codec layer. The response helper's output is
+then passed through the compression _serve applies, for clients sending
+``Accept-Encoding: gzip`` and ``gzip, br``::
+
+    python scripts/measure_payload_sizes.py --hours 10 --slot-minutes 15 --services 12
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SERVICE_NAMES = [
+    "Første konsultation",
+    "Opfølgende behandling",
+    "Sportsskade, akut",
+    "Genoptræning efter operation",
+    "Rygbehandling",
+    "Nakke og skulder",
+    "Hovedpine og svimmelhed",
+    "Holdtræning, pilates",
+    "Løbeanalyse",
+    "Graviditetsrelaterede gener",
+    "Ergonomisk arbejdspladsvurdering",
+    "Telefonkonsultation",
+]
+
+
+def _slots_payload(functions_main, hours: float, slot_minutes: int, service_minutes: int) -> dict:
+    tzinfo = functions_main.ZoneInfo(functions_main.WORK_HOURS_TIMEZONE)
+    target = date.today() + timedelta(days=1)
+    start = 8 * 60
+    window = {"startMinutes": start, "endMinutes": start + int(hours * 60)}
+    day = functions_main._compute_day_slots(window, target, service_minutes, slot_minutes, tzinfo, [])
+    return {
+        "slots": day["slots"],
+        "timezone": functions_main.WORK_HOURS_TIMEZONE,
+        "slotMinutes": slot_minutes,
+        "serviceMinutes": service_minutes,
+    }
+
+
+def _services_payload(count: int) -> dict:
+    services = []
+    for i in range(count):
+        name = SERVICE_NAMES[i % len(SERVICE_NAMES)]
+        price = 450 + 50 * (i % 6)
+        services.append(
+            {
+                "id": f"svc{i:03d}-{os.urandom(6).hex()}",
+                "name": name,
+                "description": (
+                    f"{name}: undersøgelse, behandling og øvelser til hjemmebrug. "
+                    "Medbring gerne tidligere journaler og en liste over nuværende medicin."
+                ),
+                "durationMinutes": 30 if i % 3 else 60,
+                "price": price,
+                "currency": "DKK",
+                "color": None,
+                "includeVat": i % 4 == 0,
+                "priceInclVat": price * 1.25 if i % 4 == 0 else price,
+            }
+        )
+    return {"services": services}
+
+
+def _encode_us(fn, payload, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn(payload)
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=10.0, help="Length of the working day.")
+    parser.add_argument("--slot-minutes", type=int, default=15)
+    parser.add_argument("--service-minutes", type=int, default=30)
+    parser.add_argument("--services", type=int, default=12)
+    parser.add_argument("--rounds", type=int, default=2000, help="Encodes per timing.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    import main as functions_main
+
+    logging.getLogger("main").setLevel(logging.WARNING)
+    print(
+        f"codec: {'orjson' if functions_main.orjson is not None else 'json'}, "
+        f"br: {'yes' if functions_main.brotli is not None else 'no (gzip only)'}, "
+        f"compress from {functions_main.RESPONSE_COMPRESS_MIN_BYTES} bytes\n"
+    )
+    print(f"{'payload':<12} {'json.dumps':>11} {'codec':>7} {'gzip':>7} {'br':>7} {'saved':>7} {'encode us':>18}")
+
+    payloads = {
+        "slots": _slots_payload(functions_main, args.hours, args.slot_minutes, args.service_minutes),
+        "services": _services_payload(args.services),
+    }
+    for label, payload in payloads.items():
+        before = len(json.dumps(payload).encode("utf-8"))
+        sizes = {}
+        for encoding in ("identity", "gzip", "gzip, br"):
+            request = EnvironBuilder(headers={"Accept-Encoding": encoding}).get_request(Request)
+            response = functions_main._public_booking_json_response(request, payload, status=200)
+            response = functions_main._compress_response(request, response)
+            sizes[encoding] = (len(response.get_data()), response.headers.get("Content-Encoding", "identity"))
+        best = min(size for size, _ in sizes.values())
+        old_us = _encode_us(json.dumps, payload, args.rounds)
+        new_us = _encode_us(functions_main._json_dumps, payload, args.rounds)
+        print(
+            f"{label:<12} {before:>11,} {sizes['identity'][0]:>7,} "
+            f"{sizes['gzip'][0]:>7,} {sizes['gzip, br'][0]:>7,} "
+            f"{100 * (before - best) / before:>6.0f}% "
+            f"{old_us:>8.1f} -> {new_us:>6.1f}"
+        )
+        if sizes["gzip, br"][1] != "br" and functions_main.brotli is not None:
+            print(f"  note: br not applied ({sizes['gzip, br'][1]})")
+
+
+if __name__ == "__main__":
+    main()
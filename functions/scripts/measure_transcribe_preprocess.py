@@ -0,0 +1,119 @@
+"""Compare transcribe_audio with and without audio preprocessing.
+
+For each sample file (default: the repository's test.wav) the script also
+builds browser-like variants with ffmpeg, looped to --seconds: 48 kHz stereo
+WAV and 128 kbit/s Opus WebM. Every variant is sent through ``transcribe_audio``
+against the in-process mock server twice, once as uploaded and once with
+``?preprocess=1``. It reports the bytes that reached the upstream and the
+end-to-end latency. The mock charges --seconds-per-mb to stand in for upload
+and decode time that grows with the body size::
+
+    python scripts/measure_transcribe_preprocess.py --seconds 300 --trim-silence
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_openai import start_mock_server  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _variants(ffmpeg: str, sample: str, seconds: float, workdir: str) -> list[tuple[str, str]]:
+    name = os.path.splitext(os.path.basename(sample))[0]
+    variants = [(os.path.basename(sample), sample)]
+    loop = ["-stream_loop", "-1", "-i", sample, "-t", f"{seconds:g}"]
+    for label, args in (
+        ("48k-stereo.wav", ["-ac", "2", "-ar", "48000", "-c:a", "pcm_s16le"]),
+        ("128k-opus.webm", ["-ac", "2", "-ar", "48000", "-c:a", "libopus", "-b:a", "128k"]),
+    ):
+        path = os.path.join(workdir, f"{name}-{label}")
+        subprocess.run(
+            [ffmpeg, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", *loop, *args, path],
+            check=True,
+        )
+        variants.append((f"{name}-{label}", path))
+    return variants
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--audio", action="append", help="Sample file (repeatable).")
+    parser.add_argument("--seconds", type=float, default=120.0, help="Length of the looped variants.")
+    parser.add_argument("--seconds-per-mb", type=float, default=0.5)
+    parser.add_argument("--trim-silence", action="store_true")
+    parser.add_argument("--ffmpeg", default=os.getenv("FFMPEG_BINARY", "ffmpeg"))
+    args = parser.parse_args()
+
+    ffmpeg = shutil.which(args.ffmpeg)
+    if not ffmpeg:
+        print(f"{args.ffmpeg} not found; preprocessing needs ffmpeg.")
+        return 1
+
+    server = start_mock_server(seconds_per_mb=args.seconds_per_mb)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["OPENAI_TRANSCRIBE_URL"] = f"{base_url}/audio/transcriptions"
+    os.environ["FFMPEG_BINARY"] = ffmpeg
+    os.environ["TRANSCRIBE_TRIM_SILENCE"] = "1" if args.trim_silence else "0"
+    os.environ["TRANSCRIBE_PREPROCESS_MIN_BYTES"] = "0"
+    # Every run must reach the upstream, and short variants stay single requests.
+    os.environ["TRANSCRIBE_CACHE_TTL_SECONDS"] = "0"
+    os.environ["TRANSCRIBE_LONG_AUDIO_SECONDS"] = "0"
+
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    import main as functions_main
+
+    for noisy in ("urllib3", "main"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+    functions_main.get_http_session()
+
+    def transcribe(path: str, preprocess: bool) -> tuple[int, int, float]:
+        with open(path, "rb") as fh:
+            audio = fh.read()
+        request = EnvironBuilder(
+            method="POST",
+            query_string={"preprocess": "1" if preprocess else "0"},
+            data={"file": (io.BytesIO(audio), os.path.basename(path)), "language": "da"},
+        ).get_request(Request)
+        started = time.perf_counter()
+        response = functions_main.transcribe_audio(request)
+        elapsed = time.perf_counter() - started
+        text = json.loads(response.get_data(as_text=True)).get("text") or ""
+        match = re.search(r"\((\d+) bytes\)", text)
+        return response.status_code, int(match.group(1)) if match else -1, elapsed
+
+    samples = args.audio or [os.path.join(REPO_ROOT, "test.wav")]
+    print(f"seconds/MB={args.seconds_per_mb} trimSilence={args.trim_silence} looped={args.seconds:g}s")
+    print(f"{'sample':<28} {'upstream bytes':>24} {'saved':>7} {'latency':>20}")
+    with tempfile.TemporaryDirectory(prefix="preprocess-bench-") as workdir:
+        for sample in samples:
+            for label, path in _variants(ffmpeg, sample, args.seconds, workdir):
+                status_raw, bytes_raw, seconds_raw = transcribe(path, preprocess=False)
+                status_pre, bytes_pre, seconds_pre = transcribe(path, preprocess=True)
+                saved = 100.0 * (bytes_raw - bytes_pre) / bytes_raw if bytes_raw > 0 else 0.0
+                print(
+                    f"{label:<28} {bytes_raw:>11,} -> {bytes_pre:>9,} {saved:>6.0f}% "
+                    f"{seconds_raw * 1000:>8.0f} -> {seconds_pre * 1000:>6.0f}ms"
+                    + ("" if status_raw == status_pre == 200 else f"  status={status_raw}/{status_pre}")
+                )
+
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Measure peak RSS of transcribe_audio for a large synthetic upload.
+
+Feeds a generated multipart body (default 100 MB, never held in memory by the
+script) through ``transcribe_audio`` against the local mock server, once in
+the buffered mode (``req.files``) and once in the streaming pass-through mode.
+Each mode runs in its own process so ``ru_maxrss`` is not shared::
+
+    python scripts/measure_transcribe_rss.py --size-mb 100
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BOUNDARY = "rss-measure-boundary"
+
+
+class _SyntheticMultipart(io.RawIOBase):
+    """Readable multipart body with `size` bytes of audio, generated on the fly."""
+
+    def __init__(self, size: int):
+        self._head = (
+            f"--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="model"\r\n\r\n'
+            "gpt-4o-mini-transcribe\r\n"
+            f"--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="file"; filename="session.wav"\r\n'
+            "Content-Type: audio/wav\r\n\r\n"
+        ).encode()
+        # A field after the audio part exercises the re-framing.
+        self._tail = (
+            f"\r\n--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="language"\r\n\r\n'
+            f"da\r\n--{BOUNDARY}--\r\n"
+        ).encode()
+        self._block = bytes(range(256)) * 256
+        self._size = size
+        self._pos = 0
+        self.length = len(self._head) + size + len(self._tail)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer)
+        written = 0
+        while written < len(view) and self._pos < self.length:
+            pos = self._pos
+            if pos < len(self._head):
+                chunk = self._head[pos:]
+            elif pos < len(self._head) + self._size:
+                offset = pos - len(self._head)
+                remaining = self._size - offset
+                chunk = self._block[offset % len(self._block) :][:remaining]
+            else:
+                chunk = self._tail[pos - len(self._head) - self._size :]
+            n = min(len(chunk), len(view) - written)
+            view[written : written + n] = chunk[:n]
+            written += n
+            self._pos += n
+        return written
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_child(mode: str, size_mb: int) -> None:
+    from mock_openai import start_mock_server
+
+    server = start_mock_server()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["OPENAI_TRANSCRIBE_URL"] = f"{base_url}/audio/transcriptions"
+    os.environ["TRANSCRIBE_STREAMING"] = "1" if mode == "streaming" else "0"
+
+    from flask import Request
+
+    import main as functions_main
+
+    for noisy in ("urllib3", "main"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    body = _SyntheticMultipart(size_mb * 1024 * 1024)
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": "/",
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BufferedReader(body, buffer_size=64 * 1024),
+        "CONTENT_TYPE": f"multipart/form-data; boundary={BOUNDARY}",
+        "CONTENT_LENGTH": str(body.length),
+    }
+    functions_main.get_http_session()
+    baseline = _peak_rss_mb()
+    started = time.perf_counter()
+    response = functions_main.transcribe_audio(Request(environ))
+    elapsed = time.perf_counter() - started
+    peak = _peak_rss_mb()
+    print(
+        json.dumps(
+            {
+                "mode": mode,
+                "status": response.status_code,
+                "body": response.get_data(as_text=True)[:80],
+                "baselineMb": round(baseline, 1),
+                "peakMb": round(peak, 1),
+                "deltaMb": round(peak - baseline, 1),
+                "seconds": round(elapsed, 2),
+            }
+        )
+    )
+    server.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--mode", choices=("buffered", "streaming"), default=None)
+    args = parser.parse_args()
+
+    if args.mode:
+        _run_child(args.mode, args.size_mb)
+        return
+
+    print(f"Synthetic upload: {args.size_mb} MB")
+    for mode in ("buffered", "streaming"):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode, "--size-mb", str(args.size_mb)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{mode:<10} status={result['status']} peak={result['peakMb']:7.1f}MB "
+            f"delta={result['deltaMb']:7.1f}MB time={result['seconds']:.2f}s  {result['body']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Minimal OpenAI-compatible mock server for local benchmarks and emulator runs.
+
+Serves ``POST /v1/chat/completions``, ``POST /v1/embeddings`` and
+``POST /v1/audio/transcriptions`` with canned responses over HTTP/1.1
+keep-alive. Point the functions at it with::
+
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+    OPENAI_TRANSCRIBE_URL=http://127.0.0.1:8765/v1/audio/transcriptions
+
+Faults can be injected to exercise the retry/circuit-breaker layer, e.g.
+``--fail-first 2 --fail-status 429 --retry-after 1`` or ``--fail-rate 0.3``.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _iter_body(handler: BaseHTTPRequestHandler, chunk_size: int = 64 * 1024):
+    if handler.headers.get("Transfer-Encoding", "").lower() == "chunked":
+        while True:
+            size_line = handler.rfile.readline().strip()
+            size = int(size_line.split(b";")[0] or b"0", 16)
+            if size == 0:
+                handler.rfile.readline()
+                return
+            yield handler.rfile.read(size)
+            handler.rfile.readline()
+    remaining = int(handler.headers.get("Content-Length") or 0)
+    while remaining > 0:
+        chunk = handler.rfile.read(min(chunk_size, remaining))
+        if not chunk:
+            return
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _read_body(handler: BaseHTTPRequestHandler) -> bytes:
+    return b"".join(_iter_body(handler))
+
+
+def _drain_body(handler: BaseHTTPRequestHandler) -> int:
+    """Consume the body without holding it in memory; returns its size."""
+    return sum(len(chunk) for chunk in _iter_body(handler))
+
+
+def _chat_payload(request_body: bytes) -> dict:
+    try:
+        body = json.loads(request_body or b"{}")
+    except ValueError:
+        body = {}
+    wants_json = (body.get("response_format") or {}).get("type") == "json_object"
+    content = (
+        json.dumps(
+            {
+                "recommendedIntervalDays": 7,
+                "clinicalRationale": "Mock rationale.",
+                "safetyNote": "",
+                "text": "Mock svar.",
+                "blocks": [],
+            }
+        )
+        if wants_json
+        else "Mock svar."
+    )
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in body.get("messages") or [])
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model") or "gpt-4o-mini",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_chars // 4 + len(content) // 4,
+        },
+    }
+
+
+def _default_faults() -> dict:
+    return {
+        "fail_first": 0,
+        "fail_rate": 0.0,
+        "fail_status": 503,
+        "retry_after": None,
+        "hang_seconds": 0.0,
+    }
+
+
+def _embeddings_payload(request_body: bytes) -> dict:
+    """Deterministic pseudo-embeddings: identical inputs get identical vectors."""
+    try:
+        body = json.loads(request_body or b"{}")
+    except ValueError:
+        body = {}
+    inputs = body.get("input") or []
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dims = int(body.get("dimensions") or 256)
+    data = []
+    for index, text in enumerate(inputs):
+        rng = random.Random(str(text))
+        data.append(
+            {
+                "object": "embedding",
+                "index": index,
+                "embedding": [rng.uniform(-1.0, 1.0) for _ in range(dims)],
+            }
+        )
+    tokens = sum(len(str(text)) // 4 for text in inputs)
+    return {
+        "object": "list",
+        "model": body.get("model") or "text-embedding-3-small",
+        "data": data,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency_seconds = 0.0
+    seconds_per_mb = 0.0
+    faults = _default_faults()
+    stats = {"requests": 0, "connections": 0, "faults": 0}
+    stats_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with self.stats_lock:
+            self.stats["connections"] += 1
+
+    def log_message(self, format, *args):  # noqa: A002 - signature from BaseHTTPRequestHandler
+        return
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _should_fail(self) -> bool:
+        with self.stats_lock:
+            if self.stats["requests"] <= self.faults["fail_first"] or (
+                self.faults["fail_rate"] and random.random() < self.faults["fail_rate"]
+            ):
+                self.stats["faults"] += 1
+                return True
+        return False
+
+    def do_POST(self):  # noqa: N802 - http.server naming
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/audio/transcriptions"):
+            # Uploads can be large; count them instead of buffering.
+            body_size = _drain_body(self)
+            body = b""
+        else:
+            body = _read_body(self)
+            body_size = len(body)
+        with self.stats_lock:
+            self.stats["requests"] += 1
+        if self.faults["hang_seconds"]:
+            time.sleep(self.faults["hang_seconds"])
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if self.seconds_per_mb:
+            # Upstream work that scales with the request size, e.g. audio decoding.
+            time.sleep(self.seconds_per_mb * body_size / (1024 * 1024))
+        if self._should_fail():
+            status = self.faults["fail_status"]
+            headers = {}
+            if self.faults["retry_after"] is not None:
+                headers["Retry-After"] = str(self.faults["retry_after"])
+            self._send_json(
+                status,
+                {"error": {"message": f"Injected fault ({status})", "type": "mock_fault"}},
+                headers,
+            )
+            return
+        if path.endswith("/chat/completions"):
+            self._send_json(200, _chat_payload(body))
+            return
+        if path.endswith("/embeddings"):
+            self._send_json(200, _embeddings_payload(body))
+            return
+        if path.endswith("/audio/transcriptions"):
+            self._send_json(200, {"text": f"Mock transcript ({body_size} bytes)."})
+            return
+        self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+
+
+def start_mock_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency_seconds: float = 0.0,
+    seconds_per_mb: float = 0.0,
+    **faults,
+) -> ThreadingHTTPServer:
+    """Start the mock server on a background thread and return it.
+
+    Keyword arguments are fault settings, see ``configure_faults``.
+    """
+    handler = type(
+        "ConfiguredMockOpenAIHandler",
+        (MockOpenAIHandler,),
+        {
+            "latency_seconds": latency_seconds,
+            "seconds_per_mb": seconds_per_mb,
+            "faults": _default_faults(),
+            "stats": {"requests": 0, "connections": 0, "faults": 0},
+            "stats_lock": threading.Lock(),
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    configure_faults(server, **faults)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def configure_faults(server: ThreadingHTTPServer, **faults) -> None:
+    """Replace the server's fault settings and reset its counters.
+
+    Settings: ``fail_first`` (fail the first N requests), ``fail_rate`` (0-1),
+    ``fail_status`` (default 503), ``retry_after`` (seconds header on faults)
+    and ``hang_seconds`` (delay before every response).
+    """
+    handler = server.RequestHandlerClass
+    unknown = set(faults) - set(_default_faults())
+    if unknown:
+        raise ValueError(f"Unknown fault settings: {sorted(unknown)}")
+    with handler.stats_lock:
+        handler.faults = {**_default_faults(), **faults}
+        handler.stats.update(requests=0, faults=0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to sleep per request.")
+    parser.add_argument(
+        "--seconds-per-mb", type=float, default=0.0, help="Extra seconds per MB of request body."
+    )
+    parser.add_argument("--fail-first", type=int, default=0, help="Fail the first N requests.")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests to fail.")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After on faults.")
+    parser.add_argument("--hang", type=float, default=0.0, help="Seconds to stall every response.")
+    args = parser.parse_args()
+    server = start_mock_server(
+        args.host,
+        args.port,
+        args.latency,
+        args.seconds_per_mb,
+        fail_first=args.fail_first,
+        fail_rate=args.fail_rate,
+        fail_status=args.fail_status,
+        retry_after=args.retry_after,
+        hang_seconds=args.hang,
+    )
+    print(f"Mock OpenAI server listening on http://{args.host}:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
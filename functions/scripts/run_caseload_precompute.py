@@ -0,0 +1,72 @@
+"""Run the caseload summary job against the Firestore emulator and the mock model.
+
+Start the emulator first (``firebase emulators:start --only firestore``), then::
+
+    python scripts/run_caseload_precompute.py --seed
+
+--seed writes one owner with a client, two journal entries and an appointment
+tomorrow, so the job has something to do. The mock model endpoint is started
+in-process.
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_openai import start_mock_server  # noqa: E402
+
+
+def _seed(functions_main) -> None:
+    db = functions_main.get_db()
+    tzinfo = functions_main.ZoneInfo(functions_main.WORK_HOURS_TIMEZONE)
+    owner = db.collection("users").document("emulator-owner")
+    owner.set({"email": "owner@example.com"})
+    client = owner.collection("clients").document("emulator-client")
+    client.set({"navn": "Test Klient"})
+    for day, note in ((3, "Akutte lændesmerter efter løft."), (1, "Bedring, øger belastning.")):
+        created = datetime.now(tzinfo) - timedelta(days=day)
+        client.collection("journalEntries").document(f"entry-{day}").set(
+            {"title": "Konsultation", "content": note, "createdAt": created}
+        )
+    start = (datetime.now(tzinfo) + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+    owner.collection("appointments").document("emulator-appointment").set(
+        {
+            "clientId": "emulator-client",
+            "start": functions_main._to_utc_iso(start),
+            "end": functions_main._to_utc_iso(start + timedelta(hours=1)),
+        }
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emulator-host", default=os.getenv("FIRESTORE_EMULATOR_HOST", "127.0.0.1:7701"))
+    parser.add_argument("--project", default=os.getenv("GCLOUD_PROJECT", "actualbackend-3b454"))
+    parser.add_argument("--seed", action="store_true", help="Seed one appointment tomorrow first.")
+    args = parser.parse_args()
+
+    server = start_mock_server()
+    os.environ["FIRESTORE_EMULATOR_HOST"] = args.emulator_host
+    os.environ["GCLOUD_PROJECT"] = args.project
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+
+    import main as functions_main
+
+    if args.seed:
+        _seed(functions_main)
+
+    stats = functions_main._precompute_caseload_summaries()
+    print("stats:", stats)
+    print("model calls:", server.RequestHandlerClass.stats["requests"])
+    if args.seed:
+        stored = functions_main._journal_summary_ref("emulator-owner", "emulator-client").get()
+        print("stored summary:", stored.to_dict() if stored.exists else None)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Hammer the HTTP handlers from many threads, as an instance with concurrency > 1 does.
+
+First every lazy initialiser (Firebase app, Firestore, OpenAI client, HTTP
+session, I/O pool, tokenizer) is called from all threads at once. Each must
+hand every thread the same object. Then a mix of requests is replayed against
+the handlers from --threads threads and once from a single thread, with the
+in-process mock model adding --latency. The script checks every status code
+and compares throughput::
+
+    python scripts/stress_concurrency.py --threads 32 --requests 400
+
+Without emulators the mix is openai_completion and transcribe_audio. With
+--emulators it seeds a public clinic in the Firestore emulator and adds
+publicGetAvailability, getClinicServicesPublic and agent_chat, using a token
+from the Auth emulator. Start them first with
+``firebase emulators:start --only auth,firestore``. Exits 1 on any failure.
+"""
+
+import argparse
+import io
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_openai import start_mock_server  # noqa: E402
+
+CLINIC_SLUG = "stress-clinic"
+OWNER_UID = "stress-owner"
+SERVICE_ID = "stress-service"
+
+
+def _race_initialisers(functions_main, threads: int, with_db: bool) -> list[str]:
+    """Call each initialiser from all threads behind a barrier; returns problems."""
+    initialisers = {
+        "ensure_firebase_app": functions_main.ensure_firebase_app,
+        "get_openai_client": functions_main.get_openai_client,
+        "get_http_session": functions_main.get_http_session,
+        "get_io_executor": functions_main.get_io_executor,
+        "_get_tokenizer": functions_main._get_tokenizer,
+    }
+    if with_db:
+        initialisers["get_db"] = functions_main.get_db
+    problems = []
+    for name, fn in initialisers.items():
+        barrier = threading.Barrier(threads)
+
+        def call(_):
+            barrier.wait()
+            return id(fn())
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            try:
+                ids = set(pool.map(call, range(threads)))
+            except Exception as exc:
+                problems.append(f"{name} raised {exc!r}")
+                continue
+        if len(ids) != 1:
+            problems.append(f"{name} returned {len(ids)} different objects")
+    return problems
+
+
+def _seed(functions_main) -> None:
+    db = functions_main.get_db()
+    db.collection("publicClinics").document(CLINIC_SLUG).set(
+        {"isActive": True, "ownerUid": OWNER_UID, "slotMinutes": 15, "name": "Stress Klinik"}
+    )
+    owner = db.collection("users").document(OWNER_UID)
+    owner.collection("services").document(SERVICE_ID).set(
+        {"navn": "Konsultation", "duration": 30, "isActive": True}
+    )
+    owner.collection("team").document(OWNER_UID).set({"name": "Test Behandler", "uid": OWNER_UID})
+
+
+def _emulator_id_token(auth_host: str) -> str:
+    import requests
+
+    response = requests.post(
+        f"http://{auth_host}/identitytoolkit.googleapis.com/v1/accounts:signUp?key=emulator",
+        json={"returnSecureToken": True},
+        timeout=10,
+    )
+    response.raise_for_status()
+    return response.json()["idToken"]
+
+
+def _request_mix(emulators: bool, token: str | None) -> list[tuple[str, dict, set[int]]]:
+    """(handler name, EnvironBuilder kwargs, accepted statuses)."""
+    mix = [
+        ("openai_completion", {"method": "POST", "json": {"userprompt": "ping"}}, {200}),
+        ("openai_completion", {"method": "POST", "json": {"userprompt": None}}, {200}),
+        ("transcribe_audio", {"method": "POST", "data": None}, {200}),
+    ]
+    if emulators:
+        tomorrow = time.strftime("%Y-%m-%d", time.localtime(time.time() + 86400))
+        mix += [
+            (
+                "publicGetAvailability",
+                {
+                    "method": "GET",
+                    "query_string": {
+                        "clinicSlug": CLINIC_SLUG,
+                        "staffUid": OWNER_UID,
+                        "serviceId": SERVICE_ID,
+                        "dateIso": tomorrow,
+                    },
+                },
+                {200},
+            ),
+            ("getClinicServicesPublic", {"method": "GET", "query_string": {"clinicSlug": CLINIC_SLUG}}, {200}),
+            (
+                "agent_chat",
+                {
+                    "method": "POST",
+                    "headers": {"Authorization": f"Bearer {token}"},
+                    "json": {"agentId": "reasoner", "clientId": "stress-client", "message": None},
+                },
+                {200},
+            ),
+        ]
+    return mix
+
+
+def _run(functions_main, mix, requests_total: int, threads: int, seed: int) -> tuple[float, Counter, list[str]]:
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    rng = random.Random(seed)
+    plan = [rng.choice(mix) for _ in range(requests_total)]
+
+    def one(index: int) -> tuple[str, int | None, str | None]:
+        name, kwargs, accepted = plan[index]
+        kwargs = dict(kwargs)
+        if "json" in kwargs:
+            body = dict(kwargs["json"])
+            for key, value in body.items():
+                if value is None:
+                    # Distinct prompts, so requests are not coalesced or cached.
+                    body[key] = f"stress {index} {rng.random()}"
+            kwargs["json"] = body
+        if name == "transcribe_audio":
+            kwargs["data"] = {"file": (io.BytesIO(os.urandom(8192)), "stress.webm"), "language": "da"}
+        try:
+            response = getattr(functions_main, name)(EnvironBuilder(**kwargs).get_request(Request))
+        except Exception as exc:
+            return name, None, repr(exc)
+        if response.status_code not in accepted:
+            return name, response.status_code, response.get_data(as_text=True)[:200]
+        return name, response.status_code, None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(one, range(requests_total)))
+    elapsed = time.perf_counter() - started
+    statuses = Counter(f"{name} {status}" for name, status, _ in results)
+    errors = [f"{name} -> {status}: {detail}" for name, status, detail in results if detail]
+    return elapsed, statuses, errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock model seconds per call.")
+    parser.add_argument("--emulators", action="store_true", help="Also hit Firestore-backed endpoints.")
+    parser.add_argument("--firestore-host", default=os.getenv("FIRESTORE_EMULATOR_HOST", "127.0.0.1:7701"))
+    parser.add_argument("--auth-host", default=os.getenv("FIREBASE_AUTH_EMULATOR_HOST", "127.0.0.1:9099"))
+    parser.add_argument("--project", default=os.getenv("GCLOUD_PROJECT", "actualbackend-3b454"))
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    server = start_mock_server(latency_seconds=args.latency)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_TRANSCRIBE_URL"] = f"{base_url}/audio/transcriptions"
+    os.environ["HTTP_POOL_MAXSIZE"] = str(max(args.threads, 1))
+    if args.emulators:
+        os.environ["FIRESTORE_EMULATOR_HOST"] = args.firestore_host
+        os.environ["FIREBASE_AUTH_EMULATOR_HOST"] = args.auth_host
+        os.environ["GCLOUD_PROJECT"] = args.project
+
+    import main as functions_main
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    problems = _race_initialisers(functions_main, args.threads, with_db=args.emulators)
+    print(f"initialiser race ({args.threads} threads): {'ok' if not problems else 'FAILED'}")
+    for problem in problems:
+        print(f"  {problem}")
+
+    token = None
+    if args.emulators:
+        _seed(functions_main)
+        token = _emulator_id_token(args.auth_host)
+    mix = _request_mix(args.emulators, token)
+
+    serial_count = max(args.requests // max(args.threads, 1), len(mix))
+    serial, _, serial_errors = _run(functions_main, mix, serial_count, 1, args.seed)
+    elapsed, statuses, errors = _run(functions_main, mix, args.requests, args.threads, args.seed)
+    errors = serial_errors + errors
+
+    print(f"\n{args.requests} requests from {args.threads} threads in {elapsed:.2f}s")
+    for key, count in sorted(statuses.items()):
+        print(f"  {key:<32} {count:>6}")
+    concurrent_rps = args.requests / elapsed
+    serial_rps = serial_count / serial
+    print(
+        f"throughput: {concurrent_rps:.1f} req/s vs {serial_rps:.1f} req/s from one thread "
+        f"({concurrent_rps / serial_rps:.1f}x)"
+    )
+    print(f"transcript cache: {functions_main._transcript_cache.stats()}")
+    print(f"coalesced chat calls: {functions_main._chat_singleflight.coalesced}")
+    if errors:
+        print(f"\n{len(errors)} failed requests, first few:")
+        for error in errors[:10]:
+            print(f"  {error}")
+
+    server.shutdown()
+    return 1 if problems or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())